@@ -1,4 +1,61 @@
-from .core import encode, decode
-from .streams import open, EncodedFile
+import importlib
+import sys
 
-__all__ = ['encode', 'decode', 'open', 'EncodedFile']
+from .core import (encode, decode, decompressed_size, estimate_ratio,
+                   memory_for, Params)
+
+# Attributes that are imported from their module when first used, so
+# that importing the package for encode/decode stays fast.
+_LAZY_ATTRIBUTES = {
+    'open': 'streams',
+    'EncodedFile': 'streams',
+    'FORMAT_RAW': 'framing',
+    'FORMAT_FRAMED': 'framing',
+    'FLUSH_SYNC': 'framing',
+    'FLUSH_FULL': 'framing',
+    'STORE_NEVER': 'framing',
+    'STORE_IF_LARGER': 'framing',
+    'STORE_AUTO': 'framing',
+    'LEVEL_DEFAULT': 'framing',
+    'LEVEL_MAX': 'framing',
+    'BlockCache': 'cache',
+    'open_shared': 'shared',
+    'EncodedSocket': 'transport',
+    'EncodedProtocol': 'transport',
+    'grep': 'search',
+    'GrepMatch': 'search',
+    'map_encode': 'parallel',
+    'map_decode': 'parallel',
+}
+
+__all__ = ['encode', 'decode', 'decompressed_size', 'estimate_ratio',
+           'memory_for', 'open',
+           'EncodedFile', 'FORMAT_RAW', 'FORMAT_FRAMED', 'FLUSH_SYNC',
+           'FLUSH_FULL', 'STORE_NEVER', 'STORE_IF_LARGER', 'STORE_AUTO',
+           'LEVEL_DEFAULT', 'LEVEL_MAX', 'BlockCache', 'open_shared',
+           'Params', 'EncodedSocket', 'EncodedProtocol', 'grep', 'GrepMatch',
+           'map_encode', 'map_decode']
+
+
+def __getattr__(name):
+    try:
+        module = _LAZY_ATTRIBUTES[name]
+    except KeyError:
+        msg = 'module {!r} has no attribute {!r}'
+        raise AttributeError(msg.format(__name__, name))
+
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    # Later lookups don't go through __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
+
+
+if sys.version_info < (3, 7):
+    # Module __getattr__ isn't supported, import everything up front
+    for _name in _LAZY_ATTRIBUTES:
+        __getattr__(_name)
+    del _name
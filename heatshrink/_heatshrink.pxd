@@ -1,4 +1,4 @@
-from libc.stdint cimport uint8_t, uint16_t
+from libc.stdint cimport int16_t, uint8_t, uint16_t
 
 
 cdef extern from "_heatshrink/heatshrink_common.h":
@@ -9,9 +9,25 @@ cdef extern from "_heatshrink/heatshrink_common.h":
 
 
 cdef extern from "_heatshrink/heatshrink_encoder.h":
+    cdef struct hs_index:
+        uint16_t size
+        int16_t *index
+
     ctypedef struct heatshrink_encoder:
+        uint16_t input_size
+        uint16_t match_scan_index
+        uint16_t match_length
+        uint16_t match_pos
+        uint16_t outgoing_bits
+        uint8_t outgoing_bits_count
+        uint8_t flags
+        uint8_t state
+        uint8_t current_byte
+        uint8_t bit_index
         uint8_t window_sz2
         uint8_t lookahead_sz2
+        hs_index *search_index
+        uint8_t *buffer
 
     ctypedef enum HSE_sink_res:
         HSER_SINK_OK,
@@ -44,8 +60,18 @@ cdef extern from "_heatshrink/heatshrink_encoder.h":
 
 cdef extern from "_heatshrink/heatshrink_decoder.h":
     ctypedef struct heatshrink_decoder:
+        uint16_t input_size
+        uint16_t input_index
+        uint16_t output_count
+        uint16_t output_index
+        uint16_t head_index
+        uint8_t state
+        uint8_t current_byte
+        uint8_t bit_index
         uint8_t window_sz2
         uint8_t lookahead_sz2
+        uint16_t input_buffer_size
+        uint8_t *buffers
 
     ctypedef enum HSD_sink_res:
         HSDR_SINK_OK,
@@ -0,0 +1,130 @@
+"""In-memory cache of decoded data, shared by EncodedFile readers.
+
+Seeking backwards in a heatshrink stream means decoding it again from
+the beginning. A BlockCache keeps recently decoded blocks around, so
+that regions that are read repeatedly are served without decoding:
+
+    >>> cache = heatshrink.BlockCache(max_size=64 << 20)
+    >>> with heatshrink.open('data.hs', cache=cache) as fp:
+    ...     fp.seek(1000000)
+    ...     data = fp.read(100)
+
+The same cache can be passed to any number of files, blocks are keyed
+by the identity of the file they were read from. Only files with a
+file descriptor (see os.fstat) are cached.
+"""
+from __future__ import absolute_import
+import collections
+import hashlib
+import os
+from threading import Lock
+
+# Default limit on the total size of the cached blocks
+DEFAULT_CACHE_SIZE = 64 << 20
+# Default size of the blocks that raw streams are cached in
+DEFAULT_BLOCK_SIZE = 64 << 10
+
+CacheStats = collections.namedtuple('CacheStats', [
+    'hits', 'misses', 'evictions',
+    # Number of cached blocks and their total size
+    'count', 'size',
+])
+
+
+def file_key(fp):
+    """Return a key identifying the contents of file object fp.
+
+    The key changes when the file is modified. Returns None if fp has
+    no file descriptor.
+    """
+    try:
+        st = os.fstat(fp.fileno())
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+
+
+def window_key(window):
+    """Return a key identifying the preset window of a decoder.
+
+    Data decoded with different windows differs, so the window is part
+    of the key of anything decoded. Returns None without a window.
+    """
+    if window is None:
+        return None
+    return hashlib.sha256(bytes(bytearray(window))).hexdigest()
+
+
+class BlockCache(object):
+    """Least recently used cache of decoded blocks.
+
+    max_size limits the total size of the cached blocks in bytes and
+    block_size is the size of the blocks raw streams are decoded in.
+    Framed streams are cached a member at a time.
+
+    All methods are thread safe.
+    """
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE,
+                 block_size=DEFAULT_BLOCK_SIZE):
+        if max_size < 0:
+            raise ValueError('max_size must be >= 0')
+        if block_size < 1:
+            raise ValueError('block_size must be >= 1')
+
+        self.max_size = max_size
+        self.block_size = block_size
+
+        self._lock = Lock()
+        # Least recently used blocks first
+        self._blocks = collections.OrderedDict()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def get(self, key):
+        """Return the block cached for key, or None."""
+        with self._lock:
+            data = self._blocks.pop(key, None)
+            if data is None:
+                self._misses += 1
+                return None
+
+            # Mark as most recently used
+            self._blocks[key] = data
+            self._hits += 1
+            return data
+
+    def put(self, key, data):
+        """Cache data for key, evicting the least recently used blocks."""
+        if len(data) > self.max_size:
+            return
+
+        with self._lock:
+            old = self._blocks.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+
+            self._blocks[key] = data
+            self._size += len(data)
+
+            while self._size > self.max_size:
+                _, evicted = self._blocks.popitem(last=False)
+                self._size -= len(evicted)
+                self._evictions += 1
+
+    def clear(self):
+        """Remove all cached blocks. The statistics are kept."""
+        with self._lock:
+            self._blocks.clear()
+            self._size = 0
+
+    @property
+    def stats(self):
+        """Current CacheStats of the cache."""
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions,
+                              len(self._blocks), self._size)
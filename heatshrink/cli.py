@@ -0,0 +1,346 @@
+"""Command line interface to heatshrink.
+
+Run with ``python -m heatshrink``. Files are streamed through the
+package encoders in large buffered chunks and, when more than one job
+is requested, processed concurrently on a pool of worker processes.
+"""
+from __future__ import absolute_import, division, print_function
+import argparse
+import collections
+import multiprocessing
+import os
+import sys
+import time
+
+import heatshrink.core as core
+import heatshrink.streams as streams
+
+# Size of the chunks copied between files. Large chunks keep the
+# number of system and encoder calls low.
+_CHUNK_SIZE = 1 << 20
+
+DEFAULT_SUFFIX = '.hs'
+
+# File name used for the standard input/output streams
+_STDIO = '-'
+
+_PY3 = sys.version_info[0] == 3
+
+# Short command names, only supported by Python 3 argparse
+_ALIASES = {'c': 'compress', 'd': 'decompress', 't': 'test', 'l': 'list'}
+
+_Result = collections.namedtuple(
+    '_Result', ['name', 'in_size', 'out_size', 'elapsed', 'error'])
+
+
+class _CountingFile(object):
+    """Wraps a file object, counting the bytes read or written."""
+    def __init__(self, fp):
+        self._fp = fp
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self._fp.read(size)
+        self.count += len(data)
+        return data
+
+    def write(self, data):
+        self._fp.write(data)
+        self.count += len(data)
+        return len(data)
+
+
+class _NullFile(object):
+    """Write only file object that discards all data."""
+    def write(self, data):
+        return len(data)
+
+
+def _binary_stream(stream):
+    """Return the binary buffer of a standard stream."""
+    # Python 3 text streams wrap a binary buffer
+    return getattr(stream, 'buffer', stream)
+
+
+def _copy(src, dst):
+    """Copy all data from file object src to dst."""
+    while True:
+        chunk = src.read(_CHUNK_SIZE)
+        if not chunk:
+            break
+        dst.write(chunk)
+
+
+def _transform(command, src, dst, params):
+    """Run command on data read from src, writing the result to dst.
+
+    Returns a tuple of the number of bytes read and written.
+    """
+    src = _CountingFile(src)
+    dst = _CountingFile(dst)
+
+    if command == 'compress':
+        with streams.EncodedFile(dst, 'wb', **params) as fp:
+            _copy(src, fp)
+    else:
+        with streams.EncodedFile(src, 'rb', **params) as fp:
+            _copy(fp, dst)
+
+    return src.count, dst.count
+
+
+def _output_name(command, name, suffix):
+    """Return the name of the file that command writes for name."""
+    if command == 'compress':
+        return name + suffix
+
+    if not name.endswith(suffix) or name == suffix:
+        raise ValueError('unknown suffix, expected {!r}'.format(suffix))
+    return name[:-len(suffix)]
+
+
+def _process_stdio(command, options):
+    src = _binary_stream(sys.stdin)
+    dst = _binary_stream(sys.stdout)
+    if command in ('test', 'list'):
+        dst = _NullFile()
+
+    try:
+        return _transform(command, src, dst, options['params'])
+    finally:
+        if hasattr(dst, 'flush'):
+            dst.flush()
+
+
+def _process_path(command, name, options):
+    params = options['params']
+
+    if command in ('test', 'list'):
+        with open(name, 'rb', _CHUNK_SIZE) as src:
+            return _transform(command, src, _NullFile(), params)
+
+    if options['stdout']:
+        dst = _binary_stream(sys.stdout)
+        with open(name, 'rb', _CHUNK_SIZE) as src:
+            sizes = _transform(command, src, dst, params)
+        dst.flush()
+        return sizes
+
+    out_name = _output_name(command, name, options['suffix'])
+    if os.path.exists(out_name) and not options['force']:
+        raise IOError('{} already exists'.format(out_name))
+
+    try:
+        with open(name, 'rb', _CHUNK_SIZE) as src:
+            with open(out_name, 'wb', _CHUNK_SIZE) as dst:
+                sizes = _transform(command, src, dst, params)
+    except BaseException:
+        # Don't leave partial output behind
+        if os.path.exists(out_name):
+            os.unlink(out_name)
+        raise
+
+    if not options['keep']:
+        os.unlink(name)
+    return sizes
+
+
+def _run_task(task):
+    """Run a command on a single file, returning a _Result.
+
+    This is the function that is run in the worker processes, so
+    errors are returned rather than raised.
+    """
+    command, name, options = task
+    initial = time.time()
+    try:
+        if name == _STDIO:
+            in_size, out_size = _process_stdio(command, options)
+        else:
+            in_size, out_size = _process_path(command, name, options)
+    except (IOError, OSError, ValueError, RuntimeError) as e:
+        return _Result(name, 0, 0, time.time() - initial, str(e))
+    return _Result(name, in_size, out_size, time.time() - initial, None)
+
+
+def _run_tasks(tasks, jobs):
+    """Yield the results of tasks, in order, using `jobs` processes."""
+    if jobs == 1 or len(tasks) == 1:
+        for task in tasks:
+            yield _run_task(task)
+        return
+
+    pool = multiprocessing.Pool(min(jobs, len(tasks)))
+    try:
+        for result in pool.imap(_run_task, tasks):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _ratio(compressed, uncompressed):
+    """Return the space saving of compressed data as a percentage."""
+    if not uncompressed:
+        return 0.0
+    return 100.0 * (1 - compressed / uncompressed)
+
+
+def _throughput(size, elapsed):
+    """Return a human readable rate for size bytes in elapsed seconds."""
+    if elapsed <= 0:
+        return '-- MB/s'
+    return '{:.1f} MB/s'.format(size / elapsed / (1 << 20))
+
+
+def _sizes(command, result):
+    """Return the compressed and uncompressed sizes of a task result."""
+    if command == 'compress':
+        return result.out_size, result.in_size
+    return result.in_size, result.out_size
+
+
+def _report(command, result, out):
+    """Print a verbose report of a task result to out."""
+    compressed, plain = _sizes(command, result)
+
+    status = 'OK' if command == 'test' else '{:.1f}%'.format(
+        _ratio(compressed, plain))
+    print('{}: {} -- {} in {:.3f}s ({})'.format(
+        result.name, status, plain, result.elapsed,
+        _throughput(plain, result.elapsed)), file=out)
+
+
+def _list(results, out):
+    """Print the list command table for results to out."""
+    row = '{:>14} {:>14} {:>6.1f}% {}'
+    print('{:>14} {:>14} {:>7} {}'.format(
+        'compressed', 'uncompressed', 'ratio', 'name'), file=out)
+
+    for result in results:
+        print(row.format(result.in_size, result.out_size,
+                         _ratio(result.in_size, result.out_size),
+                         result.name), file=out)
+
+    if len(results) > 1:
+        compressed = sum(r.in_size for r in results)
+        plain = sum(r.out_size for r in results)
+        print(row.format(compressed, plain, _ratio(compressed, plain),
+                         '(totals)'), file=out)
+
+
+def _aliases(*names):
+    """Return the add_parser arguments for command aliases, which
+    Python 2 doesn't support."""
+    return {'aliases': list(names)} if _PY3 else {}
+
+
+def _parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('files', nargs='*', metavar='FILE',
+                        help='files to process, "-" or none for stdin')
+    common.add_argument('-w', '--window-sz2', type=int,
+                        default=core.DEFAULT_WINDOW_SZ2,
+                        help='window size as a power of 2 (default: %(default)s)')
+    common.add_argument('-l', '--lookahead-sz2', type=int,
+                        default=core.DEFAULT_LOOKAHEAD_SZ2,
+                        help='lookahead size as a power of 2 (default: %(default)s)')
+    common.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes, 0 for one per CPU '
+                             '(default: %(default)s)')
+    common.add_argument('-v', '--verbose', action='store_true',
+                        help='report ratio and throughput per file')
+
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument('-c', '--stdout', action='store_true',
+                        help='write to standard output, keep input files')
+    output.add_argument('-k', '--keep', action='store_true',
+                        help='keep input files')
+    output.add_argument('-f', '--force', action='store_true',
+                        help='overwrite existing output files')
+    output.add_argument('-S', '--suffix', default=DEFAULT_SUFFIX,
+                        help='suffix of compressed files (default: %(default)s)')
+
+    parser = argparse.ArgumentParser(
+        prog='python -m heatshrink',
+        description='Compress or decompress files with heatshrink LZSS.')
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.required = True
+
+    commands.add_parser('compress', parents=[common, output],
+                        help='compress files', **_aliases('c'))
+    commands.add_parser('decompress', parents=[common, output],
+                        help='decompress files', **_aliases('d'))
+    commands.add_parser('test', parents=[common],
+                        help='check that files decompress', **_aliases('t'))
+    commands.add_parser('list', parents=[common],
+                        help='list compression ratios', **_aliases('l'))
+    return parser
+
+
+def main(argv=None):
+    """Run the command line interface, returning the exit status."""
+    parser = _parser()
+    args = parser.parse_args(argv)
+    command = _ALIASES.get(args.command, args.command)
+
+    files = args.files or [_STDIO]
+    if files.count(_STDIO) > 1:
+        parser.error('standard input can only be used once')
+
+    to_stdout = getattr(args, 'stdout', False)
+    if command == 'compress' and to_stdout and len(files) > 1:
+        # Concatenated streams can't be told apart when decoding
+        parser.error('cannot compress more than one file to standard output')
+
+    options = {
+        'params': {
+            'window_sz2': args.window_sz2,
+            'lookahead_sz2': args.lookahead_sz2,
+        },
+        'stdout': to_stdout,
+        'keep': getattr(args, 'keep', True) or to_stdout,
+        'force': getattr(args, 'force', False),
+        'suffix': getattr(args, 'suffix', DEFAULT_SUFFIX),
+    }
+
+    # Validate parameters before any file is touched. The encoder
+    # supports fewer windows than the decoder.
+    coder = core.Writer if command == 'compress' else core.Reader
+    try:
+        coder(**options['params'])
+    except (TypeError, ValueError, MemoryError) as e:
+        parser.error('invalid compression parameters: {}'.format(e))
+
+    jobs = args.jobs if args.jobs > 0 else multiprocessing.cpu_count()
+    if to_stdout or _STDIO in files:
+        # Output has to be written from this process
+        jobs = 1
+
+    tasks = [(command, name, options) for name in files]
+    results = []
+    status = 0
+    initial = time.time()
+
+    for result in _run_tasks(tasks, jobs):
+        if result.error is not None:
+            print('{}: {}'.format(result.name, result.error), file=sys.stderr)
+            status = 1
+            continue
+
+        results.append(result)
+        if args.verbose:
+            _report(command, result, sys.stderr)
+
+    if command == 'list':
+        _list(results, sys.stdout)
+
+    if args.verbose and len(results) > 1:
+        total = sum(_sizes(command, r)[1] for r in results)
+        elapsed = time.time() - initial
+        print('Total: {} files, {} bytes in {:.3f}s ({})'.format(
+            len(results), total, elapsed, _throughput(total, elapsed)),
+            file=sys.stderr)
+
+    return status
@@ -1,7 +1,12 @@
 import array
-import numbers
+import collections
+import struct
+cimport cython
 from cpython cimport array
-from libc.stdint cimport uint8_t
+from cpython.bytes cimport PyBytes_FromStringAndSize
+from libc.stdint cimport uint8_t, uint16_t, uint32_t, uint64_t
+from libc.stdlib cimport free, malloc, realloc
+from libc.string cimport memcpy, memset
 
 cimport _heatshrink
 
@@ -9,11 +14,55 @@ cimport _heatshrink
 MIN_WINDOW_SZ2 = _heatshrink.HEATSHRINK_MIN_WINDOW_BITS
 MAX_WINDOW_SZ2 = _heatshrink.HEATSHRINK_MAX_WINDOW_BITS
 DEFAULT_WINDOW_SZ2 = 11
+# The C encoder's 16 bit buffer offsets overflow with the largest
+# window, which corrupts its output. encode has no such limit.
+MAX_WRITER_WINDOW_SZ2 = MAX_WINDOW_SZ2 - 1
 
 MIN_LOOKAHEAD_SZ2 = _heatshrink.HEATSHRINK_MIN_LOOKAHEAD_BITS
 DEFAULT_LOOKAHEAD_SZ2 = 4
 
 DEFAULT_INPUT_BUFFER_SIZE = 2048
+# The decoder keeps the input buffer size in 16 bits
+MAX_INPUT_BUFFER_SIZE = 0xFFFF
+
+# Size of the chunks read by decompressed_size from file objects
+_SIZE_CHUNK_SIZE = 1 << 16
+
+# Initial output capacity of one-shot decoding, as a multiple of the
+# input size. Grows as needed.
+cdef size_t _DECODE_GROWTH = 4
+
+# Initial states of the encoder and decoder state machines
+cdef enum:
+    _HSES_NOT_FULL = 0
+    _HSDS_TAG_BIT = 0
+    # Number of states of the state machines
+    _HSES_STATES = 10
+    _HSDS_STATES = 7
+
+# Snapshot formats, see the snapshot methods and restore
+_SNAPSHOT_VERSION = 1
+_WRITER_MAGIC = b'HSWS'
+_READER_MAGIC = b'HSRS'
+_ENCODER_MAGIC = b'HSES'
+# magic, version, window_sz2, lookahead_sz2, state, flags, current_byte,
+# bit_index, outgoing_bits_count, input_size, match_scan_index,
+# match_length, match_pos, outgoing_bits
+_WRITER_SNAPSHOT = struct.Struct('<4sBBBBBBBBHHHHH')
+# magic, version, window_sz2, lookahead_sz2, state, current_byte,
+# bit_index, input_buffer_size, size of the pending input, output_count,
+# output_index, head_index
+_READER_SNAPSHOT = struct.Struct('<4sBBBBBBHHHHH')
+# magic, version, flags, size of the Writer or Reader snapshot
+_ENCODER_SNAPSHOT = struct.Struct('<4sBBI')
+_ENCODER_FINISHED = 0x01
+_ENCODER_PENDING_OUTPUT = 0x02
+
+
+def _is_number(val, integral=False):
+    """Return whether `val` is a (integral) number of any type."""
+    import numbers
+    return isinstance(val, numbers.Integral if integral else numbers.Number)
 
 
 def _validate_bounds(val, name, min=None, max=None):
@@ -27,7 +76,9 @@ def _validate_bounds(val, name, min=None, max=None):
     if min is None and max is None:
         raise ValueError("Expecting either a min or max parameter")
 
-    if not isinstance(val, numbers.Number):
+    # Check the common types first, the abstract base class is slow
+    # to check and to import.
+    if not isinstance(val, (int, float)) and not _is_number(val):
         msg = 'Expected number, got {}'
         raise TypeError(msg.format(val.__class__.__name__))
 
@@ -43,31 +94,297 @@ def _validate_bounds(val, name, min=None, max=None):
     return val
 
 
-cdef class Writer:
-    """Thin wrapper around heatshrink_encoder"""
-    cdef _heatshrink.heatshrink_encoder *_hse
+def _check_max_output_size(max_output_size):
+    """Ensure that `max_output_size` is a valid output limit."""
+    if (not isinstance(max_output_size, int) and
+            not _is_number(max_output_size, integral=True)):
+        msg = 'Expected integer, got {}'
+        raise TypeError(msg.format(max_output_size.__class__.__name__))
+
+    if max_output_size < 0:
+        raise ValueError('max_output_size must be >= 0')
+    return max_output_size
 
-    def __cinit__(self, **kwargs):
-        window_sz2 = kwargs.get('window_sz2', DEFAULT_WINDOW_SZ2)
-        lookahead_sz2 = kwargs.get('lookahead_sz2', DEFAULT_LOOKAHEAD_SZ2)
 
+cdef class Params:
+    """Validated window and lookahead sizes.
+
+    Parameters are checked once, when created. A Params object can be
+    passed as `params` to encode, decode, Writer and Reader instead of
+    `window_sz2` and `lookahead_sz2`, which skips validating them again.
+    """
+    cdef readonly int window_sz2
+    cdef readonly int lookahead_sz2
+
+    def __cinit__(self, window_sz2=DEFAULT_WINDOW_SZ2,
+                  lookahead_sz2=DEFAULT_LOOKAHEAD_SZ2):
         _validate_bounds(window_sz2, name='window_sz2',
                          min=MIN_WINDOW_SZ2, max=MAX_WINDOW_SZ2)
         _validate_bounds(lookahead_sz2, name='lookahead_sz2',
                          min=MIN_LOOKAHEAD_SZ2, max=window_sz2)
 
-        self._hse = _heatshrink.heatshrink_encoder_alloc(window_sz2, lookahead_sz2)
+        self.window_sz2 = window_sz2
+        self.lookahead_sz2 = lookahead_sz2
+
+    def __repr__(self):
+        return 'Params(window_sz2={}, lookahead_sz2={})'.format(
+            self.window_sz2, self.lookahead_sz2)
+
+    def __eq__(self, other):
+        if not isinstance(other, Params):
+            return NotImplemented
+        return (self.window_sz2, self.lookahead_sz2) == \
+            (other.window_sz2, other.lookahead_sz2)
+
+    def __ne__(self, other):
+        if not isinstance(other, Params):
+            return NotImplemented
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.window_sz2, self.lookahead_sz2))
+
+    def __reduce__(self):
+        return Params, (self.window_sz2, self.lookahead_sz2)
+
+
+# Params created from keyword arguments, by (window_sz2, lookahead_sz2)
+cdef dict _params_cache = {}
+
+
+cpdef Params _get_params(dict kwargs, params=None):
+    """Return the Params given by `params` or by the `kwargs` sizes.
+
+    `params` defaults to kwargs['params']. Params are only validated
+    the first time a pair of sizes is used.
+    """
+    if params is None:
+        params = kwargs.get('params')
+
+    if params is not None:
+        if not isinstance(params, Params):
+            msg = 'Expected Params, got {}'
+            raise TypeError(msg.format(params.__class__.__name__))
+        if 'window_sz2' in kwargs or 'lookahead_sz2' in kwargs:
+            raise TypeError('Pass either params or window_sz2 and '
+                            'lookahead_sz2, not both')
+        return params
+
+    key = (kwargs.get('window_sz2', DEFAULT_WINDOW_SZ2),
+           kwargs.get('lookahead_sz2', DEFAULT_LOOKAHEAD_SZ2))
+    try:
+        return _params_cache[key]
+    except (KeyError, TypeError):
+        # TypeError for unhashable values, rejected by Params
+        pass
+
+    params = Params(*key)
+    _params_cache[key] = params
+    return params
+
+
+MemoryUsage = collections.namedtuple('MemoryUsage', ['encoder', 'decoder'])
+
+
+cdef size_t _encoder_memory(int window_sz2):
+    """Return the number of bytes allocated by heatshrink_encoder_alloc."""
+    cdef size_t buffer_size = 2 << window_sz2
+    # The buffer holds the backlog and the input, the search index has
+    # a 16 bit entry for each byte of it.
+    return (sizeof(_heatshrink.heatshrink_encoder) + buffer_size +
+            sizeof(_heatshrink.hs_index) + buffer_size * sizeof(uint16_t))
+
+
+cdef size_t _decoder_memory(int window_sz2, size_t input_buffer_size):
+    """Return the number of bytes allocated by heatshrink_decoder_alloc."""
+    return (sizeof(_heatshrink.heatshrink_decoder) + (1 << window_sz2) +
+            input_buffer_size)
+
+
+cdef _check_memory_budget(memory_budget, size_t needed, what):
+    """Raise a ValueError if `needed` bytes don't fit `memory_budget`."""
+    if (not isinstance(memory_budget, int) and
+            not _is_number(memory_budget, integral=True)):
+        msg = 'Expected integer, got {}'
+        raise TypeError(msg.format(memory_budget.__class__.__name__))
+
+    if memory_budget < needed:
+        msg = 'memory_budget must be >= {}, the size of the smallest {}'
+        raise ValueError(msg.format(needed, what))
+
+
+cdef size_t _input_buffer_size_for(memory_budget, Params params) except 0:
+    """Return the largest input buffer size of a Reader that fits in
+    `memory_budget` bytes."""
+    cdef size_t needed = _decoder_memory(params.window_sz2, 1)
+    _check_memory_budget(memory_budget, needed, 'decoder')
+    return min(memory_budget - needed + 1, MAX_INPUT_BUFFER_SIZE)
+
+
+def memory_for(params=None, input_buffer_size=DEFAULT_INPUT_BUFFER_SIZE,
+               **kwargs):
+    """
+    Return the memory used by a Writer and a Reader, as a MemoryUsage.
+
+    Both sizes count the bytes allocated for the C encoder or decoder
+    state and buffers, which is what grows with the parameters. The
+    Python objects and the allocator's bookkeeping aren't included.
+
+    Keyword arguments:
+        params (Params): The window and lookahead sizes. Defaults to
+            the sizes given by `window_sz2` and `lookahead_sz2`.
+        input_buffer_size (int): The input buffer size of the Reader.
+            Defaults to `DEFAULT_INPUT_BUFFER_SIZE`.
+        window_sz2 (int): See `encode`.
+        lookahead_sz2 (int): See `encode`.
+
+    Returns:
+        MemoryUsage: The `encoder` and `decoder` sizes in bytes.
+    """
+    cdef Params p = _get_params(kwargs, params)
+    _validate_bounds(input_buffer_size, name='input_buffer_size', min=1,
+                     max=MAX_INPUT_BUFFER_SIZE)
+    return MemoryUsage(_encoder_memory(p.window_sz2),
+                       _decoder_memory(p.window_sz2, input_buffer_size))
+
+
+cdef class Writer:
+    """Thin wrapper around heatshrink_encoder
+
+    Windows are limited to MAX_WRITER_WINDOW_SZ2, the C encoder's
+    output is corrupt with larger ones. Use encode for those.
+    """
+    cdef _heatshrink.heatshrink_encoder *_hse
+
+    def __cinit__(self, params=None, **kwargs):
+        cdef Params p = _get_params(kwargs, params)
+
+        if p.window_sz2 > MAX_WRITER_WINDOW_SZ2:
+            msg = 'Writer supports window_sz2 up to {}, use encode instead'
+            raise ValueError(msg.format(MAX_WRITER_WINDOW_SZ2))
+
+        if 'memory_budget' in kwargs:
+            _check_memory_budget(kwargs['memory_budget'],
+                                 _encoder_memory(p.window_sz2), 'encoder')
+
+        self._hse = _heatshrink.heatshrink_encoder_alloc(p.window_sz2,
+                                                         p.lookahead_sz2)
         if self._hse is NULL:
             raise MemoryError('Failed to allocate encoder.')
 
+        window = kwargs.get('window')
+        if window is not None:
+            self.set_window(window)
+
     def __dealloc__(self):
         if self._hse is not NULL:
             _heatshrink.heatshrink_encoder_free(self._hse)
 
+    def __reduce__(self):
+        return restore, (self.snapshot(),)
+
+    def snapshot(self):
+        """Return the state of the encoder as a byte string.
+
+        `restore` turns the snapshot back in to a Writer that continues
+        where this one left off. Between rounds of input, which is
+        always the case after `Encoder.fill` without a `max_length`,
+        only the window and the unprocessed input are saved.
+        """
+        cdef:
+            _heatshrink.heatshrink_encoder *hse = self._hse
+            size_t window_size = 1 << hse.window_sz2
+
+        header = _WRITER_SNAPSHOT.pack(
+            _WRITER_MAGIC, _SNAPSHOT_VERSION, hse.window_sz2,
+            hse.lookahead_sz2, hse.state, hse.flags, hse.current_byte,
+            hse.bit_index, hse.outgoing_bits_count, hse.input_size,
+            hse.match_scan_index, hse.match_length, hse.match_pos,
+            hse.outgoing_bits)
+
+        if hse.state == _HSES_NOT_FULL:
+            # Only the backlog and the input are in use
+            return header + PyBytes_FromStringAndSize(
+                <char *>hse.buffer, window_size + hse.input_size)
+
+        # In the middle of a round, the search index is in use too
+        return (header +
+                PyBytes_FromStringAndSize(<char *>hse.buffer,
+                                          2 * window_size) +
+                PyBytes_FromStringAndSize(<char *>hse.search_index.index,
+                                          hse.search_index.size))
+
+    cdef _restore(self, tuple fields, bytes data):
+        """Set the state from the fields and data of a snapshot."""
+        cdef:
+            _heatshrink.heatshrink_encoder *hse = self._hse
+            size_t window_size = 1 << hse.window_sz2
+            size_t size
+
+        (state, flags, current_byte, bit_index, outgoing_bits_count,
+         input_size, match_scan_index, match_length, match_pos,
+         outgoing_bits) = fields[4:]
+
+        if state == _HSES_NOT_FULL:
+            size = window_size + input_size
+        else:
+            size = 2 * window_size + hse.search_index.size
+
+        if (state >= _HSES_STATES or input_size > window_size or
+                match_scan_index > window_size or
+                match_length > 1 << hse.lookahead_sz2 or
+                match_pos > window_size or outgoing_bits_count > 16 or
+                len(data) != size):
+            raise ValueError('Invalid Writer snapshot.')
+
+        hse.state = state
+        hse.flags = flags
+        hse.current_byte = current_byte
+        hse.bit_index = bit_index
+        hse.outgoing_bits_count = outgoing_bits_count
+        hse.input_size = input_size
+        hse.match_scan_index = match_scan_index
+        hse.match_length = match_length
+        hse.match_pos = match_pos
+        hse.outgoing_bits = outgoing_bits
+
+        if state == _HSES_NOT_FULL:
+            memcpy(hse.buffer, <char *>data, size)
+        else:
+            memcpy(hse.buffer, <char *>data, 2 * window_size)
+            memcpy(hse.search_index.index, &(<char *>data)[2 * window_size],
+                   hse.search_index.size)
+
     @property
     def max_output_size(self):
         return 1 << self._hse.window_sz2
 
+    @property
+    def memory_usage(self):
+        """Number of bytes allocated by the encoder, see memory_for."""
+        return _encoder_memory(self._hse.window_sz2)
+
+    def set_window(self, window):
+        """Preload the sliding window with the contents of `window`.
+
+        The encoder then behaves as if `window` was compressed before
+        the first input, so matches can refer back in to it. Only the
+        last 2^window_sz2 bytes are used. Data has to be decoded by a
+        Reader with the same window.
+        """
+        cdef:
+            array.array data = array.array('B', window)
+            size_t window_size = 1 << self._hse.window_sz2
+            size_t size = min(len(data), window_size)
+
+        if (self._hse.state != _HSES_NOT_FULL or self._hse.input_size or
+                self._hse.match_scan_index or self._hse.bit_index != 0x80):
+            raise ValueError('Window can only be set before sinking input.')
+
+        # The window is the backlog in the first half of the buffer
+        memcpy(&self._hse.buffer[window_size - size],
+               &data.data.as_uchars[len(data) - size], size)
+
     def sink(self, array.array in_buf, size_t offset=0):
         """
         Sink input in to the encoder with an optional N byte `offset`.
@@ -77,13 +394,15 @@ cdef class Writer:
             _heatshrink.HSE_sink_res res
 
             size_t in_buf_size = len(in_buf)
-
-        res = _heatshrink.heatshrink_encoder_sink(
-            self._hse,
-            &in_buf.data.as_uchars[offset],
-            in_buf_size - offset,
-            &sink_size
-        )
+            uint8_t *in_ptr = &in_buf.data.as_uchars[offset]
+
+        with nogil:
+            res = _heatshrink.heatshrink_encoder_sink(
+                self._hse,
+                in_ptr,
+                in_buf_size - offset,
+                &sink_size
+            )
         return res, sink_size
 
     def poll(self, array.array out_buf):
@@ -97,13 +416,15 @@ cdef class Writer:
             _heatshrink.HSE_poll_res res
 
             size_t out_buf_size = len(out_buf)
-
-        res = _heatshrink.heatshrink_encoder_poll(
-            self._hse,
-            out_buf.data.as_uchars,
-            out_buf_size,
-            &poll_size
-        )
+            uint8_t *out_ptr = out_buf.data.as_uchars
+
+        with nogil:
+            res = _heatshrink.heatshrink_encoder_poll(
+                self._hse,
+                out_ptr,
+                out_buf_size,
+                &poll_size
+            )
         return res, poll_size
 
     def is_poll_empty(self, _heatshrink.HSE_poll_res res):
@@ -121,31 +442,121 @@ cdef class Reader:
     """Thin wrapper around heatshrink_decoder"""
     cdef _heatshrink.heatshrink_decoder *_hsd
 
-    def __cinit__(self, **kwargs):
-        input_buffer_size = kwargs.get('input_buffer_size',
-                                       DEFAULT_INPUT_BUFFER_SIZE)
-        window_sz2 = kwargs.get('window_sz2', DEFAULT_WINDOW_SZ2)
-        lookahead_sz2 = kwargs.get('lookahead_sz2', DEFAULT_LOOKAHEAD_SZ2)
-
-        _validate_bounds(input_buffer_size, name='input_buffer_size', min=0)
-        _validate_bounds(window_sz2, name='window_sz2',
-                         min=MIN_WINDOW_SZ2, max=MAX_WINDOW_SZ2)
-        _validate_bounds(lookahead_sz2, name='lookahead_sz2',
-                         min=MIN_LOOKAHEAD_SZ2, max=window_sz2)
+    def __cinit__(self, params=None, **kwargs):
+        cdef Params p = _get_params(kwargs, params)
+
+        input_buffer_size = DEFAULT_INPUT_BUFFER_SIZE
+        if 'input_buffer_size' in kwargs:
+            if 'memory_budget' in kwargs:
+                raise TypeError('Pass either input_buffer_size or '
+                                'memory_budget, not both')
+            input_buffer_size = kwargs['input_buffer_size']
+            _validate_bounds(input_buffer_size, name='input_buffer_size',
+                             min=0)
+        elif 'memory_budget' in kwargs:
+            input_buffer_size = _input_buffer_size_for(kwargs['memory_budget'],
+                                                       p)
 
         self._hsd = _heatshrink.heatshrink_decoder_alloc(
-            input_buffer_size, window_sz2, lookahead_sz2)
+            input_buffer_size, p.window_sz2, p.lookahead_sz2)
         if self._hsd is NULL:
             raise MemoryError('Failed to allocate decoder.')
 
+        window = kwargs.get('window')
+        if window is not None:
+            self.set_window(window)
+
     def __dealloc__(self):
         if self._hsd is not NULL:
             _heatshrink.heatshrink_decoder_free(self._hsd)
 
+    def __reduce__(self):
+        return restore, (self.snapshot(),)
+
+    def snapshot(self):
+        """Return the state of the decoder as a byte string.
+
+        `restore` turns the snapshot back in to a Reader that continues
+        where this one left off. Only the window and the input that
+        hasn't been decoded yet are saved.
+        """
+        cdef:
+            _heatshrink.heatshrink_decoder *hsd = self._hsd
+            size_t window_size = 1 << hsd.window_sz2
+            size_t pending = hsd.input_size - hsd.input_index
+
+        header = _READER_SNAPSHOT.pack(
+            _READER_MAGIC, _SNAPSHOT_VERSION, hsd.window_sz2,
+            hsd.lookahead_sz2, hsd.state, hsd.current_byte, hsd.bit_index,
+            hsd.input_buffer_size, pending, hsd.output_count,
+            hsd.output_index, hsd.head_index)
+        return (header +
+                PyBytes_FromStringAndSize(
+                    <char *>&hsd.buffers[hsd.input_index], pending) +
+                PyBytes_FromStringAndSize(
+                    <char *>&hsd.buffers[hsd.input_buffer_size],
+                    window_size))
+
+    cdef _restore(self, tuple fields, bytes data):
+        """Set the state from the fields and data of a snapshot."""
+        cdef:
+            _heatshrink.heatshrink_decoder *hsd = self._hsd
+            size_t window_size = 1 << hsd.window_sz2
+
+        (state, current_byte, bit_index, _, pending, output_count,
+         output_index, head_index) = fields[4:]
+
+        if (state >= _HSDS_STATES or pending > hsd.input_buffer_size or
+                output_count > 1 << hsd.lookahead_sz2 or
+                output_index > window_size or
+                len(data) != pending + window_size):
+            raise ValueError('Invalid Reader snapshot.')
+
+        hsd.state = state
+        hsd.current_byte = current_byte
+        hsd.bit_index = bit_index
+        hsd.input_index = 0
+        hsd.input_size = pending
+        hsd.output_count = output_count
+        hsd.output_index = output_index
+        hsd.head_index = head_index
+
+        memcpy(hsd.buffers, <char *>data, pending)
+        memcpy(&hsd.buffers[hsd.input_buffer_size],
+               &(<char *>data)[pending], window_size)
+
     @property
     def max_output_size(self):
         return 1 << self._hsd.window_sz2
 
+    @property
+    def memory_usage(self):
+        """Number of bytes allocated by the decoder, see memory_for."""
+        return _decoder_memory(self._hsd.window_sz2,
+                               self._hsd.input_buffer_size)
+
+    def set_window(self, window):
+        """Preload the sliding window with the contents of `window`.
+
+        Used to decode data from a Writer with the same window.
+        Only the last 2^window_sz2 bytes are used.
+        """
+        cdef:
+            array.array data = array.array('B', window)
+            size_t window_size = 1 << self._hsd.window_sz2
+            size_t size = min(len(data), window_size)
+            size_t mask = window_size - 1
+            size_t i
+            uint8_t *buf = &self._hsd.buffers[self._hsd.input_buffer_size]
+
+        if (self._hsd.state != _HSDS_TAG_BIT or self._hsd.input_size or
+                self._hsd.head_index):
+            raise ValueError('Window can only be set before sinking input.')
+
+        for i in range(size):
+            buf[i & mask] = data.data.as_uchars[len(data) - size + i]
+        self._hsd.head_index = size
+
     def sink(self, array.array in_buf, size_t offset=0):
         """
         Sink input in to the encoder with an optional N byte `offset`.
@@ -155,13 +566,15 @@ cdef class Reader:
             _heatshrink.HSD_sink_res res
 
             size_t in_buf_size = len(in_buf)
-
-        res = _heatshrink.heatshrink_decoder_sink(
-            self._hsd,
-            &in_buf.data.as_uchars[offset],
-            in_buf_size - offset,
-            &sink_size
-        )
+            uint8_t *in_ptr = &in_buf.data.as_uchars[offset]
+
+        with nogil:
+            res = _heatshrink.heatshrink_decoder_sink(
+                self._hsd,
+                in_ptr,
+                in_buf_size - offset,
+                &sink_size
+            )
         return res, sink_size
 
     def poll(self, array.array out_buf):
@@ -170,13 +583,15 @@ cdef class Reader:
             _heatshrink.HSD_poll_res res
 
             size_t out_buf_size = len(out_buf)
-
-        res = _heatshrink.heatshrink_decoder_poll(
-            self._hsd,
-            out_buf.data.as_uchars,
-            out_buf_size,
-            &poll_size
-        )
+            uint8_t *out_ptr = out_buf.data.as_uchars
+
+        with nogil:
+            res = _heatshrink.heatshrink_decoder_poll(
+                self._hsd,
+                out_ptr,
+                out_buf_size,
+                &poll_size
+            )
         return res, poll_size
 
     def is_poll_empty(self, _heatshrink.HSD_poll_res res):
@@ -195,6 +610,11 @@ class Encoder(object):
     def __init__(self, encoder):
         self._encoder = encoder
         self._finished = False
+        # Input that has not yet been sunk in to the state machine
+        self._in_buf = array.array('B', [])
+        self._in_offset = 0
+        # True if the state machine may have more data to poll
+        self._pending_output = False
 
     def _check_not_finished(self):
         """Throws an exception if the encoder has been closed."""
@@ -203,30 +623,70 @@ class Encoder(object):
             # TODO: ValueError isn't the right exception for this
             raise ValueError(msg)
 
-    def _drain(self):
-        """Empty data from the encoder state machine."""
+    def _drain(self, array.array out_buf, max_length=-1):
+        """Empty data from the encoder state machine in to `out_buf`.
+
+        Stops polling once `out_buf` holds `max_length` bytes, if
+        `max_length` is non-negative. Returns False if polling was
+        stopped before the state machine was emptied.
+        """
         cdef:
-            array.array out_buf = array.array('B', [])
+            array.array poll_buf = array.array('B', [])
+            size_t poll_buf_size = self._encoder.max_output_size
 
         while True:
+            if max_length >= 0:
+                if len(out_buf) >= max_length:
+                    return False
+                poll_buf_size = min(poll_buf_size, max_length - len(out_buf))
+
             # Resize to decent length
-            array.resize(out_buf, self._encoder.max_output_size)
+            array.resize(poll_buf, poll_buf_size)
 
-            res, poll_size = self._encoder.poll(out_buf)
+            res, poll_size = self._encoder.poll(poll_buf)
             if res < 0:
                 raise RuntimeError('Encoder poll failed.')
 
             # Drop unused elements
-            array.resize(out_buf, poll_size)
-
-            yield out_buf
+            array.resize(poll_buf, poll_size)
+            out_buf.extend(poll_buf)
 
             # Done polling
             if self._encoder.is_poll_empty(res):
-                raise StopIteration
+                self._pending_output = False
+                return True
+
+    def _process(self, array.array out_buf, max_length=-1):
+        """Sink pending input and poll the results in to `out_buf`."""
+        while True:
+            if self._pending_output:
+                if not self._drain(out_buf, max_length):
+                    # Output budget reached, resume on the next call
+                    return
+
+            if self._in_offset >= len(self._in_buf):
+                break
+
+            res, sunk = self._encoder.sink(self._in_buf,
+                                           offset=self._in_offset)
+            if res < 0:
+                raise RuntimeError('Encoder sink failed.')
+
+            self._in_offset += sunk
+            self._pending_output = True
+
+        # All input has been consumed
+        self._in_buf = array.array('B', [])
+        self._in_offset = 0
 
-    def fill(self, buf):
-        """Fill the encoder state machine with a buffer."""
+    def fill(self, buf, max_length=-1):
+        """Fill the encoder state machine with a buffer.
+
+        If `max_length` is non-negative, at most `max_length` bytes
+        are returned. Any input that could not be processed within
+        that budget is kept and consumed by subsequent calls, which
+        may be made with an empty buffer (see `needs_input`).
+        """
         self._check_not_finished()
 
         if isinstance(buf, (unicode, memoryview)):
@@ -237,19 +697,14 @@ class Encoder(object):
         cdef array.array in_buf  = array.array('B', buf)
         cdef array.array out_buf = array.array('B', [])
 
-        cdef size_t total_sunk = 0
+        if self._in_offset < len(self._in_buf):
+            # Keep the input left over from the previous call
+            in_buf = self._in_buf[self._in_offset:] + in_buf
 
-        while total_sunk < len(in_buf):
-            res, sunk = self._encoder.sink(in_buf, offset=total_sunk)
+        self._in_buf = in_buf
+        self._in_offset = 0
 
-            if res < 0:
-                raise RuntimeError('Encoder sink failed.')
-
-            total_sunk += sunk
-
-            # Clear state machine
-            for data in self._drain():
-                out_buf.extend(data)
+        self._process(out_buf, max_length)
 
         try:
             # Python 3
@@ -260,6 +715,7 @@ class Encoder(object):
     def finish(self):
         """Close encoder and return any remaining data.
 
+        Any input left over from a limited fill() is processed first.
         Will throw an exception if fill() or finish()
         is used after this.
         """
@@ -267,6 +723,8 @@ class Encoder(object):
 
         cdef array.array out_buf = array.array('B', [])
 
+        self._process(out_buf)
+
         while True:
             res = self._encoder.finish()
             if res < 0:
@@ -276,8 +734,7 @@ class Encoder(object):
                 self._finished = True
                 break
 
-            for data in self._drain():
-                out_buf.extend(data)
+            self._drain(out_buf)
 
         try:
             # Python 3
@@ -285,16 +742,325 @@ class Encoder(object):
         except AttributeError:
             return out_buf.tostring()
 
+    def __reduce__(self):
+        return restore, (self.snapshot(),)
+
+    def snapshot(self):
+        """Return the state of the encoder as a byte string.
+
+        The snapshot of the wrapped Writer or Reader is included, as
+        well as any input left over from a limited fill(). See
+        `restore`.
+        """
+        cdef array.array pending = self._in_buf[self._in_offset:]
+
+        state = self._encoder.snapshot()
+        flags = ((_ENCODER_FINISHED if self._finished else 0) |
+                 (_ENCODER_PENDING_OUTPUT if self._pending_output else 0))
+        header = _ENCODER_SNAPSHOT.pack(_ENCODER_MAGIC, _SNAPSHOT_VERSION,
+                                        flags, len(state))
+        try:
+            # Python 3
+            return header + state + pending.tobytes()
+        except AttributeError:
+            return header + state + pending.tostring()
+
     @property
     def finished(self):
         """Returns true if the encoder has been closed."""
         return self._finished
 
+    @property
+    def needs_input(self):
+        """Returns true if all input passed to fill() has been processed.
+
+        False means that a previous fill() stopped at `max_length` and
+        more data can be retrieved by calling fill() again.
+        """
+        return (not self._pending_output and
+                self._in_offset >= len(self._in_buf))
+
 
-cdef _encode_impl(encoder, buf):
-    """Encode iterable `buf` into an array of bytes."""
-    encoder = Encoder(encoder)
-    return encoder.fill(buf) + encoder.finish()
+def _invalid_snapshot():
+    return ValueError('Invalid snapshot.')
+
+
+def restore(snapshot):
+    """
+    Return the Writer, Reader or Encoder saved in a snapshot.
+
+    Snapshots are made by the `snapshot` methods, and are used when
+    pickling. The restored object continues exactly where the saved
+    one left off, no input needs to be fed to it again. Snapshots
+    should only be restored from trusted sources.
+
+    Raises:
+        ValueError: If `snapshot` isn't a valid snapshot.
+    """
+    cdef Writer writer
+    cdef Reader reader
+
+    snapshot = bytes(snapshot)
+    magic = snapshot[:4]
+
+    if magic == _ENCODER_MAGIC:
+        size = _ENCODER_SNAPSHOT.size
+        if len(snapshot) < size:
+            raise _invalid_snapshot()
+        _, version, flags, state_size = _ENCODER_SNAPSHOT.unpack_from(
+            snapshot)
+        if version != _SNAPSHOT_VERSION or len(snapshot) < size + state_size:
+            raise _invalid_snapshot()
+
+        inner = snapshot[size:size + state_size]
+        if inner[:4] == _ENCODER_MAGIC:
+            raise _invalid_snapshot()
+
+        encoder = Encoder(restore(inner))
+        encoder._finished = bool(flags & _ENCODER_FINISHED)
+        encoder._pending_output = bool(flags & _ENCODER_PENDING_OUTPUT)
+        encoder._in_buf = array.array('B', snapshot[size + state_size:])
+        return encoder
+
+    if magic == _WRITER_MAGIC:
+        header = _WRITER_SNAPSHOT
+    elif magic == _READER_MAGIC:
+        header = _READER_SNAPSHOT
+    else:
+        raise _invalid_snapshot()
+
+    if len(snapshot) < header.size:
+        raise _invalid_snapshot()
+    fields = header.unpack_from(snapshot)
+    _, version, window_sz2, lookahead_sz2 = fields[:4]
+    if version != _SNAPSHOT_VERSION or lookahead_sz2 >= window_sz2:
+        raise _invalid_snapshot()
+    params = Params(window_sz2, lookahead_sz2)
+    data = snapshot[header.size:]
+
+    if magic == _WRITER_MAGIC:
+        writer = Writer(params)
+        writer._restore(fields, data)
+        return writer
+
+    if not fields[7]:
+        raise _invalid_snapshot()
+    reader = Reader(params, input_buffer_size=fields[7])
+    reader._restore(fields, data)
+    return reader
+
+
+cdef _check_allocatable(Params params, what):
+    """Raise the MemoryError of the C allocators for unsupported sizes.
+
+    The one-shot engines don't allocate a C encoder or decoder, but
+    have to reject the same parameters.
+    """
+    if params.lookahead_sz2 >= params.window_sz2:
+        raise MemoryError('Failed to allocate {}.'.format(what))
+
+
+cdef _as_buffer(buf, what):
+    """Return iterable `buf` as an object supporting the buffer protocol."""
+    if isinstance(buf, (unicode, memoryview)):
+        msg = "Cannot {} type '{.__name__}'"
+        raise TypeError(msg.format(what, buf.__class__))
+    if not isinstance(buf, (bytes, bytearray)):
+        buf = bytearray(array.array('B', buf))
+    return buf
+
+
+cdef inline void _push_bits(uint8_t *out, size_t *out_pos, uint64_t *bits,
+                            int *bit_count, uint64_t value, int count) nogil:
+    """Append the `count` low bits of value to out, most significant first."""
+    bits[0] = (bits[0] << count) | value
+    bit_count[0] += count
+    while bit_count[0] >= 8:
+        bit_count[0] -= 8
+        out[out_pos[0]] = <uint8_t>(bits[0] >> bit_count[0])
+        out_pos[0] += 1
+
+
+# Bits of the largest hash table of _encode_buffer, which has a chain
+# for every byte pair
+cdef int _MAX_HASH_BITS = 16
+cdef int _MIN_HASH_BITS = 8
+
+
+cdef inline Py_ssize_t _pair_key(const uint8_t *buf, Py_ssize_t pos,
+                                 int hash_bits) nogil:
+    """Return the hash table slot of the byte pair at `pos` of buf."""
+    cdef uint32_t pair = (buf[pos] << 8) | buf[pos + 1]
+    if hash_bits == _MAX_HASH_BITS:
+        return pair
+    # Multiplicative hashing, smaller tables share chains between pairs
+    return <uint32_t>(pair * <uint32_t>2654435761U) >> (32 - hash_bits)
+
+
+cdef inline void _index(const uint8_t *buf, Py_ssize_t total,
+                        Py_ssize_t *head, Py_ssize_t *prev,
+                        Py_ssize_t mask, int hash_bits,
+                        Py_ssize_t pos) nogil:
+    """Add position `pos` of buf to the hash chains."""
+    cdef Py_ssize_t key
+    if pos + 1 < total:
+        key = _pair_key(buf, pos, hash_bits)
+        prev[pos & mask] = head[key]
+        head[key] = pos
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef bytes _encode_buffer(const uint8_t[:] data, Params params, window):
+    """Encode all of `data` at once.
+
+    Produces exactly the same output as a streaming Writer. The input
+    is processed in the same rounds as the Writer's 2 * 2^window_sz2
+    byte buffer, which only matter for where matches are limited, and
+    matches are found with hash chains of byte pairs instead of single
+    bytes, which finds the same nearest longest matches of at least
+    two bytes, the shortest that are ever used.
+
+    The largest window is the exception: the C encoder's 16 bit buffer
+    offsets overflow, so it searches a stale index, which corrupts its
+    output and can make it very slow. This encoder has no such limit.
+
+    The hash table is sized to the input, so that small inputs don't
+    pay for clearing a chain for every pair.
+    """
+    cdef:
+        Py_ssize_t window_size = 1 << params.window_sz2
+        Py_ssize_t lookahead_size = 1 << params.lookahead_sz2
+        Py_ssize_t mask = window_size - 1
+        Py_ssize_t length = data.shape[0]
+        # The input follows a history of the initial window
+        Py_ssize_t total = window_size + length
+        # Matches must be longer than this to be smaller than literals
+        Py_ssize_t break_even = (1 + params.window_sz2 +
+                                 params.lookahead_sz2) // 8
+
+        uint8_t *buf = NULL
+        Py_ssize_t *head = NULL
+        Py_ssize_t *prev = NULL
+        uint8_t *out = NULL
+        size_t out_pos = 0
+        uint64_t bits = 0
+        int bit_count = 0
+
+        int hash_bits = _MIN_HASH_BITS
+        Py_ssize_t indexed
+        Py_ssize_t base = window_size
+        Py_ssize_t remaining, limit, scan, cur, max_len, start
+        Py_ssize_t candidate, match_len, match_pos, match, advance, p
+        bint final
+
+        const uint8_t[:] window_data
+        Py_ssize_t window_len
+
+    _check_allocatable(params, 'encoder')
+
+    # A few slots per indexed position, so that clearing the table
+    # costs less than encoding and chains of different pairs rarely
+    # share a slot. Without a preset window, the history is zeros,
+    # which share a single chain.
+    indexed = length if window is None else total
+    while hash_bits < _MAX_HASH_BITS and (1 << hash_bits) < 4 * indexed:
+        hash_bits += 1
+
+    try:
+        buf = <uint8_t *>malloc(total)
+        head = <Py_ssize_t *>malloc((1 << hash_bits) * sizeof(Py_ssize_t))
+        prev = <Py_ssize_t *>malloc(window_size * sizeof(Py_ssize_t))
+        # Literals take 9 bits and matches less per byte
+        out = <uint8_t *>malloc(length + length // 8 + 2)
+        if buf is NULL or head is NULL or prev is NULL or out is NULL:
+            raise MemoryError('Failed to allocate encode buffers.')
+
+        memset(buf, 0, window_size)
+        if window is not None:
+            window_data = bytearray(window)
+            window_len = min(window_data.shape[0], window_size)
+            if window_len:
+                memcpy(&buf[window_size - window_len],
+                       &window_data[window_data.shape[0] - window_len],
+                       window_len)
+        if length:
+            memcpy(&buf[window_size], &data[0], length)
+
+        with nogil:
+            for p in range(1 << hash_bits):
+                head[p] = -1
+            for p in range(window_size):
+                _index(buf, total, head, prev, mask, hash_bits, p)
+
+            while True:
+                # Rounds process the input in the same steps as the C
+                # encoder. Only the last one may have less than a
+                # window of input, where matches are cut short.
+                remaining = total - base
+                final = remaining < window_size
+                limit = remaining if final else window_size - lookahead_size + 1
+
+                scan = 0
+                while scan < limit:
+                    cur = base + scan
+                    max_len = lookahead_size
+                    if final and remaining - scan < max_len:
+                        max_len = remaining - scan
+
+                    match_len = 0
+                    match_pos = -1
+                    if max_len >= 2:
+                        start = cur - window_size
+                        candidate = head[_pair_key(buf, cur, hash_bits)]
+                        while candidate >= start:
+                            # Only check candidates that can be longer,
+                            # and that start with the same pair
+                            if (buf[candidate + match_len] == buf[cur + match_len] and
+                                    buf[candidate] == buf[cur] and
+                                    buf[candidate + 1] == buf[cur + 1]):
+                                match = 2
+                                while (match < max_len and
+                                       buf[candidate + match] == buf[cur + match]):
+                                    match += 1
+                                if match > match_len:
+                                    match_len = match
+                                    match_pos = candidate
+                                    if match == max_len:
+                                        break
+                            candidate = prev[candidate & mask]
+
+                    if match_len > break_even:
+                        _push_bits(out, &out_pos, &bits, &bit_count, 0, 1)
+                        _push_bits(out, &out_pos, &bits, &bit_count,
+                                   cur - match_pos - 1, params.window_sz2)
+                        _push_bits(out, &out_pos, &bits, &bit_count,
+                                   match_len - 1, params.lookahead_sz2)
+                        advance = match_len
+                    else:
+                        _push_bits(out, &out_pos, &bits, &bit_count,
+                                   0x100 | buf[cur], 9)
+                        advance = 1
+
+                    for p in range(cur, cur + advance):
+                        _index(buf, total, head, prev, mask, hash_bits, p)
+                    scan += advance
+
+                if final:
+                    break
+                base += scan
+
+            if bit_count:
+                # Pad the last byte with zeros
+                _push_bits(out, &out_pos, &bits, &bit_count, 0,
+                           8 - bit_count)
+
+        return PyBytes_FromStringAndSize(<char *>out, out_pos)
+    finally:
+        free(buf)
+        free(head)
+        free(prev)
+        free(out)
 
 
 def encode(buf, **kwargs):
@@ -309,6 +1075,11 @@ def encode(buf, **kwargs):
             patterns that are found. Defaults to `DEFAULT_LOOKAHEAD_SZ2`.
             Allowed values are between `MIN_LOOKAHEAD_SZ2` and the
             value set for `window_sz2`.
+        params (Params): Validated window and lookahead sizes, used
+            instead of `window_sz2` and `lookahead_sz2`.
+        window (iterable): Data to preload the sliding window with,
+            which matches can refer back to. The same window has to be
+            passed to `decode`. Defaults to an empty window.
 
     Returns:
         str or bytes: A byte string of encoded contents.
@@ -322,17 +1093,203 @@ def encode(buf, **kwargs):
         RuntimeError: Thrown if internal polling or sinking of the
             encoder/decoder fails.
     """
-    return _encode_impl(Writer(**kwargs), buf)
+    cdef Params params = _get_params(kwargs)
+    return _encode_buffer(_as_buffer(buf, 'encode'), params,
+                          kwargs.get('window'))
+
+
+# Size and number of the samples compressed by estimate_ratio
+_SAMPLE_SIZE = 4096
+_SAMPLE_COUNT = 8
+
+
+def estimate_ratio(buf, sample_size=_SAMPLE_SIZE, samples=_SAMPLE_COUNT,
+                   **kwargs):
+    """
+    Estimate how well iterable `buf` compresses.
+
+    Up to `samples` evenly spaced slices of `sample_size` bytes are
+    compressed, which is much faster than compressing all of `buf`
+    when it is large. Matches can't reach outside of the samples, so
+    data with repeats far apart compresses better than estimated.
 
+    Keyword arguments are the compression parameters, as for `encode`.
 
-def decode(buf, **kwargs):
+    Returns:
+        float: The estimated compressed size divided by the size. 1.0
+            or more means that compressing doesn't make `buf` smaller,
+            as is the case for random or already compressed data.
+            Returns 1.0 for empty buffers.
+    """
+    _validate_bounds(sample_size, name='sample_size', min=1)
+    _validate_bounds(samples, name='samples', min=1)
+
+    cdef Params params = _get_params(kwargs)
+    cdef const uint8_t[:] data = _as_buffer(buf, 'estimate')
+    cdef Py_ssize_t length = data.shape[0]
+    cdef Py_ssize_t step, start
+    cdef size_t encoded = 0
+
+    if not length:
+        return 1.0
+    if length <= sample_size * samples:
+        return len(_encode_buffer(data, params, None)) / float(length)
+
+    step = (length - sample_size) // max(samples - 1, 1)
+    for start in range(0, step * samples, step):
+        encoded += len(_encode_buffer(data[start:start + sample_size],
+                                      params, None))
+    return encoded / float(sample_size * samples)
+
+
+cdef inline bint _reserve(uint8_t **out, size_t *capacity,
+                          size_t size) nogil:
+    """Grow the *out buffer to hold at least size bytes."""
+    cdef:
+        size_t new_capacity = capacity[0]
+        uint8_t *new_out
+
+    if size <= new_capacity:
+        return True
+
+    while new_capacity < size:
+        new_capacity *= 2
+    new_out = <uint8_t *>realloc(out[0], new_capacity)
+    if new_out is NULL:
+        return False
+
+    out[0] = new_out
+    capacity[0] = new_capacity
+    return True
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef bytes _decode_buffer(const uint8_t[:] data, Params params, window,
+                          max_output_size):
+    """Decode all of `data` at once.
+
+    Produces the same output as a streaming Reader, including for
+    truncated or malformed input. Instead of a circular window, the
+    output is decoded after a 2^window_sz2 byte history, which holds
+    the zero filled initial window of the Reader and `window`, so
+    back-references can be copied directly from the output.
+    """
+    cdef:
+        size_t history_size = 1 << params.window_sz2
+        int count_bits = params.lookahead_sz2
+        int backref_bits = params.window_sz2 + params.lookahead_sz2
+        uint64_t count_mask = (1 << count_bits) - 1
+        uint64_t index_mask = history_size - 1
+
+        size_t length = data.shape[0]
+        size_t in_pos = 0
+        uint64_t bits = 0
+        int bit_count = 0
+        uint64_t token
+
+        size_t capacity = history_size + length * _DECODE_GROWTH + 16
+        size_t pos = history_size
+        # Decoding stops once the output exceeds the limit
+        size_t limit = <size_t>-1
+        size_t count, distance, i
+        uint8_t *src
+        uint8_t *out
+        bint failed = False
+
+        const uint8_t[:] window_data
+        size_t window_size
+
+    if max_output_size is not None:
+        limit = history_size + max_output_size
+
+    out = <uint8_t *>malloc(capacity)
+    if out is NULL:
+        raise MemoryError('Failed to allocate decode buffer.')
+    memset(out, 0, history_size)
+
+    if window is not None:
+        window_data = bytearray(window)
+        window_size = min(<size_t>window_data.shape[0], history_size)
+        if window_size:
+            memcpy(&out[history_size - window_size],
+                   &window_data[window_data.shape[0] - window_size],
+                   window_size)
+
+    try:
+        with nogil:
+            while pos <= limit:
+                # Keep the accumulator topped up with whole bytes
+                while bit_count <= 56 and in_pos < length:
+                    bits = (bits << 8) | data[in_pos]
+                    in_pos += 1
+                    bit_count += 8
+
+                # Incomplete trailing tokens are ignored
+                if bit_count < 1:
+                    break
+                bit_count -= 1
+
+                if (bits >> bit_count) & 1:
+                    # Literal
+                    if bit_count < 8:
+                        break
+                    bit_count -= 8
+                    if not _reserve(&out, &capacity, pos + 1):
+                        failed = True
+                        break
+                    out[pos] = <uint8_t>(bits >> bit_count)
+                    pos += 1
+                    continue
+
+                # Back-reference
+                if bit_count < backref_bits:
+                    break
+                bit_count -= backref_bits
+                token = bits >> bit_count
+                count = (token & count_mask) + 1
+                distance = ((token >> count_bits) & index_mask) + 1
+
+                if not _reserve(&out, &capacity, pos + count):
+                    failed = True
+                    break
+
+                src = &out[pos - distance]
+                if distance >= count:
+                    memcpy(&out[pos], src, count)
+                else:
+                    # Overlapping copies repeat the last `distance` bytes
+                    for i in range(count):
+                        out[pos + i] = src[i]
+                pos += count
+
+        if failed:
+            raise MemoryError('Failed to allocate decode buffer.')
+        if pos > limit:
+            msg = 'Decoded data exceeds max_output_size ({} bytes)'
+            raise ValueError(msg.format(max_output_size))
+
+        return PyBytes_FromStringAndSize(<char *>&out[history_size],
+                                         pos - history_size)
+    finally:
+        free(out)
+
+
+def decode(buf, max_output_size=None, **kwargs):
     """
     Decode iterable `buf` in to a byte string.
 
+    The whole input is decoded at once, which is several times faster
+    than decoding it with a streaming Reader and gives the same output.
+
     Keyword arguments:
-        input_buffer_size (int): How large an input buffer to use for the decoder.
-            This impacts how much work the decoder can do in a single step,
-            a larger buffer will use more memory.
+        max_output_size (int): The maximum number of decoded bytes to
+            produce. Decoding stops as soon as this limit is exceeded,
+            which bounds the memory used by untrusted input. Defaults
+            to no limit.
+        input_buffer_size (int): How large an input buffer to use for the
+            streaming decoder. Accepted for compatibility, but unused as
+            the whole input is available.
         window_sz2 (int): Determines how far back in the input can be
             searched for repeated patterns. Defaults to `DEFAULT_WINDOW_SZ2`.
             Allowed values are between. `MIN_WINDOW_SZ2` and `MAX_WINDOW_SZ2`.
@@ -340,6 +1297,9 @@ def decode(buf, **kwargs):
             patterns that are found. Defaults to `DEFAULT_LOOKAHEAD_SZ2`.
             Allowed values are between `MIN_LOOKAHEAD_SZ2` and the
             value set for `window_sz2`.
+        params (Params): Validated window and lookahead sizes, used
+            instead of `window_sz2` and `lookahead_sz2`.
+        window (iterable): The window that was passed to `encode`.
 
     Returns:
         str or bytes: A byte string of decoded contents.
@@ -347,11 +1307,152 @@ def decode(buf, **kwargs):
 
     Raises:
         ValueError: If `input_buffer_size`, `window_sz2` or `lookahead_sz2` are
-            outside their defined ranges.
+            outside their defined ranges or if the decoded data is larger
+            than `max_output_size`.
         TypeError: If `input_buffer_size`, `window_sz2` or `lookahead_sz2` are
-            not valid numbers and if `buf` is not a valid iterable.
-        RuntimeError: Thrown if internal polling or sinking of the
-            encoder/decoder fails.
+            not valid numbers, if `buf` is not a valid iterable and if
+            `memory_budget` is passed.
+        MemoryError: If the output buffer can't be allocated.
+    """
+    cdef Params params = _decode_params(max_output_size, kwargs)
+    return _decode_buffer(_as_buffer(buf, 'decode'), params,
+                          kwargs.get('window'), max_output_size)
+
+
+cdef Params _decode_params(max_output_size, dict kwargs):
+    """Return the Params of a decode call, after checking its arguments."""
+    cdef Params params = _get_params(kwargs)
+
+    if 'input_buffer_size' in kwargs:
+        # Not needed when the whole input is available
+        _validate_bounds(kwargs['input_buffer_size'],
+                         name='input_buffer_size', min=0)
+        if not kwargs['input_buffer_size']:
+            raise MemoryError('Failed to allocate decoder.')
+    if 'memory_budget' in kwargs:
+        # The whole output is held in memory, see max_output_size
+        raise TypeError('decode takes no memory_budget, use a Reader or '
+                        'EncodedFile to decode within a budget')
+    if max_output_size is not None:
+        _check_max_output_size(max_output_size)
+
+    _check_allocatable(params, 'decoder')
+    return params
+
+
+def _encode_view(const uint8_t[:] data, **kwargs):
+    """Like encode, but for any buffer of bytes, including memoryviews,
+    which is used without copying it. See heatshrink.parallel.
+    """
+    cdef Params params = _get_params(kwargs)
+    return _encode_buffer(data, params, kwargs.get('window'))
+
+
+def _decode_view(const uint8_t[:] data, max_output_size=None, **kwargs):
+    """Like decode, but for any buffer of bytes, see _encode_view."""
+    cdef Params params = _decode_params(max_output_size, kwargs)
+    return _decode_buffer(data, params, kwargs.get('window'),
+                          max_output_size)
+
+
+
+cdef class _SizeCounter:
+    """Counts the decoded size of a stream without decoding it.
+
+    Walks the bitstream, adding one byte for each literal and the
+    length of each back-reference. Incomplete trailing tokens are
+    ignored, in the same way as the decoder ignores them.
+    """
+    cdef:
+        uint64_t _bits
+        int _bit_count
+        # Number of bits needed to complete the current token
+        int _needed
+        bint _literal
+        int _backref_bits
+        uint64_t _count_mask
+        readonly uint64_t size
+
+    def __cinit__(self, params=None, **kwargs):
+        cdef Params p = _get_params(kwargs, params)
+
+        self._backref_bits = p.window_sz2 + p.lookahead_sz2
+        self._count_mask = (1 << p.lookahead_sz2) - 1
+        self._needed = 1
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def feed(self, buf):
+        """Count the tokens completed by the bytes in `buf`."""
+        cdef:
+            const uint8_t[:] data = buf
+            size_t i
+            size_t length = len(data)
+
+        with nogil:
+            for i in range(length):
+                # Only the low bits matter, older ones are shifted out
+                self._bits = (self._bits << 8) | data[i]
+                self._bit_count += 8
+
+                while self._bit_count >= self._needed:
+                    self._bit_count -= self._needed
+                    if self._needed == 1:
+                        # Tag bit
+                        self._literal = (self._bits >> self._bit_count) & 1
+                        self._needed = 8 if self._literal else self._backref_bits
+                        continue
+
+                    if self._literal:
+                        self.size += 1
+                    else:
+                        self.size += ((self._bits >> self._bit_count) &
+                                      self._count_mask) + 1
+                    self._needed = 1
+
+
+def decompressed_size(buf, **kwargs):
+    """
+    Return the decoded size of `buf` without decoding it.
+
+    Only the tokens of the bitstream are parsed, no output or window
+    is written, so this is much faster than decoding and uses no
+    memory for the output.
+
+    Arguments:
+        buf: An iterable of bytes or a binary file object, which is
+            read from its current position until EOF.
+
+    Keyword arguments:
+        window_sz2 (int): The window size the data was encoded with.
+            Defaults to `DEFAULT_WINDOW_SZ2`.
+        lookahead_sz2 (int): The lookahead size the data was encoded
+            with. Defaults to `DEFAULT_LOOKAHEAD_SZ2`.
+        params (Params): Validated window and lookahead sizes, used
+            instead of `window_sz2` and `lookahead_sz2`.
+
+    Returns:
+        int: The number of bytes that `decode` would return.
+
+    Raises:
+        ValueError: If `window_sz2` or `lookahead_sz2` are outside their
+            defined ranges.
+        TypeError: If `window_sz2`, `lookahead_sz2` are not valid numbers and
+            if `buf` is not a valid iterable.
     """
-    return _encode_impl(Reader(**kwargs), buf)
+    counter = _SizeCounter(**kwargs)
+
+    # Python 2 arrays have a read method, an alias of fromfile
+    if (isinstance(buf, (bytes, bytearray, array.array, memoryview)) or
+            not hasattr(buf, 'read')):
+        if not isinstance(buf, (bytes, bytearray)):
+            buf = bytearray(buf)
+        counter.feed(buf)
+    else:
+        while True:
+            chunk = buf.read(_SIZE_CHUNK_SIZE)
+            if not chunk:
+                break
+            counter.feed(chunk)
 
+    return counter.size
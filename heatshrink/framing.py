@@ -0,0 +1,681 @@
+"""Framed, multi-member heatshrink streams.
+
+A raw heatshrink stream has no header or end marker, so streams can't
+be appended to each other. The framed format stores a sequence of
+members instead, each one an independent heatshrink stream preceded
+by a fixed size header:
+
+    magic            4 bytes, MAGIC
+    flags            1 byte, see FLAG_*
+    window_sz2       1 byte
+    lookahead_sz2    1 byte
+    padding          1 byte
+    compressed_size  4 bytes, little endian
+    size             4 bytes, little endian, size of the decoded data
+
+As every member records its own size and parameters, members can be
+located without decoding them. Members are decoded independently of
+each other, unless they are flagged with FLAG_CONTINUED, in which case
+the window of the member starts out with the data of the preceding
+members (see FLUSH_SYNC). Members flagged with FLAG_STORED hold their
+data uncompressed (see STORE_IF_LARGER and STORE_AUTO).
+"""
+from __future__ import absolute_import
+import collections
+import errno
+import functools
+import io
+import os
+import struct
+
+import heatshrink.core as core
+from heatshrink.cache import file_key
+
+FORMAT_RAW = 0
+FORMAT_FRAMED = 1
+
+MAGIC = b'\x89HSM'
+
+# Member flags
+FLAG_CONTINUED = 0x01
+FLAG_STORED = 0x02
+
+# Flush modes. Both modes write out all pending data as a complete
+# member. With FLUSH_SYNC the next member keeps the current window,
+# which compresses better, while FLUSH_FULL starts the next member
+# with an empty window so that decoding can restart from it.
+FLUSH_SYNC = 2
+FLUSH_FULL = 3
+
+# Store modes, deciding when members are stored uncompressed.
+# STORE_NEVER always compresses, STORE_IF_LARGER stores members whose
+# compressed data would be larger than their data and STORE_AUTO also
+# stores members without compressing them when estimate_ratio finds
+# that compressing doesn't pay.
+STORE_NEVER = 0
+STORE_IF_LARGER = 1
+STORE_AUTO = 2
+
+# STORE_AUTO stores members with an estimated ratio of at least this
+AUTO_STORE_RATIO = 0.98
+
+# Compression levels. LEVEL_DEFAULT compresses with the given
+# parameters, LEVEL_MAX compresses every member with each of
+# MAX_LEVEL_PARAMS as well and keeps the smallest result.
+LEVEL_DEFAULT = 0
+LEVEL_MAX = 1
+
+MAX_LEVEL_PARAMS = [core.Params(window_sz2, lookahead_sz2)
+                    for window_sz2, lookahead_sz2 in [
+                        (8, 4), (10, 4), (10, 6), (12, 4),
+                        (12, 6), (14, 4), (14, 6), (14, 8)]]
+
+# Uncompressed size of the members written by default
+DEFAULT_MEMBER_SIZE = 1 << 20
+# Members can't record a size larger than this
+MAX_MEMBER_SIZE = 0xffffffff
+
+_HEADER = struct.Struct('<4sBBBxII')
+HEADER_SIZE = _HEADER.size
+
+Member = collections.namedtuple('Member', [
+    # Offset of the member header in the framed stream
+    'offset',
+    # Offset of the member's decoded data in the decoded stream
+    'start',
+    'compressed_size',
+    'size',
+    'window_sz2',
+    'lookahead_sz2',
+    'flags',
+])
+
+
+def _check_format(format):
+    if format not in (FORMAT_RAW, FORMAT_FRAMED):
+        raise ValueError('Invalid format: {!r}'.format(format))
+    return format
+
+
+def _check_store(store):
+    if store not in (STORE_NEVER, STORE_IF_LARGER, STORE_AUTO):
+        raise ValueError('Invalid store mode: {!r}'.format(store))
+    return store
+
+
+def _check_level(level):
+    if level not in (LEVEL_DEFAULT, LEVEL_MAX):
+        raise ValueError('Invalid level: {!r}'.format(level))
+    return level
+
+
+def _corrupt(msg):
+    return IOError(errno.EINVAL, 'Corrupt framed stream: {}'.format(msg))
+
+
+def pack_header(compressed_size, size, window_sz2, lookahead_sz2, flags=0):
+    """Return the header for a member with the given properties."""
+    return _HEADER.pack(MAGIC, flags, window_sz2, lookahead_sz2,
+                        compressed_size, size)
+
+
+def read_header(fp, offset=0, start=0):
+    """Read a member header from file object fp.
+
+    offset and start are recorded in the returned Member as the
+    position of the header in the file and of the member's data in
+    the decoded stream respectively.
+
+    Returns None if fp is at EOF. Throws an IOError if the
+    header is truncated or invalid.
+    """
+    header = fp.read(HEADER_SIZE)
+    if not header:
+        return None
+    if len(header) < HEADER_SIZE:
+        raise _corrupt('truncated member header at {}'.format(offset))
+    return unpack_header(header, offset, start)
+
+
+def unpack_header(header, offset=0, start=0):
+    """Return the Member described by the HEADER_SIZE bytes of header.
+
+    offset and start are recorded in the Member like in read_header.
+    Throws an IOError if the header is invalid.
+    """
+    magic, flags, window_sz2, lookahead_sz2, compressed_size, size = \
+        _HEADER.unpack(header)
+    if magic != MAGIC:
+        raise _corrupt('bad member magic at {}'.format(offset))
+    # The C decoder needs lookaheads smaller than the window
+    if (not core.MIN_WINDOW_SZ2 <= window_sz2 <= core.MAX_WINDOW_SZ2 or
+            not core.MIN_LOOKAHEAD_SZ2 <= lookahead_sz2 < window_sz2):
+        raise _corrupt('bad member parameters at {}'.format(offset))
+
+    return Member(offset, start, compressed_size, size,
+                  window_sz2, lookahead_sz2, flags)
+
+
+def read_payload(fp, member):
+    """Read the compressed data of member from fp.
+
+    fp must be positioned right after the member header.
+    """
+    payload = fp.read(member.compressed_size)
+    if len(payload) < member.compressed_size:
+        raise _corrupt('truncated member at {}'.format(member.offset))
+    return payload
+
+
+def decode_member(member, payload, window=None):
+    """Decode the compressed payload of member.
+
+    window is the decoded data preceding the member, which is
+    required if the member is flagged with FLAG_CONTINUED.
+    """
+    if member.flags & FLAG_STORED:
+        if len(payload) != member.size:
+            raise _corrupt('member at {} has wrong size'.format(
+                member.offset))
+        return bytes(payload)
+
+    if not member.flags & FLAG_CONTINUED:
+        window = None
+    elif window is None:
+        msg = 'member at {} continues a previous member'
+        raise ValueError(msg.format(member.offset))
+
+    try:
+        data = core.decode(payload,
+                           window_sz2=member.window_sz2,
+                           lookahead_sz2=member.lookahead_sz2,
+                           max_output_size=member.size,
+                           window=window)
+    except ValueError as e:
+        raise _corrupt('member at {}: {}'.format(member.offset, e))
+
+    if len(data) != member.size:
+        raise _corrupt('member at {} has wrong size'.format(member.offset))
+    return data
+
+
+def encode_member(data, store=STORE_NEVER, level=LEVEL_DEFAULT, **params):
+    """Encode data as a complete member, header included.
+
+    store is one of the STORE_* modes and level one of the LEVEL_*
+    compression levels.
+    """
+    params = core._get_params(params)
+    payload, params, flags = _encode_payload(
+        data, params, _check_store(store), _check_level(level))
+    return _member_bytes(payload, len(data), params, flags)
+
+
+def _encode_with(data, window, params):
+    return core.encode(data, params=params, window=window)
+
+
+def _encode_payload(data, params, store=STORE_NEVER, level=LEVEL_DEFAULT,
+                    window=None, map=map):
+    """Compress data as the payload of a member.
+
+    With LEVEL_MAX, data is compressed with each parameter set by
+    calling map, which may do so concurrently.
+
+    Returns the payload, the Params it was compressed with and the
+    member flags, FLAG_STORED or 0.
+    """
+    if (store == STORE_AUTO and
+            core.estimate_ratio(data, params=params) >= AUTO_STORE_RATIO):
+        return bytes(data), params, FLAG_STORED
+
+    if level == LEVEL_MAX:
+        candidates = [params] + [p for p in MAX_LEVEL_PARAMS if p != params]
+        payloads = map(functools.partial(_encode_with, data, window),
+                       candidates)
+        # The first of the smallest, so that the result is repeatable
+        payload, params = min(zip(payloads, candidates),
+                              key=lambda result: len(result[0]))
+    else:
+        payload = core.encode(data, params=params, window=window)
+
+    if store != STORE_NEVER and len(payload) >= len(data):
+        return bytes(data), params, FLAG_STORED
+    return payload, params, 0
+
+
+def _member_bytes(payload, size, params, flags=0):
+    header = pack_header(len(payload), size, params.window_sz2,
+                         params.lookahead_sz2, flags)
+    return header + payload
+
+
+def read_index(fp):
+    """Return a list of the members in framed file object fp.
+
+    Only the member headers are read. fp is read from its current
+    position, which is assumed to be the beginning of the stream.
+    Payloads are skipped by seeking if fp supports it.
+    """
+    members = []
+    offset = 0
+    start = 0
+
+    while True:
+        member = read_header(fp, offset, start)
+        if member is None:
+            return members
+
+        members.append(member)
+        offset += HEADER_SIZE + member.compressed_size
+        start += member.size
+
+        if _seekable(fp):
+            fp.seek(member.compressed_size, io.SEEK_CUR)
+        else:
+            read_payload(fp, member)
+
+
+def _check_flush_mode(mode):
+    if mode not in (FLUSH_SYNC, FLUSH_FULL):
+        raise ValueError('Invalid flush mode: {!r}'.format(mode))
+    return mode
+
+
+def _append_window(window, data, size=1 << core.MAX_WINDOW_SZ2):
+    """Return the last `size` bytes of window followed by data."""
+    if len(data) >= size:
+        return data[-size:]
+    return (window + data)[-size:]
+
+
+def _seekable(fp):
+    try:
+        return fp.seekable()
+    except AttributeError:
+        return hasattr(fp, 'seek')
+
+
+class _MemberWriter(object):
+    """Writes data to a file object as a sequence of members.
+
+    With STORE_NEVER and LEVEL_DEFAULT, the data is compressed as it is
+    written. Otherwise the data of the current member is kept until it
+    ends, so that it can be stored or compressed with several
+    parameter sets instead. With LEVEL_MAX, up to `threads` parameter
+    sets are tried concurrently. Windows larger than the streaming
+    encoder supports are compressed when the member ends as well.
+    """
+    def __init__(self, fp, member_size=DEFAULT_MEMBER_SIZE,
+                 store=STORE_NEVER, level=LEVEL_DEFAULT, threads=1,
+                 **params):
+        if not 0 < member_size <= MAX_MEMBER_SIZE:
+            raise ValueError('member_size must be between 1 and {}'.format(
+                MAX_MEMBER_SIZE))
+        if threads < 1:
+            raise ValueError('threads must be >= 1')
+
+        self._fp = fp
+        self._member_size = member_size
+        self._store = _check_store(store)
+        self._level = _check_level(level)
+        self._threads = threads
+        self._pool = None
+        self._params = core._get_params(params)
+        # Most recently written data, for continued members
+        self._window = b''
+        self._start_member(continued=False)
+
+    def _start_member(self, continued):
+        window = self._window if continued else None
+        if (self._store == STORE_NEVER and self._level == LEVEL_DEFAULT and
+                self._params.window_sz2 <= core.MAX_WRITER_WINDOW_SZ2):
+            self._encoder = core.Encoder(core.Writer(self._params,
+                                                     window=window))
+        else:
+            self._encoder = None
+            self._member_window = window
+        self._flags = FLAG_CONTINUED if continued else 0
+        # Compressed chunks of the current member, or its data if it
+        # is compressed once it ends
+        self._chunks = []
+        # Uncompressed size of the current member
+        self._size = 0
+
+    def write(self, data):
+        offset = 0
+        while offset < len(data):
+            chunk = bytes(data[offset:offset + self._member_size - self._size])
+            if self._encoder is not None:
+                self._chunks.append(self._encoder.fill(chunk))
+            else:
+                self._chunks.append(chunk)
+            self._window = _append_window(self._window, chunk)
+            self._size += len(chunk)
+            offset += len(chunk)
+
+            if self._size >= self._member_size:
+                self.end_member()
+
+    def _map(self, func, iterable):
+        """Map func over iterable, concurrently if threads > 1."""
+        if self._threads == 1:
+            return list(map(func, iterable))
+        if self._pool is None:
+            # Only imported when needed, it's slow to import
+            from multiprocessing.pool import ThreadPool
+            self._pool = ThreadPool(self._threads)
+        return self._pool.map(func, iterable)
+
+    def _write_member(self):
+        flags = self._flags
+        params = self._params
+        if self._encoder is not None:
+            self._chunks.append(self._encoder.finish())
+            payload = b''.join(self._chunks)
+        else:
+            payload, params, stored = _encode_payload(
+                b''.join(self._chunks), params, self._store, self._level,
+                self._member_window, self._map)
+            flags |= stored
+        self._fp.write(_member_bytes(payload, self._size, params, flags))
+
+    def end_member(self, continued=False):
+        """Write out the current member, if it contains any data.
+
+        If continued is True, the next member starts out with the
+        window of the current one.
+        """
+        if self._size:
+            self._write_member()
+        elif continued or not self._flags:
+            # Nothing was written to the current member, keep it
+            return
+
+        self._start_member(continued)
+
+    def flush(self, mode):
+        if mode is None:
+            return
+        self.end_member(continued=_check_flush_mode(mode) == FLUSH_SYNC)
+
+    def close(self):
+        try:
+            if self._size:
+                self._write_member()
+        finally:
+            self._encoder = None
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
+
+
+class _MemberParser(object):
+    """Decodes a framed stream that is received in arbitrary pieces.
+
+    Members larger than max_member_size, decoded, are rejected as
+    corrupt as soon as their header is received, so that a peer can't
+    make the parser buffer or decode more than that at a time.
+    """
+    def __init__(self, max_member_size=DEFAULT_MEMBER_SIZE):
+        if not 0 < max_member_size <= MAX_MEMBER_SIZE:
+            raise ValueError('max_member_size must be between 1 and '
+                             '{}'.format(MAX_MEMBER_SIZE))
+        self._max_member_size = max_member_size
+        # Literals take 9 bits, anything larger doesn't decode to a
+        # member within the limit
+        self._max_compressed_size = (max_member_size +
+                                     max_member_size // 8 + 2)
+        # Received data of the incomplete next member
+        self._buf = bytearray()
+        # Offset and decoded start of the next member
+        self._offset = 0
+        self._start = 0
+        # Most recently decoded data, for continued members
+        self._window = b''
+
+    def feed(self, data):
+        """Return the decoded data of the members completed by data."""
+        self._buf += data
+        decoded = []
+        while len(self._buf) >= HEADER_SIZE:
+            member = unpack_header(bytes(self._buf[:HEADER_SIZE]),
+                                   self._offset, self._start)
+            if (member.size > self._max_member_size or
+                    member.compressed_size > self._max_compressed_size):
+                raise _corrupt('member at {} is larger than {} bytes'.format(
+                    self._offset, self._max_member_size))
+            end = HEADER_SIZE + member.compressed_size
+            if len(self._buf) < end:
+                break
+
+            payload = bytes(self._buf[HEADER_SIZE:end])
+            del self._buf[:end]
+            data = decode_member(member, payload, self._window)
+            self._window = _append_window(self._window, data)
+            self._offset += end
+            self._start += member.size
+            decoded.append(data)
+        return b''.join(decoded)
+
+    def close(self):
+        """Check that the stream didn't end in the middle of a member."""
+        if self._buf:
+            raise _corrupt('truncated member at {}'.format(self._offset))
+
+
+class _MemberReader(io.RawIOBase):
+    """Adapts a framed stream to a RawIOBase reader API.
+
+    Members are read sequentially from the underlying file. When
+    `threads` is larger than 1, the next members are decoded
+    concurrently on a pool of threads and returned in order. Continued
+    members depend on the data before them and are always decoded
+    in order.
+    """
+    def __init__(self, fp, threads=1, max_output_size=None, cache=None):
+        if threads < 1:
+            raise ValueError('threads must be >= 1')
+
+        self._fp = fp
+        self._threads = threads
+        self._max_output_size = max_output_size
+        self._pool = None
+
+        # Decoded members are cached by their offset in the file
+        self._cache = None
+        self._cache_id = file_key(fp) if cache is not None else None
+        if self._cache_id is not None:
+            self._cache = cache
+
+        # Member index, built lazily when seeking
+        self._index = None
+        self._rewind()
+
+    def _rewind(self):
+        """Reset the reader to the beginning of the stream."""
+        # Position in file (decompressed)
+        self._pos = 0
+        # Decoded data of the current member
+        self._buf = b''
+        self._buf_offset = 0
+        # Offset and decoded start of the next member header to read
+        self._next_offset = 0
+        self._next_start = 0
+        self._eof = False
+        # Most recently decoded data, for continued members
+        self._window = b''
+        # Functions returning the decoded data of the members that
+        # have been read, but not yet returned, in order.
+        self._pending = collections.deque()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+        self._pending.clear()
+        # Don't close self._fp directly because we don't own it.
+        return super(_MemberReader, self).close()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return _seekable(self._fp)
+
+    def readinto(self, b):
+        buf = self.read(len(b))
+        b[:len(buf)] = buf
+        return len(buf)
+
+    def _read_member(self):
+        """Read the next member from the file, returns False at EOF."""
+        member = read_header(self._fp, self._next_offset, self._next_start)
+        if member is None:
+            return False
+
+        payload = read_payload(self._fp, member)
+        self._next_offset += HEADER_SIZE + member.compressed_size
+        self._next_start += member.size
+
+        cached = None
+        if self._cache is not None:
+            cached = self._cache.get((self._cache_id, member.offset))
+
+        if (self._max_output_size is not None and
+                member.start + member.size > self._max_output_size):
+            # Don't decode members that would go over the limit
+            self._pending.append(self._exceeded)
+        elif cached is not None:
+            self._pending.append(lambda window: cached)
+        elif self._threads > 1 and not member.flags & FLAG_CONTINUED:
+            if self._pool is None:
+                # Only imported when needed, it's slow to import
+                from multiprocessing.pool import ThreadPool
+                self._pool = ThreadPool(self._threads)
+            result = self._pool.apply_async(decode_member, (member, payload))
+            self._pending.append(
+                lambda window: self._cache_member(member, result.get()))
+        else:
+            # Decoded once the preceding data is known
+            self._pending.append(lambda window: self._cache_member(
+                member, decode_member(member, payload, window)))
+        return True
+
+    def _cache_member(self, member, data):
+        """Add the decoded data of member to the cache, returns data."""
+        if self._cache is not None:
+            self._cache.put((self._cache_id, member.offset), data)
+        return data
+
+    def _exceeded(self, window):
+        msg = 'Decoded data exceeds max_output_size ({} bytes)'
+        raise ValueError(msg.format(self._max_output_size))
+
+    def _refill(self):
+        """Move on to the next member.
+
+        Throws a EOFError when all members have been read.
+        """
+        # Keep up to `threads` members in flight
+        while not self._eof and len(self._pending) < self._threads:
+            if not self._read_member():
+                self._eof = True
+
+        if not self._pending:
+            raise EOFError
+
+        self._buf = self._pending.popleft()(self._window)
+        self._buf_offset = 0
+        self._window = _append_window(self._window, self._buf)
+
+    def read(self, size=-1):
+        if size < 0:
+            return self.readall()
+
+        if not size:
+            return b''
+
+        while self._buf_offset >= len(self._buf):
+            try:
+                self._refill()
+            except EOFError:
+                return b''
+
+        data = self._buf[self._buf_offset:self._buf_offset + size]
+        self._buf_offset += len(data)
+        self._pos += len(data)
+        return data
+
+    @property
+    def index(self):
+        """List of all the members in the stream."""
+        if self._index is None:
+            position = self._fp.tell()
+            try:
+                self._fp.seek(0)
+                self._index = read_index(self._fp)
+            finally:
+                self._fp.seek(position)
+        return self._index
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        index = self.index
+        size = index[-1].start + index[-1].size if index else 0
+
+        # Recalculate offset as an absolute file position.
+        if whence == io.SEEK_SET:
+            pass
+        elif whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += size
+        else:
+            raise ValueError('Invalid value for whence: {}'.format(whence))
+
+        if offset < 0:
+            msg = '[Error {code}] {msg}'
+            raise IOError(msg.format(code=errno.EINVAL,
+                                     msg=os.strerror(errno.EINVAL)))
+
+        offset = min(offset, size)
+        # Position within the current member if possible
+        buf_start = self._pos - self._buf_offset
+        if buf_start <= offset <= buf_start + len(self._buf):
+            self._buf_offset = offset - buf_start
+            self._pos = offset
+            return self._pos
+
+        # Jump to the member containing the offset, or to the
+        # member it continues from.
+        self._rewind()
+        for i, member in enumerate(index):
+            if member.start + member.size > offset:
+                while i > 0 and index[i].flags & FLAG_CONTINUED:
+                    i -= 1
+                member = index[i]
+
+                self._fp.seek(member.offset)
+                self._next_offset = member.offset
+                self._next_start = member.start
+                self._pos = member.start
+                break
+        else:
+            self._fp.seek(index[-1].offset + HEADER_SIZE +
+                          index[-1].compressed_size if index else 0)
+            self._eof = True
+            self._pos = size
+            return self._pos
+
+        # Read and discard data until we reach the desired position
+        offset -= self._pos
+        while offset > 0:
+            data = self.read(offset)
+            if not data:
+                break
+            offset -= len(data)
+
+        return self._pos
+
+    def tell(self):
+        return self._pos
@@ -0,0 +1,228 @@
+"""Encoding and decoding many buffers on a pool of processes.
+
+For batch jobs where the work around encoding is Python code, which
+threads can't run in parallel, map_encode and map_decode spread the
+buffers of an iterable over worker processes:
+
+    >>> for encoded in heatshrink.parallel.map_encode(buffers, processes=4):
+    ...     out.write(encoded)
+
+Buffers are sent to the workers in batches of `chunksize`. Each batch,
+and the results of each batch, are passed in a single shared memory
+block (see multiprocessing.shared_memory, Python 3.8+) instead of
+being pickled through a pipe. On older versions they are pickled.
+
+Results are yielded in the order of the input, as soon as they are
+ready. Only a few batches per process are in flight at a time, so long
+iterables aren't read ahead entirely, and stopping early only waits
+for those.
+"""
+from __future__ import absolute_import
+import collections
+import multiprocessing
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    # Python < 3.8, buffers are pickled instead
+    resource_tracker = shared_memory = None
+
+import heatshrink.core as core
+
+# Number of batches queued or being processed per worker process
+_PENDING_PER_PROCESS = 2
+
+# Functions applied to the buffers of batches, which are memoryviews
+# of shared memory or bytes
+_VIEW_FUNCTIONS = {'encode': core._encode_view, 'decode': core._decode_view}
+
+
+def _as_view(buf):
+    """Return a memoryview of the bytes of buf."""
+    try:
+        view = memoryview(buf)
+    except TypeError:
+        # Iterables of integers, as accepted by encode
+        return memoryview(bytearray(buf))
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    return view
+
+
+def _pack(buffers):
+    """Return a picklable batch holding a copy of buffers.
+
+    A batch is a (block name, sizes) tuple, or (None, list of bytes)
+    without shared memory. The block is freed by _unpack or _release.
+    """
+    views = [_as_view(buf) for buf in buffers]
+    if shared_memory is None:
+        return None, [view.tobytes() for view in views]
+
+    sizes = [view.nbytes for view in views]
+    # Empty blocks aren't allowed
+    block = shared_memory.SharedMemory(create=True, size=max(sum(sizes), 1))
+    try:
+        offset = 0
+        for view, size in zip(views, sizes):
+            block.buf[offset:offset + size] = view
+            offset += size
+    except BaseException:
+        block.close()
+        block.unlink()
+        raise
+    block.close()
+    return block.name, sizes
+
+
+def _unpack(batch):
+    """Return the buffers of batch as a list of bytes and free it."""
+    name, data = batch
+    if name is None:
+        return data
+
+    block = shared_memory.SharedMemory(name)
+    try:
+        buffers = []
+        offset = 0
+        for size in data:
+            buffers.append(bytes(block.buf[offset:offset + size]))
+            offset += size
+        return buffers
+    finally:
+        block.close()
+        block.unlink()
+
+
+def _release(batch):
+    """Free the shared memory of a batch that isn't unpacked."""
+    name, _ = batch
+    if name is None:
+        return
+    try:
+        block = shared_memory.SharedMemory(name)
+    except (IOError, OSError):
+        return
+    block.close()
+    block.unlink()
+
+
+def _run_batch(task):
+    """Apply a function to each buffer of a batch.
+
+    This is the function that is run in the worker processes. The
+    buffers are read from shared memory in place, the results are
+    returned as a new batch.
+    """
+    name, batch, kwargs = task
+    func = _VIEW_FUNCTIONS[name]
+    block_name, data = batch
+    if block_name is None:
+        return _pack([func(buf, **kwargs) for buf in data])
+
+    block = shared_memory.SharedMemory(block_name)
+    try:
+        results = []
+        offset = 0
+        for size in data:
+            view = block.buf[offset:offset + size]
+            try:
+                results.append(func(view, **kwargs))
+            finally:
+                view.release()
+            offset += size
+    finally:
+        block.close()
+    return _pack(results)
+
+
+def _batches(iterable, chunksize):
+    """Yield lists of up to chunksize items of iterable."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == chunksize:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _collect(batch, result):
+    """Return the results of a batch that was sent to the pool."""
+    try:
+        output = result.get()
+    finally:
+        _release(batch)
+    return _unpack(output)
+
+
+def _map_pool(name, iterable, processes, chunksize, kwargs):
+    if resource_tracker is not None:
+        # Workers inherit the running tracker, which then also tracks
+        # the result blocks they create until they are unlinked here.
+        resource_tracker.ensure_running()
+
+    pool = multiprocessing.Pool(processes)
+    # (batch, AsyncResult) of the batches sent to the pool, in order
+    pending = collections.deque()
+    try:
+        for items in _batches(iterable, chunksize):
+            batch = _pack(items)
+            pending.append((batch, pool.apply_async(
+                _run_batch, ((name, batch, kwargs),))))
+            if len(pending) >= processes * _PENDING_PER_PROCESS:
+                for result in _collect(*pending.popleft()):
+                    yield result
+
+        while pending:
+            for result in _collect(*pending.popleft()):
+                yield result
+        pool.close()
+    finally:
+        # Let the batches that weren't collected finish before stopping
+        # the workers, which could otherwise be killed after creating
+        # the block of their results, and free their blocks.
+        for batch, result in pending:
+            result.wait()
+            _release(batch)
+            if result.successful():
+                _release(result.get())
+        pool.terminate()
+        pool.join()
+
+
+def _map(name, iterable, processes, chunksize, kwargs):
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes < 1:
+        raise ValueError('processes must be >= 1')
+    if chunksize < 1:
+        raise ValueError('chunksize must be >= 1')
+    # Check the parameters here rather than in every worker
+    core._get_params(kwargs)
+
+    if processes == 1:
+        func = _VIEW_FUNCTIONS[name]
+        return (func(_as_view(buf), **kwargs) for buf in iterable)
+    return _map_pool(name, iterable, processes, chunksize, kwargs)
+
+
+def map_encode(iterable, processes=None, chunksize=1, **kwargs):
+    """Encode each buffer of iterable on a pool of processes.
+
+    Returns an iterator of the encoded byte strings, in order. Up to
+    `chunksize` buffers are sent to a worker process at a time, use
+    larger batches for many small buffers. processes defaults to the
+    number of CPUs, with a single process the buffers are encoded in
+    this process. kwargs are passed to heatshrink.encode.
+    """
+    return _map('encode', iterable, processes, chunksize, kwargs)
+
+
+def map_decode(iterable, processes=None, chunksize=1, **kwargs):
+    """Decode each buffer of iterable on a pool of processes.
+
+    Like map_encode, with kwargs passed to heatshrink.decode. Errors
+    raised while decoding a buffer are raised by the iterator.
+    """
+    return _map('decode', iterable, processes, chunksize, kwargs)
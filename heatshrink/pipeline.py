@@ -0,0 +1,224 @@
+"""Background threads for EncodedFile.
+
+A pipelined writer hands written data to a compressor thread and the
+compressed data to a writer thread, so that compression and slow I/O
+overlap with each other and with the caller:
+
+    >>> with heatshrink.open('data.hs', 'wb', pipeline=8) as fp:
+    ...     for chunk in produce():
+    ...         fp.write(chunk)
+
+Similarly, read-ahead reads and decodes the next chunks of a file on a
+background thread while the caller processes the current one:
+
+    >>> with heatshrink.open('data.hs', read_ahead=4) as fp:
+    ...     for line in fp:
+    ...         process(line)
+
+The encoder and decoder release the GIL while processing data, so the
+threads run in parallel with Python code in the caller's thread.
+"""
+from __future__ import absolute_import
+import array
+import threading
+try:
+    import queue
+    unicode = str
+except ImportError:
+    import Queue as queue
+
+# Sentinel stopping the pipeline threads
+_STOP = object()
+
+# Maximum size of the chunks decoded by read-ahead
+_READ_AHEAD_CHUNK_SIZE = 64 << 10
+
+
+def _start_thread(target, name):
+    thread = threading.Thread(target=target, name=name)
+    # Don't keep the interpreter alive for files that weren't closed
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+class _QueueFile(object):
+    """File-like object that puts written data in a queue."""
+    def __init__(self, items):
+        self._items = items
+
+    def write(self, data):
+        if data:
+            self._items.put(data)
+
+
+class _PipelinedWriter(object):
+    """Compresses and writes data to fp on background threads.
+
+    writer_factory is called with a file object to create the writer
+    doing the compression (see _CompressWriter and _MemberWriter).
+    At most `depth` chunks wait to be compressed and `depth`
+    compressed chunks wait to be written, write blocks when the
+    pipeline is full.
+
+    Errors raised on the threads are raised by the next call to
+    write, flush or close. Once an error occurred, all further
+    data is discarded.
+    """
+    def __init__(self, fp, writer_factory, depth):
+        if depth < 1:
+            raise ValueError('pipeline depth must be >= 1')
+
+        self._fp = fp
+        self._error = None
+        self._input = queue.Queue(depth)
+        self._output = queue.Queue(depth)
+        self._writer = writer_factory(_QueueFile(self._output))
+        self._threads = [
+            _start_thread(self._compress, 'heatshrink-compress'),
+            _start_thread(self._write, 'heatshrink-write'),
+        ]
+
+    def _run(self, items, func):
+        """Call func with each item of the items queue, until stopped."""
+        while True:
+            item = items.get()
+            try:
+                if item is _STOP:
+                    return
+                if self._error is None:
+                    func(item)
+            except BaseException as e:
+                self._error = e
+            finally:
+                items.task_done()
+
+    def _compress(self):
+        self._run(self._input, self._writer.write)
+
+    def _write(self):
+        self._run(self._output, self._fp.write)
+
+    def _check_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _drain(self):
+        """Wait until all queued data has been written."""
+        # Compressed data is queued before the input is marked done,
+        # so the output queue holds everything once the input is empty.
+        self._input.join()
+        self._output.join()
+        self._check_error()
+
+    def write(self, data):
+        self._check_error()
+        if isinstance(data, (unicode, memoryview)):
+            msg = "Cannot fill encoder with type '{.__name__}'"
+            raise TypeError(msg.format(data.__class__))
+        if not isinstance(data, bytes):
+            # Copy, the caller may reuse the buffer once write returns
+            data = array.array('B', data)
+        self._input.put(data)
+
+    def flush(self, mode):
+        self._drain()
+        # The threads are idle, the writer can be used from this thread
+        if mode is not None:
+            self._writer.flush(mode)
+            self._drain()
+
+    def close(self):
+        try:
+            self._drain()
+            self._writer.close()
+            self._drain()
+        finally:
+            self._input.put(_STOP)
+            self._output.put(_STOP)
+            for thread in self._threads:
+                thread.join()
+
+
+class _ReadAheadEnd(object):
+    """Last item queued by the read-ahead thread."""
+    def __init__(self, error=None):
+        self.error = error
+
+
+class _ReadAhead(object):
+    """Reads and decodes fp on a background thread.
+
+    The data read from fp is decoded with decoder (a core.Encoder),
+    which belongs to the thread from then on. Up to `depth` decoded
+    chunks are queued for get. lock is held while reading from fp, so
+    that others can use fp in between.
+    """
+    def __init__(self, fp, decoder, depth, read_size, lock):
+        if depth < 1:
+            raise ValueError('read_ahead must be >= 1')
+
+        self._fp = fp
+        self._decoder = decoder
+        self._read_size = read_size
+        self._lock = lock
+        self._chunks = queue.Queue(depth)
+        self._stopped = False
+        self._end = None
+        self._thread = _start_thread(self._run, 'heatshrink-read-ahead')
+
+    def _decode_next(self):
+        """Return the next decoded chunk, or None at the end."""
+        decoder = self._decoder
+        if decoder.finished:
+            return None
+
+        if decoder.needs_input:
+            with self._lock:
+                raw_chunk = self._fp.read(self._read_size)
+            if not raw_chunk:
+                return decoder.finish()
+        else:
+            # Resume decoding the previously read chunk
+            raw_chunk = b''
+        return decoder.fill(raw_chunk, _READ_AHEAD_CHUNK_SIZE)
+
+    def _run(self):
+        end = _ReadAheadEnd()
+        try:
+            while not self._stopped:
+                data = self._decode_next()
+                if data is None:
+                    break
+                if data:
+                    self._chunks.put(data)
+        except BaseException as e:
+            end.error = e
+        finally:
+            self._chunks.put(end)
+
+    def get(self):
+        """Return the next decoded chunk.
+
+        Raises EOFError once all data has been decoded, or the error
+        that stopped the thread.
+        """
+        if self._end is None:
+            data = self._chunks.get()
+            if not isinstance(data, _ReadAheadEnd):
+                return data
+            self._end = data
+
+        if self._end.error is not None:
+            raise self._end.error
+        raise EOFError
+
+    def close(self):
+        """Stop the thread, discarding the chunks decoded ahead."""
+        self._stopped = True
+        # Unblock the thread, until it queues its last item
+        while self._end is None:
+            data = self._chunks.get()
+            if isinstance(data, _ReadAheadEnd):
+                self._end = data
+        self._thread.join()
@@ -0,0 +1,79 @@
+"""Searching compressed files line by line.
+
+grep yields the lines of a compressed file that contain a pattern,
+together with their position in the decompressed data:
+
+    >>> for match in heatshrink.grep('app.log.hs', b'ERROR'):
+    ...     print(match.lineno, match.line)
+
+The file is decoded in large chunks, which are searched as a whole
+with bytes.find or the regular expression engine. Only the matching
+lines are extracted, so lines that don't match cost next to nothing.
+match.offset can be passed to EncodedFile.seek to resume reading at
+the matching line.
+"""
+from __future__ import absolute_import
+import collections
+try:
+    unicode
+except NameError:
+    unicode = str
+
+from heatshrink.streams import _LINE_CHUNK_SIZE, EncodedFile, _line_blocks
+
+class GrepMatch(collections.namedtuple('GrepMatch',
+                                       ['lineno', 'offset', 'line'])):
+    """A line matched by grep.
+
+    lineno is the 1-based line number, offset is the position of the
+    start of the line in the decompressed data and line the line itself,
+    including its newline.
+    """
+    __slots__ = ()
+
+
+def _finder(pattern):
+    """Return find(data, start, end) for pattern, like bytes.find."""
+    if hasattr(pattern, 'search'):
+        def find(data, start, end):
+            match = pattern.search(data, start, end)
+            return -1 if match is None else match.start()
+        return find
+
+    if isinstance(pattern, unicode):
+        raise TypeError('pattern must be bytes or a compiled bytes pattern')
+    pattern = bytes(pattern)
+
+    def find(data, start, end):
+        return data.find(pattern, start, end)
+    return find
+
+
+def grep(filename, pattern, chunk_size=_LINE_CHUNK_SIZE, **kwargs):
+    """Yield a GrepMatch for each line of a compressed file containing
+    pattern.
+
+    filename is a filename or file object, as for heatshrink.open,
+    which is also passed kwargs. pattern is a byte string or a compiled
+    regular expression of bytes. Regular expressions are searched
+    from each line start, so use re.MULTILINE to anchor them with ^
+    and $.
+    """
+    find = _finder(pattern)
+    with EncodedFile(filename, 'rb', **kwargs) as fp:
+        lineno = 1
+        for offset, data, end in _line_blocks(fp, chunk_size):
+            # Newlines before `counted` have been added to lineno
+            pos = counted = 0
+            while pos < end:
+                found = find(data, pos, end)
+                if found < 0:
+                    break
+
+                start = data.rfind(b'\n', pos, found) + 1 or pos
+                stop = data.find(b'\n', found, end) + 1 or end
+                lineno += data.count(b'\n', counted, start)
+                counted = start
+                yield GrepMatch(lineno, offset + start, data[start:stop])
+                pos = stop
+            lineno += data.count(b'\n', counted, end)
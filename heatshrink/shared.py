@@ -0,0 +1,165 @@
+"""Decoded data shared between processes.
+
+Processes that all need the decoded contents of the same compressed
+file can map a single decoded copy instead of each decoding it:
+
+    >>> data = heatshrink.open_shared('assets.hs')
+    >>> data[:10]
+
+The first process decodes the file to a cache file named after a hash
+of the compressed contents and the decoding parameters. Every process,
+including later ones, maps the cache file read-only, so the decoded
+data is only held once by the operating system page cache.
+
+Cache files are only used if they are owned by the current user and
+can't be modified by others, and the default cache directory is
+private to the user.
+"""
+from __future__ import absolute_import
+import errno
+import hashlib
+import mmap
+import os
+import stat
+import tempfile
+try:
+    from builtins import open as builtin_open
+except ImportError:
+    from __builtin__ import open as builtin_open
+
+import heatshrink.core as core
+from heatshrink.cache import window_key
+from heatshrink.framing import FORMAT_RAW, _check_format
+from heatshrink.streams import EncodedFile
+
+
+def _default_cache_dir():
+    name = 'heatshrink'
+    if hasattr(os, 'getuid'):
+        # The temporary directory is shared by all users
+        name += '-{}'.format(os.getuid())
+    return os.path.join(tempfile.gettempdir(), name)
+
+
+# Default directory of the decoded cache files, only accessible by the
+# current user
+DEFAULT_CACHE_DIR = _default_cache_dir()
+
+_CHUNK_SIZE = 1 << 20
+
+# Atomically replaces existing files on all platforms (Python 3)
+_replace = getattr(os, 'replace', os.rename)
+
+
+def _makedirs(path, mode=0o777):
+    """Create directory path, unless it already exists."""
+    try:
+        os.makedirs(path, mode)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+
+def _check_owner(path, st, mode_mask):
+    """Throws an IOError if path isn't owned by the current user or any
+    of the permissions of mode_mask are set.
+
+    Without user ids (Windows), nothing is checked.
+    """
+    if not hasattr(os, 'getuid'):
+        return
+    if st.st_uid != os.getuid() or st.st_mode & mode_mask:
+        msg = '{} is not private to the current user'.format(path)
+        raise IOError(errno.EPERM, msg)
+
+
+def _private_dir(path):
+    """Create directory path only accessible by the current user, or
+    check that an existing one is."""
+    _makedirs(path, 0o700)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        msg = '{} is not a directory'.format(path)
+        raise IOError(errno.ENOTDIR, msg)
+    _check_owner(path, st, 0o077)
+
+
+def cache_path(filename, cache_dir=None, format=FORMAT_RAW, **params):
+    """Return the path of the decoded cache file of filename.
+
+    The name is a hash of the compressed contents, so it changes
+    whenever the file does, followed by the decoding parameters.
+    """
+    window = params.get('window')
+    params = core._get_params(params)
+
+    digest = hashlib.sha256()
+    with builtin_open(filename, 'rb') as fp:
+        while True:
+            chunk = fp.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+
+    name = '{}-{}-{}-{}'.format(digest.hexdigest(), _check_format(format),
+                                params.window_sz2, params.lookahead_sz2)
+    if window is not None:
+        name += '-' + window_key(window)
+    return os.path.join(cache_dir or DEFAULT_CACHE_DIR, name)
+
+
+def _decode_to(path, filename, **kwargs):
+    """Decode filename to a new file at path."""
+    directory = os.path.dirname(path)
+    _makedirs(directory)
+
+    # Decode to a temporary file first, so other processes never see
+    # a partially written cache file.
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as dst:
+            with EncodedFile(filename, 'rb', **kwargs) as src:
+                while True:
+                    chunk = src.read(_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+        _replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def open_shared(filename, cache_dir=None, **kwargs):
+    """Return the decoded contents of filename, shared between processes.
+
+    The data is decoded to a cache file in cache_dir (DEFAULT_CACHE_DIR
+    by default) once, unless a cache file for the same compressed
+    contents and parameters already exists. The cache file is then
+    mapped in to memory read-only. An IOError is raised if the cache
+    file, or DEFAULT_CACHE_DIR, could have been modified by another
+    user.
+
+    kwargs are the EncodedFile arguments used to decode the file, such
+    as format, window_sz2 and lookahead_sz2.
+
+    Returns a read-only mmap.mmap, or b'' if the decoded data is
+    empty (empty files can't be mapped).
+    """
+    if cache_dir is None:
+        _private_dir(DEFAULT_CACHE_DIR)
+
+    path = cache_path(filename, cache_dir, **kwargs)
+    if not os.path.exists(path):
+        # Processes racing here decode the same data, the last one to
+        # finish replaces the cache file with an identical copy.
+        _decode_to(path, filename, **kwargs)
+
+    with builtin_open(path, 'rb') as fp:
+        st = os.fstat(fp.fileno())
+        # Writable by the group or others
+        _check_owner(path, st, 0o022)
+        if not st.st_size:
+            return b''
+        # The mapping stays valid after the file is closed
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
@@ -2,7 +2,7 @@ from __future__ import absolute_import
 import errno
 import io
 import os
-from threading import RLock
+from threading import Lock, RLock
 try:
     from builtins import open as builtin_open
     unicode = str
@@ -10,8 +10,44 @@ except ImportError:
     from __builtin__ import open as builtin_open
 
 import heatshrink.core as core
+from heatshrink.cache import file_key, window_key
+from heatshrink.framing import (DEFAULT_MEMBER_SIZE, FLUSH_FULL, FLUSH_SYNC,
+                                FORMAT_FRAMED, FORMAT_RAW, LEVEL_DEFAULT,
+                                STORE_NEVER, _check_flush_mode, _check_format,
+                                _check_level, _check_store, _MemberReader,
+                                _MemberWriter)
+from heatshrink.pipeline import _PipelinedWriter, _ReadAhead
 
 _READ_BUFFER_SIZE = io.DEFAULT_BUFFER_SIZE
+# Size of the chunks decoded by iter_lines and grep
+_LINE_CHUNK_SIZE = 256 << 10
+
+
+def _line_blocks(fp, chunk_size):
+    """Read the rest of fp in blocks of complete lines.
+
+    Yields (offset, data, end) tuples, where data[:end] holds the
+    complete lines found in data and offset is the position of data
+    in fp. The last block may end without a newline.
+    """
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be >= 1')
+
+    offset = fp.tell()
+    rest = b''
+    while True:
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            if rest:
+                yield offset, rest, len(rest)
+            return
+
+        data = rest + chunk if rest else chunk
+        end = data.rfind(b'\n') + 1
+        if end:
+            yield offset, data, end
+            offset += end
+        rest = data[end:]
 
 
 class _DecompressReader(io.RawIOBase):
@@ -21,11 +57,20 @@ class _DecompressReader(io.RawIOBase):
     decompression modules. See github for more details:
     https://github.com/python/cpython/blob/3.6/Lib/_compression.py#L33
     """
-    def __init__(self, fp, reader_factory, **reader_args):
+    def __init__(self, fp, reader_factory, max_output_size=None,
+                 cache=None, read_ahead=0, **reader_args):
+        if read_ahead < 0:
+            raise ValueError('read_ahead must be >= 0')
+
         self._fp = fp
         self._eof = False
+        # Maximum number of bytes that may be decompressed
+        self._max_output_size = max_output_size
         # Position in file (decompressed)
         self._pos = 0
+        # Number of bytes decompressed by the decoder. This is ahead
+        # or behind of self._pos when reading from the cache.
+        self._decoded = 0
         # Decompressed data
         self._buf = b''
         self._buf_offset = 0
@@ -38,12 +83,33 @@ class _DecompressReader(io.RawIOBase):
 
         self._decoder = self._new_decoder()
 
+        # Number of chunks decoded ahead on a background thread, which
+        # is started by the first read.
+        self._read_ahead_depth = read_ahead
+        self._read_ahead = None
+        # Held while self._fp is used, once the thread is started
+        self._fp_lock = Lock()
+
+        # Blocks are only cached for files that can be identified
+        self._cache = None
+        key = file_key(fp) if cache is not None else None
+        if key is not None:
+            self._cache = cache
+            self._cache_id = (key, core._get_params(reader_args),
+                              window_key(reader_args.get('window')))
+
     def _new_decoder(self):
         """Create a new decoder using the reader factory and args."""
         reader = self._reader_factory(**self._reader_args)
         return core.Encoder(reader)
 
+    def _stop_read_ahead(self):
+        if self._read_ahead is not None:
+            self._read_ahead.close()
+            self._read_ahead = None
+
     def close(self):
+        self._stop_read_ahead()
         self._decoder = None
         # Don't close self._fp directly because we don't own it.
         return super(_DecompressReader, self).close()
@@ -67,39 +133,63 @@ class _DecompressReader(io.RawIOBase):
         b[:len(buf)] = buf
         return len(buf)
 
-    def _refill(self):
+    def _refill(self, size):
         """Refill internal decompress buffer with file data.
 
+        At most `size` bytes are decompressed, any remaining input
+        is kept in the decoder until the next call.
+
         Throws a EOFError when all data has been read and
         the decoder has been finalized.
         """
+        if self._read_ahead_depth:
+            # The decoder is owned by the read-ahead thread
+            if self._read_ahead is None:
+                self._read_ahead = _ReadAhead(
+                    self._fp, self._decoder, self._read_ahead_depth,
+                    _READ_BUFFER_SIZE, self._fp_lock)
+            self._buf_offset = 0
+            self._buf = self._read_ahead.get()
+            return
+
         # Concecutive calls should be ignored
         if self._decoder.finished:
             raise EOFError
 
         self._buf_offset = 0
 
-        raw_chunk = self._fp.read(_READ_BUFFER_SIZE)
-        if raw_chunk:
-            self._buf = self._decoder.fill(raw_chunk)
+        if self._decoder.needs_input:
+            raw_chunk = self._fp.read(_READ_BUFFER_SIZE)
+            if not raw_chunk:
+                # Finalize internal decoder.
+                self._buf = self._decoder.finish()
+                return
         else:
-            # Finalize internal decoder.
-            self._buf = self._decoder.finish()
-            raise EOFError
+            # Resume decoding the previously read chunk
+            raw_chunk = b''
 
-    def read(self, size=-1):
-        if size < 0:
-            return self.readall()
+        self._buf = self._decoder.fill(raw_chunk, size)
+
+    def _decode(self, size):
+        """Return up to `size` bytes from the decoder.
 
-        if not size or self._eof:
+        Returns b'' when all data has been decoded.
+        """
+        if self._eof:
             return b''
 
-        if self._buf_offset >= len(self._buf):
+        if self._max_output_size is not None:
+            # Don't buffer data beyond the limit, but read a single
+            # byte past it to find out if the stream is too large.
+            size = min(size, max(self._max_output_size - self._decoded, 1))
+
+        while self._buf_offset >= len(self._buf):
             try:
-                self._refill()
+                self._refill(size)
             except EOFError:
                 self._eof = True
-                self._size = self._pos
+                self._size = self._decoded
+                return b''
 
         # TODO: Clean up
         data = self._buf[
@@ -107,20 +197,119 @@ class _DecompressReader(io.RawIOBase):
             self._buf_offset + size
         ]
         self._buf_offset += size
+        self._decoded += len(data)
+
+        self._check_output_size(self._decoded)
+        return data
+
+    def _check_output_size(self, size):
+        """Throws a ValueError if `size` decoded bytes exceed
+        max_output_size."""
+        if (self._max_output_size is not None and
+                size > self._max_output_size):
+            msg = 'Decoded data exceeds max_output_size ({} bytes)'
+            raise ValueError(msg.format(self._max_output_size))
+
+    def _decode_block(self, start):
+        """Return the block of decoded data starting at `start`.
+
+        The blocks decoded on the way are added to the cache. Returns
+        b'' if the block is past the end of the stream.
+        """
+        if start < self._decoded:
+            self._rewind_decoder()
+
+        block_size = self._cache.block_size
+        while True:
+            block_start = self._decoded
+            chunks = []
+            remaining = block_size
+            if self._max_output_size is not None:
+                # Stop at the limit, the block is then returned but
+                # not cached, since it may not end the stream.
+                remaining = min(remaining,
+                                self._max_output_size - block_start)
+            complete = remaining == block_size
+            while remaining:
+                data = self._decode(remaining)
+                if not data:
+                    break
+                chunks.append(data)
+                remaining -= len(data)
+
+            block = b''.join(chunks)
+            if not block:
+                return block
+
+            if complete:
+                self._cache.put((self._cache_id, block_start), block)
+            if block_start >= start:
+                return block
+
+    def _read_cached(self, size):
+        if self._max_output_size is not None:
+            if self._pos >= self._max_output_size:
+                # Only an error if there is data past the limit
+                if self._size < 0:
+                    self._size = self._decompressed_size()
+                self._check_output_size(self._size)
+                return b''
+            size = min(size, self._max_output_size - self._pos)
+
+        offset = self._pos % self._cache.block_size
+        start = self._pos - offset
+
+        block = self._cache.get((self._cache_id, start))
+        if block is None:
+            block = self._decode_block(start)
+
+        data = block[offset:offset + size]
         self._pos += len(data)
+        return data
+
+    def read(self, size=-1):
+        if size < 0:
+            return self.readall()
 
+        if not size:
+            return b''
+
+        if self._cache is not None:
+            return self._read_cached(size)
+
+        data = self._decode(size)
+        self._pos += len(data)
         return data
 
-    def _rewind(self):
-        """Rewind the file to the beginning of the data stream."""
+    def _decompressed_size(self):
+        """Return the size of the whole decompressed stream.
+
+        The size is counted from the compressed data, without decoding
+        it. The position in the underlying file is left unchanged.
+        """
+        with self._fp_lock:
+            offset = self._fp.tell()
+            try:
+                self._fp.seek(0)
+                return core.decompressed_size(self._fp, **self._reader_args)
+            finally:
+                self._fp.seek(offset)
+
+    def _rewind_decoder(self):
+        """Restart decoding from the beginning of the data stream."""
+        self._stop_read_ahead()
         self._fp.seek(0)
         self._eof = False
-        self._pos = 0
+        self._decoded = 0
         self._buf = b''
         self._buf_offset = 0
-        # Restart the decoder from the beginning
         self._decoder = self._new_decoder()
 
+    def _rewind(self):
+        """Rewind the file to the beginning of the data stream."""
+        self._rewind_decoder()
+        self._pos = 0
+
     def seek(self, offset, whence=io.SEEK_SET):
         # Recalculate offset as an absolute file position.
         if whence == io.SEEK_SET:
@@ -129,9 +318,7 @@ class _DecompressReader(io.RawIOBase):
             offset += self._pos
         elif whence == io.SEEK_END:
             if self._size < 0:
-                # Finish reading the file
-                while self.read(io.DEFAULT_BUFFER_SIZE):
-                    pass
+                self._size = self._decompressed_size()
             offset += self._size
         else:
             raise ValueError('Invalid value for whence: {}'.format(whence))
@@ -141,6 +328,15 @@ class _DecompressReader(io.RawIOBase):
             raise IOError(msg.format(code=errno.EINVAL,
                                      msg=os.strerror(errno.EINVAL)))
 
+        if self._cache is not None:
+            # Data is decoded when read, if it isn't cached
+            if self._size < 0:
+                self._size = self._decompressed_size()
+            offset = min(offset, self._size)
+            self._check_output_size(offset)
+            self._pos = offset
+            return self._pos
+
         # Make it so that offset is the number of bytes to skip forward.
         if offset < self._pos:
             self._rewind()
@@ -160,21 +356,92 @@ class _DecompressReader(io.RawIOBase):
         return self._pos
 
 
+class _CompressWriter(object):
+    """Writes data to a file object as a single raw heatshrink stream."""
+    def __init__(self, fp, **writer_args):
+        self._fp = fp
+        self._encoder = core.Encoder(core.Writer(**writer_args))
+
+    def write(self, data):
+        self._fp.write(self._encoder.fill(data))
+
+    def flush(self, mode):
+        if mode is None:
+            return
+        _check_flush_mode(mode)
+        msg = 'Flushing pending data requires the framed format'
+        raise io.UnsupportedOperation(msg)
+
+    def close(self):
+        self._fp.write(self._encoder.finish())
+        self._encoder = None
+
+
 _MODE_CLOSED = 0
 _MODE_READ = 1
 _MODE_WRITE = 2
 
 
 class EncodedFile(io.BufferedIOBase):
-    def __init__(self, filename, mode='rb', **compress_options):
+    def __init__(self, filename, mode='rb', max_output_size=None,
+                 format=FORMAT_RAW, member_size=DEFAULT_MEMBER_SIZE,
+                 threads=1, cache=None, pipeline=0, read_ahead=0,
+                 store=STORE_NEVER, level=LEVEL_DEFAULT, memory_budget=None,
+                 **compress_options):
         """Open a heatshrink LZSS encoded file.
 
         If filename is a str, bytes or unicode object, it gives the
         name of the file to be opened. Otherwise, it should be a file-like
         object, which will be used to read or write the compressed data.
 
-        mode can be 'rb for reading (default) or 'wb' for (over)writing.
-        'r' and 'w' will be converted to to 'rb' and 'wb' respectively.
+        mode can be 'rb for reading (default), 'wb' for (over)writing
+        or 'ab' for appending. 'r', 'w' and 'a' will be converted to
+        'rb', 'wb' and 'ab' respectively.
+
+        max_output_size limits the number of bytes that can be
+        decompressed when reading. Reading past the limit raises a
+        ValueError. Only a read-sized chunk of output is decompressed
+        at a time, regardless of how well the input compresses.
+
+        format can be FORMAT_RAW (default) for a plain heatshrink
+        stream or FORMAT_FRAMED for a sequence of independent members
+        (see heatshrink.framing). Appending is only supported by the
+        framed format, where each write session adds new members.
+        member_size is the uncompressed size of the written members
+        and threads the number of members that are decoded
+        concurrently when reading a framed file.
+
+        cache can be a heatshrink.BlockCache, shared between files, to
+        keep decoded blocks in memory when reading. Cached regions are
+        read and seeked back to without decoding them again.
+
+        pipeline, if larger than 0, makes writing pipelined: written
+        data is compressed on a background thread and written to the
+        file on another, with up to `pipeline` chunks queued for each.
+        write only blocks when the queue is full, flush and close wait
+        for all queued data to be written. Errors that occur on the
+        threads are raised by the next write, flush or close.
+
+        read_ahead, if larger than 0, makes reading a raw stream read and
+        decode the next `read_ahead` chunks of up to 64KB on a
+        background thread, while the caller is busy with the current
+        one. Framed files decode members ahead with `threads` instead.
+
+        store is one of the heatshrink.STORE_* modes, deciding when
+        members of a framed file being written are stored uncompressed
+        because compressing them doesn't pay, as for already compressed
+        or encrypted data.
+
+        level is a heatshrink.LEVEL_* compression level. With LEVEL_MAX,
+        every member of a framed file being written is also compressed
+        with each of heatshrink.framing.MAX_LEVEL_PARAMS, up to `threads`
+        at a time, and written with the parameters that compress it
+        best. This is many times slower, and meant for archiving.
+
+        memory_budget limits the memory of the encoder or decoder of a
+        raw stream, in bytes (see heatshrink.memory_for). When reading,
+        the decoder uses the largest input buffer that fits, when
+        writing, a ValueError is raised if the encoder doesn't fit.
         """
         self._lock = RLock()
         self._fp = None
@@ -188,9 +455,29 @@ class EncodedFile(io.BufferedIOBase):
         elif mode in ('w', 'wb'):
             self._mode_str = 'wb'
             self._mode = _MODE_WRITE
+        elif mode in ('a', 'ab'):
+            self._mode_str = 'ab'
+            self._mode = _MODE_WRITE
         else:
             raise ValueError("Invalid mode: '{!r}'".format(mode))
 
+        self._format = _check_format(format)
+        if self._mode_str == 'ab' and format != FORMAT_FRAMED:
+            msg = 'Appending is only supported by the framed format'
+            raise ValueError(msg)
+        if _check_store(store) != STORE_NEVER and format != FORMAT_FRAMED:
+            msg = 'Storing data is only supported by the framed format'
+            raise ValueError(msg)
+        if _check_level(level) != LEVEL_DEFAULT and format != FORMAT_FRAMED:
+            msg = 'Compression levels are only supported by the framed format'
+            raise ValueError(msg)
+        if memory_budget is not None:
+            if format != FORMAT_RAW:
+                # Framed members are decoded whole
+                msg = 'Memory budgets are only supported by the raw format'
+                raise ValueError(msg)
+            compress_options['memory_budget'] = memory_budget
+
         if isinstance(filename, (str, bytes, unicode)):
             self._fp = builtin_open(filename, self._mode_str)
             # We opened the file, we need to close it
@@ -203,11 +490,31 @@ class EncodedFile(io.BufferedIOBase):
             raise TypeError(msg)
 
         if self._mode == _MODE_READ:
-            raw = _DecompressReader(self._fp, core.Reader, **compress_options)
+            if max_output_size is not None:
+                core._check_max_output_size(max_output_size)
+
+            if format == FORMAT_FRAMED:
+                raw = _MemberReader(self._fp, threads=threads,
+                                    max_output_size=max_output_size,
+                                    cache=cache)
+            else:
+                raw = _DecompressReader(self._fp, core.Reader,
+                                        max_output_size=max_output_size,
+                                        cache=cache, read_ahead=read_ahead,
+                                        **compress_options)
             self._buffer = io.BufferedReader(raw)
         else:
-            writer = core.Writer(**compress_options)
-            self._encoder = core.Encoder(writer)
+            def writer_factory(fp):
+                if format == FORMAT_FRAMED:
+                    return _MemberWriter(fp, member_size, store, level,
+                                         threads, **compress_options)
+                return _CompressWriter(fp, **compress_options)
+
+            if pipeline:
+                self._writer = _PipelinedWriter(self._fp, writer_factory,
+                                                pipeline)
+            else:
+                self._writer = writer_factory(self._fp)
             # File seek position
             self._pos = 0
 
@@ -262,27 +569,46 @@ class EncodedFile(io.BufferedIOBase):
         closed, any other operation on it will raise a ValueError.
         """
         with self._lock:
-            # Flush and finish the decoder.
-            if self._mode == _MODE_READ:
-                self._buffer.close()
-            elif self._mode == _MODE_WRITE:
-                self._fp.write(self._encoder.finish())
-                self._encoder = None
-
             try:
-                # Actually close the internal file pointer.
-                if self._close_fp:
-                    self._fp.close()
+                # Flush and finish the decoder.
+                if self._mode == _MODE_READ:
+                    self._buffer.close()
+                elif self._mode == _MODE_WRITE:
+                    writer, self._writer = self._writer, None
+                    writer.close()
             finally:
-                self._fp = None
-                self._close_fp = False
-                self._mode = _MODE_CLOSED
+                try:
+                    # Actually close the internal file pointer.
+                    if self._close_fp:
+                        self._fp.close()
+                finally:
+                    self._fp = None
+                    self._close_fp = False
+                    self._mode = _MODE_CLOSED
 
     @property
     def closed(self):
         """True if this file is closed."""
         return self._mode == _MODE_CLOSED
 
+    def flush(self, mode=None):
+        """Flush the write buffers of the underlying file.
+
+        In write mode, mode can be FLUSH_SYNC or FLUSH_FULL to also
+        write out all data that is pending in the encoder, so that
+        everything written so far can be decoded by readers of the
+        file. This is only supported by the framed format, where
+        FLUSH_SYNC keeps the current window and FLUSH_FULL starts with
+        an empty window, creating a point that reading can restart
+        from. Frequent flushing makes compression worse.
+        """
+        with self._lock:
+            self._check_not_closed()
+            if self._mode == _MODE_WRITE:
+                self._writer.flush(mode)
+                if hasattr(self._fp, 'flush'):
+                    self._fp.flush()
+
     def fileno(self):
         """Return the file descriptor for tthe underlying file."""
         self._check_not_closed()
@@ -357,6 +683,21 @@ class EncodedFile(io.BufferedIOBase):
             self._check_can_read()
             return self._buffer.readlines(size)
 
+    def iter_lines(self, chunk_size=_LINE_CHUNK_SIZE):
+        """Iterate over the lines from the current position to EOF.
+
+        Like iterating over the file, but the data is decoded in chunks
+        of chunk_size bytes which are split into lines all at once, which
+        is several times faster for short lines. The file position is
+        unspecified until the iteration finishes.
+        """
+        self._check_can_read()
+        for _, data, end in _line_blocks(self, chunk_size):
+            if end < len(data):
+                data = data[:end]
+            for line in io.BytesIO(data):
+                yield line
+
     def write(self, data):
         """Write a byte string to the file.
 
@@ -366,8 +707,7 @@ class EncodedFile(io.BufferedIOBase):
         """
         with self._lock:
             self._check_can_write()
-            compressed = self._encoder.fill(data)
-            self._fp.write(compressed)
+            self._writer.write(data)
             self._pos += len(data)
             return len(data)
 
@@ -397,12 +737,26 @@ class EncodedFile(io.BufferedIOBase):
         Returns the new file position.
 
         Note that seeking is emulated, so depending on the parameters,
-        this operation may be extremely slow.
+        this operation may be extremely slow. The end of the stream is
+        found without decompressing it (see decompressed_size).
         """
         with self._lock:
             self._check_can_seek()
             return self._buffer.seek(offset, whence)
 
+    def members(self):
+        """Return a list of the members of a framed file.
+
+        Each member is a heatshrink.framing.Member, recording where the
+        member is located in the file and in the decompressed data.
+        Only the member headers are read to build the list.
+        """
+        with self._lock:
+            self._check_can_read()
+            if self._format != FORMAT_FRAMED:
+                raise io.UnsupportedOperation('File is not framed')
+            return list(self._buffer.raw.index)
+
     def tell(self):
         """Return the current file position."""
         with self._lock:
@@ -418,8 +772,8 @@ def open(filename, mode='rb', **kwargs):
     file-like object), or an existing file object to read from or write
     to.
 
-    The mode argument can be "rb", "wb". "r" and "w" are converted to
-    "rb" and "rb" respectively.
+    The mode argument can be "rb", "wb" or "ab". "r", "w" and "a" are
+    converted to "rb", "wb" and "ab" respectively.
 
     This function is equivalent to the EncodedFile constructor:
     EncodedFile(filename, mode, **compress_options).
@@ -0,0 +1,321 @@
+"""Compressed connections for streaming protocols.
+
+EncodedSocket wraps a connected, blocking socket and EncodedProtocol
+an asyncio protocol, so that everything sent over the connection is
+compressed as one continuous stream:
+
+    >>> with heatshrink.EncodedSocket(socket.create_connection(addr)) as s:
+    ...     for message in messages:
+    ...         s.sendall(message)
+
+Data is sent in the framed format (see heatshrink.framing). Flushing
+ends a member, so that the peer can decode everything sent before it
+right away. With FLUSH_SYNC, the default, the next member keeps
+compressing with the data sent so far as its window, so that flushing
+after every message costs little compression. Members waiting to be
+sent are handed to the socket in a single call.
+
+Both ends of the connection have to use these adapters, or decode the
+framed stream themselves.
+"""
+from __future__ import absolute_import
+try:
+    import asyncio
+    _Protocol = asyncio.Protocol
+    _Transport = asyncio.Transport
+except ImportError:
+    # Python 2, only EncodedSocket is available
+    asyncio = None
+    _Protocol = _Transport = object
+
+import heatshrink.core as core
+from heatshrink.framing import (DEFAULT_MEMBER_SIZE, FLUSH_SYNC, _MemberParser,
+                                _MemberWriter)
+
+# Size of the chunks read from sockets
+_RECV_SIZE = 64 << 10
+# Queued compressed data is sent once it is larger than this, even
+# without flushing.
+_SEND_BUFFER_SIZE = 64 << 10
+# Largest number of buffers passed to a single sendmsg call
+_MAX_BUFFERS = 1024
+
+
+class _SendQueue(object):
+    """File-like object collecting the compressed data to send."""
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+
+    def pop(self):
+        """Remove and return all queued chunks."""
+        chunks = self.chunks
+        self.chunks = []
+        self.size = 0
+        return chunks
+
+
+def _send_chunks(sock, chunks):
+    """Send all chunks on sock, with as few calls as possible."""
+    views = [memoryview(chunk) for chunk in chunks]
+    while views:
+        try:
+            sent = sock.sendmsg(views[:_MAX_BUFFERS])
+        except (AttributeError, NotImplementedError):
+            # Not supported by the platform or socket type (SSL), which
+            # the first call finds out before sending anything
+            sock.sendall(b''.join(chunks))
+            return
+
+        # Skip over what was sent, sendmsg may send partially
+        done = 0
+        while done < len(views) and sent >= len(views[done]):
+            sent -= len(views[done])
+            done += 1
+        views = views[done:]
+        if sent:
+            views[0] = views[0][sent:]
+
+
+class EncodedSocket(object):
+    """Compressing wrapper of a connected, blocking socket.
+
+    Data passed to write and sendall is compressed with the given
+    parameters, data received by recv is decoded. member_size is the
+    largest uncompressed size of a member that is sent, and
+    max_member_size of one that is received, member_size by default.
+    recv raises an IOError for larger members, without receiving them.
+
+    Closing an EncodedSocket also closes the socket.
+    """
+    def __init__(self, sock, member_size=DEFAULT_MEMBER_SIZE,
+                 max_member_size=None, **params):
+        self.sock = sock
+        self._queue = _SendQueue()
+        self._writer = _MemberWriter(self._queue, member_size, **params)
+        self._parser = _MemberParser(max_member_size or member_size)
+        # Received data that hasn't been returned by recv
+        self._received = b''
+        self._received_offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _check_not_closed(self):
+        if self._writer is None:
+            raise ValueError('I/O operation on closed socket')
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def _send(self):
+        chunks = self._queue.pop()
+        if chunks:
+            _send_chunks(self.sock, chunks)
+
+    def write(self, data):
+        """Compress data, without flushing it.
+
+        The data is sent once enough compressed data is queued, or
+        when flushing.
+        """
+        self._check_not_closed()
+        self._writer.write(data)
+        if self._queue.size >= _SEND_BUFFER_SIZE:
+            self._send()
+
+    def end_message(self, mode=FLUSH_SYNC):
+        """End the current member, but don't send it yet.
+
+        Use this to mark the ends of several messages that are then
+        sent together by flush.
+        """
+        self._check_not_closed()
+        self._writer.flush(mode)
+
+    def flush(self, mode=FLUSH_SYNC):
+        """End the current member and send everything queued.
+
+        mode is FLUSH_SYNC or FLUSH_FULL, see heatshrink.framing.
+        """
+        self.end_message(mode)
+        self._send()
+
+    def sendall(self, data):
+        """Compress and send data as a message, see flush."""
+        self.write(data)
+        self.flush()
+
+    def recv(self, bufsize):
+        """Return up to bufsize bytes of decoded data.
+
+        Blocks until the next member has been received. Returns b''
+        once the peer has closed the connection and all data has been
+        returned. Throws an IOError if the connection was closed
+        within a member.
+        """
+        self._check_not_closed()
+        while self._received_offset >= len(self._received):
+            data = self.sock.recv(_RECV_SIZE)
+            if not data:
+                self._parser.close()
+                return b''
+            self._received = self._parser.feed(data)
+            self._received_offset = 0
+
+        data = self._received[self._received_offset:
+                              self._received_offset + bufsize]
+        self._received_offset += len(data)
+        return data
+
+    def close(self):
+        """Send the remaining data and close the socket."""
+        if self._writer is None:
+            return
+
+        try:
+            self._writer.close()
+            self._send()
+        finally:
+            self._writer = None
+            self.sock.close()
+
+
+class EncodedTransport(_Transport):
+    """Compressing wrapper of an asyncio transport.
+
+    Created by EncodedProtocol. Data written in the same iteration of
+    the event loop is flushed as one member at the end of it, which
+    is passed to the transport with a single writelines call. Call
+    flush to end a member right away.
+    """
+    def __init__(self, transport, member_size=DEFAULT_MEMBER_SIZE,
+                 **params):
+        super(EncodedTransport, self).__init__()
+        self._transport = transport
+        self._loop = asyncio.get_event_loop()
+        self._queue = _SendQueue()
+        self._writer = _MemberWriter(self._queue, member_size, **params)
+        # Handle of the flush scheduled by write
+        self._flush_handle = None
+
+    def get_extra_info(self, name, default=None):
+        return self._transport.get_extra_info(name, default)
+
+    def is_closing(self):
+        return self._transport.is_closing()
+
+    def pause_reading(self):
+        self._transport.pause_reading()
+
+    def resume_reading(self):
+        self._transport.resume_reading()
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        self._transport.set_write_buffer_limits(high, low)
+
+    def get_write_buffer_size(self):
+        return self._queue.size + self._transport.get_write_buffer_size()
+
+    def can_write_eof(self):
+        return self._transport.can_write_eof()
+
+    def _cancel_flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+    def _send(self):
+        chunks = self._queue.pop()
+        if chunks:
+            self._transport.writelines(chunks)
+
+    def write(self, data):
+        if self._writer is None:
+            raise ValueError('I/O operation on closed transport')
+
+        self._writer.write(data)
+        if self._flush_handle is None:
+            self._flush_handle = self._loop.call_soon(self.flush)
+
+    def flush(self, mode=FLUSH_SYNC):
+        """End the current member and pass it to the transport."""
+        self._cancel_flush()
+        if self._writer is not None:
+            self._writer.flush(mode)
+            self._send()
+
+    def _finish(self):
+        """Send the remaining data, no more data can be written."""
+        self._cancel_flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._send()
+
+    def write_eof(self):
+        self._finish()
+        self._transport.write_eof()
+
+    def close(self):
+        self._finish()
+        self._transport.close()
+
+    def abort(self):
+        self._cancel_flush()
+        self._writer = None
+        self._transport.abort()
+
+
+class EncodedProtocol(_Protocol):
+    """Compressing wrapper of an asyncio protocol.
+
+    protocol receives the decoded data and an EncodedTransport that
+    compresses what it writes:
+
+        >>> loop.create_connection(
+        ...     lambda: heatshrink.EncodedProtocol(MyProtocol()), host, port)
+
+    member_size and params are the EncodedTransport arguments.
+    max_member_size limits the size of the members received, like for
+    EncodedSocket. Corrupt data or too large members received from the
+    peer raise an IOError from data_received, which makes asyncio close
+    the connection.
+    """
+    def __init__(self, protocol, member_size=DEFAULT_MEMBER_SIZE,
+                 max_member_size=None, **params):
+        self.protocol = protocol
+        self.transport = None
+        self._member_size = member_size
+        self._params = core._get_params(params)
+        self._parser = _MemberParser(max_member_size or member_size)
+
+    def connection_made(self, transport):
+        self.transport = EncodedTransport(transport, self._member_size,
+                                          params=self._params)
+        self.protocol.connection_made(self.transport)
+
+    def data_received(self, data):
+        decoded = self._parser.feed(data)
+        if decoded:
+            self.protocol.data_received(decoded)
+
+    def eof_received(self):
+        self._parser.close()
+        return self.protocol.eof_received()
+
+    def connection_lost(self, exc):
+        self.protocol.connection_lost(exc)
+
+    def pause_writing(self):
+        self.protocol.pause_writing()
+
+    def resume_writing(self):
+        self.protocol.resume_writing()
@@ -2,6 +2,7 @@ import os
 import time
 
 import heatshrink
+from heatshrink.core import Encoder, Reader, Writer
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
 
@@ -61,5 +62,36 @@ def run_benchmarks():
         print('<== Read {} bytes'.format(compressed_file.tell()))
 
 
+def stream_encode(data):
+    """Encode data with the streaming Writer."""
+    encoder = Encoder(Writer())
+    return encoder.fill(data) + encoder.finish()
+
+
+def stream_decode(data):
+    """Decode data with the streaming Reader."""
+    decoder = Encoder(Reader())
+    return decoder.fill(data) + decoder.finish()
+
+
+def run_one_shot_benchmarks():
+    with open(PLAIN_FILE_PATH, 'rb') as plain_file:
+        plain = plain_file.read()
+    encoded = heatshrink.encode(plain)
+
+    print_block('One-shot encode benchmarks ({} bytes)'.format(len(plain)))
+    print('*** Streaming Writer ***')
+    timed(stream_encode)(plain)
+    print('*** heatshrink.encode ***')
+    timed(heatshrink.encode)(plain)
+
+    print_block('One-shot decode benchmarks ({} bytes)'.format(len(encoded)))
+    print('*** Streaming Reader ***')
+    timed(stream_decode)(encoded)
+    print('*** heatshrink.decode ***')
+    timed(heatshrink.decode)(encoded)
+
+
 if __name__ == '__main__':
     run_benchmarks()
+    run_one_shot_benchmarks()
@@ -0,0 +1,93 @@
+"""Generated corpora for the round-trip and performance tests.
+
+Every corpus is generated from a seed, so that failures can be
+reproduced. The default size can be raised with the
+HEATSHRINK_CORPUS_SIZE environment variable for longer runs.
+"""
+import hashlib
+import os
+import random
+
+from .constants import TEXT
+
+DEFAULT_SIZE = int(os.environ.get('HEATSHRINK_CORPUS_SIZE', 1 << 17))
+
+_WORDS = TEXT.split()
+
+
+def text(size, seed=0):
+    """Sentences of English words, compressing moderately."""
+    rng = random.Random(seed)
+    lines = []
+    length = 0
+    while length < size:
+        line = b' '.join(rng.choice(_WORDS)
+                         for _ in range(rng.randint(1, 12))) + b'\n'
+        lines.append(line)
+        length += len(line)
+    return b''.join(lines)[:size]
+
+
+def noise(size, seed=0):
+    """Incompressible bytes."""
+    blocks = []
+    for i in range(size // 32 + 1):
+        key = '{}:{}'.format(seed, i).encode('ascii')
+        blocks.append(hashlib.sha256(key).digest())
+    return b''.join(blocks)[:size]
+
+
+def runs(size, seed=0):
+    """Runs of repeated bytes, longer than any lookahead."""
+    rng = random.Random(seed)
+    chunks = []
+    length = 0
+    while length < size:
+        count = rng.choice((1, 2, 3, 17, 255, 1000, 40000))
+        chunks.append(bytes(bytearray([rng.randint(0, 255)])) * count)
+        length += count
+    return b''.join(chunks)[:size]
+
+
+def records(size, seed=0):
+    """Binary records with counters and a few random fields, mixing
+    short matches with literals."""
+    rng = random.Random(seed)
+    chunks = []
+    length = 0
+    counter = 0
+    while length < size:
+        counter += rng.randint(1, 3)
+        record = bytearray(b'REC\x00')
+        record += bytearray(((counter >> shift) & 0xFF
+                             for shift in (24, 16, 8, 0)))
+        record += bytearray(rng.randint(0, 255)
+                            for _ in range(rng.randint(0, 6)))
+        record += rng.choice(_WORDS) + b'\x00'
+        chunks.append(bytes(record))
+        length += len(record)
+    return b''.join(chunks)[:size]
+
+
+CORPORA = {
+    'text': text,
+    'noise': noise,
+    'runs': runs,
+    'records': records,
+}
+
+
+def corpora(size=DEFAULT_SIZE, seed=0):
+    """Return a dict of every corpus of the given size."""
+    return dict((name, generate(size, seed))
+                for name, generate in CORPORA.items())
+
+
+def all_params():
+    """Yield every supported (window_sz2, lookahead_sz2) combination."""
+    import heatshrink.core as core
+
+    for window_sz2 in range(core.MIN_WINDOW_SZ2, core.MAX_WINDOW_SZ2 + 1):
+        # The C library can't allocate lookaheads as large as the window
+        for lookahead_sz2 in range(core.MIN_LOOKAHEAD_SZ2, window_sz2):
+            yield core.Params(window_sz2, lookahead_sz2)
@@ -0,0 +1,179 @@
+import io
+import os
+import unittest
+
+import heatshrink
+from heatshrink.cache import BlockCache, CacheStats
+
+from .constants import TEXT
+from .utils import TestUtilsMixin, random_string
+
+TEST_FILENAME = 'test_cache_{}_tmp'.format(os.getpid())
+
+
+class BlockCacheTest(TestUtilsMixin, unittest.TestCase):
+    def test_get_and_put(self):
+        cache = BlockCache()
+        self.assertEqual(cache.get('a'), None)
+        cache.put('a', b'abc')
+        self.assertEqual(cache.get('a'), b'abc')
+        self.assertEqual(cache.stats, CacheStats(1, 1, 0, 1, 3))
+
+    def test_evicts_least_recently_used(self):
+        cache = BlockCache(max_size=10)
+        cache.put('a', b'a' * 4)
+        cache.put('b', b'b' * 4)
+        cache.get('a')
+        cache.put('c', b'c' * 4)
+
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), b'a' * 4)
+        self.assertEqual(cache.stats.evictions, 1)
+        self.assertEqual(cache.stats.size, 8)
+
+    def test_ignores_blocks_larger_than_cache(self):
+        cache = BlockCache(max_size=10)
+        cache.put('a', b'a' * 11)
+        self.assertEqual(len(cache), 0)
+
+    def test_replace_and_clear(self):
+        cache = BlockCache()
+        cache.put('a', b'abc')
+        cache.put('a', b'ab')
+        self.assertEqual(cache.stats.size, 2)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats.size, 0)
+
+    def test_checks_sizes(self):
+        self.assertRaises(ValueError, BlockCache, max_size=-1)
+        self.assertRaises(ValueError, BlockCache, block_size=0)
+
+
+class CachedFileTest(TestUtilsMixin, unittest.TestCase):
+    def setUp(self):
+        self.contents = random_string(10000).encode('ascii') + TEXT
+
+    def tearDown(self):
+        if os.path.exists(TEST_FILENAME):
+            os.unlink(TEST_FILENAME)
+
+    def _write(self, **kwargs):
+        with heatshrink.open(TEST_FILENAME, 'wb', **kwargs) as fp:
+            fp.write(self.contents)
+
+    def _check_random_reads(self, cache, **kwargs):
+        offsets = [5000, 100, 9000, 100, len(self.contents) - 10, 5000]
+        with heatshrink.open(TEST_FILENAME, cache=cache, **kwargs) as fp:
+            for offset in offsets:
+                self.assertEqual(fp.seek(offset), offset)
+                self.assertEqual(fp.read(100),
+                                 self.contents[offset:offset + 100])
+
+            fp.seek(0)
+            self.assertEqual(fp.read(), self.contents)
+            self.assertEqual(fp.seek(0, io.SEEK_END), len(self.contents))
+            self.assertEqual(fp.seek(len(self.contents) + 10),
+                             len(self.contents))
+            self.assertEqual(fp.read(), b'')
+
+    def test_raw_format(self):
+        self._write()
+        cache = BlockCache(block_size=1000)
+        self._check_random_reads(cache)
+        self.assertGreater(cache.stats.hits, 0)
+        self.assertEqual(cache.stats.size, len(self.contents))
+
+        # Other files share the decoded blocks
+        misses = cache.stats.misses
+        self._check_random_reads(cache)
+        self.assertEqual(cache.stats.misses, misses)
+
+    def test_framed_format(self):
+        self._write(format=heatshrink.FORMAT_FRAMED, member_size=1000)
+        cache = BlockCache()
+        self._check_random_reads(cache, format=heatshrink.FORMAT_FRAMED,
+                                 threads=2)
+        self.assertGreater(cache.stats.hits, 0)
+        self.assertEqual(cache.stats.size, len(self.contents))
+
+        misses = cache.stats.misses
+        self._check_random_reads(cache, format=heatshrink.FORMAT_FRAMED)
+        self.assertEqual(cache.stats.misses, misses)
+
+    def test_small_cache(self):
+        self._write()
+        cache = BlockCache(max_size=2000, block_size=1000)
+        self._check_random_reads(cache)
+        self.assertLessEqual(cache.stats.size, 2000)
+        self.assertGreater(cache.stats.evictions, 0)
+
+    def test_params_are_part_of_key(self):
+        cache = BlockCache()
+        self._write(window_sz2=8)
+        with heatshrink.open(TEST_FILENAME, cache=cache, window_sz2=8) as fp:
+            self.assertEqual(fp.read(), self.contents)
+        with heatshrink.open(TEST_FILENAME, cache=cache) as fp:
+            self.assertNotEqual(fp.read(), self.contents)
+
+    def test_max_output_size(self):
+        self._write()
+        with heatshrink.open(TEST_FILENAME, cache=BlockCache(block_size=100),
+                             max_output_size=1000) as fp:
+            self.assertEqual(fp.read(1000), self.contents[:1000])
+            self.assertRaises(ValueError, fp.read)
+
+    def test_max_output_size_within_block(self):
+        self._write()
+        cache = BlockCache()
+        with heatshrink.open(TEST_FILENAME, cache=cache,
+                             max_output_size=1000) as fp:
+            self.assertEqual(fp.read(500), self.contents[:500])
+            self.assertEqual(fp.read(500), self.contents[500:1000])
+            self.assertRaises(ValueError, fp.read, 1)
+        # The block cut off at the limit isn't cached
+        with heatshrink.open(TEST_FILENAME, cache=cache) as fp:
+            self.assertEqual(fp.read(), self.contents)
+
+    def test_max_output_size_with_warm_cache(self):
+        self._write()
+        cache = BlockCache(block_size=100)
+        with heatshrink.open(TEST_FILENAME, cache=cache) as fp:
+            self.assertEqual(fp.read(), self.contents)
+        misses = cache.stats.misses
+
+        with heatshrink.open(TEST_FILENAME, cache=cache,
+                             max_output_size=1000) as fp:
+            self.assertEqual(fp.read(1000), self.contents[:1000])
+            self.assertRaises(ValueError, fp.read)
+        with heatshrink.open(TEST_FILENAME, cache=cache,
+                             max_output_size=10) as fp:
+            self.assertRaises(ValueError, fp.read)
+        with heatshrink.open(TEST_FILENAME, cache=cache,
+                             max_output_size=1000) as fp:
+            self.assertEqual(fp.seek(1000), 1000)
+            self.assertRaises(ValueError, fp.seek, 1001)
+        # Checked without decoding
+        self.assertEqual(cache.stats.misses, misses)
+
+    def test_window_is_part_of_key(self):
+        cache = BlockCache()
+        # The contents start with the window, so they reference it
+        window = self.contents[:1000]
+        self._write(window=window)
+        with heatshrink.open(TEST_FILENAME, cache=cache,
+                             window=window) as fp:
+            self.assertEqual(fp.read(), self.contents)
+        with heatshrink.open(TEST_FILENAME, cache=cache) as fp:
+            self.assertNotEqual(fp.read(), self.contents)
+        with heatshrink.open(TEST_FILENAME, cache=cache,
+                             window=bytearray(window)) as fp:
+            self.assertEqual(fp.read(), self.contents)
+
+    def test_file_objects_without_descriptor_are_not_cached(self):
+        cache = BlockCache()
+        data = heatshrink.encode(self.contents)
+        with heatshrink.open(io.BytesIO(data), cache=cache) as fp:
+            self.assertEqual(fp.read(), self.contents)
+        self.assertEqual(len(cache), 0)
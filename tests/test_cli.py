@@ -0,0 +1,162 @@
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import heatshrink
+from heatshrink import cli
+
+from .constants import TEXT, COMPRESSED
+from .utils import TestUtilsMixin, random_string
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class CommandLineTest(TestUtilsMixin, unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self._stdout = sys.stdout
+        self._stderr = sys.stderr
+
+    def tearDown(self):
+        sys.stdout = self._stdout
+        sys.stderr = self._stderr
+        shutil.rmtree(self.tmpdir)
+
+    def _path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def _write(self, name, contents):
+        with open(self._path(name), 'wb') as fp:
+            fp.write(contents)
+        return self._path(name)
+
+    def _read(self, name):
+        with open(self._path(name), 'rb') as fp:
+            return fp.read()
+
+    def _main(self, *argv):
+        """Run the CLI, returning the exit status and standard output."""
+        sys.stdout = io.StringIO() if sys.version_info[0] == 3 else io.BytesIO()
+        sys.stderr = sys.stdout
+        status = cli.main(list(argv))
+        output = sys.stdout.getvalue()
+        sys.stdout = self._stdout
+        sys.stderr = self._stderr
+        return status, output
+
+    def test_compress(self):
+        path = self._write('text', TEXT)
+        status, _ = self._main('compress', path)
+        self.assertEqual(status, 0)
+        # Input is replaced by the compressed file
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self._read('text.hs'), COMPRESSED)
+
+    def test_round_trip_keep(self):
+        contents = random_string(100000).encode('ascii')
+        path = self._write('random', contents)
+
+        self.assertEqual(self._main('compress', '-k', path)[0], 0)
+        self.assertTrue(os.path.exists(path))
+        os.unlink(path)
+
+        self.assertEqual(self._main('decompress', path + '.hs')[0], 0)
+        self.assertEqual(self._read('random'), contents)
+
+    def test_compress_params(self):
+        path = self._write('text', TEXT)
+        self._main('compress', '-w', '8', '-l', '4', path)
+        self.assertEqual(self._read('text.hs'),
+                         heatshrink.encode(TEXT, window_sz2=8, lookahead_sz2=4))
+
+        self._main('decompress', '-w', '8', '-l', '4', path + '.hs')
+        self.assertEqual(self._read('text'), TEXT)
+
+    def test_invalid_params(self):
+        path = self._write('text', TEXT)
+        with self.assertRaises(SystemExit):
+            self._main('compress', '-w', '20', path)
+        self.assertTrue(os.path.exists(path))
+
+    def test_largest_window(self):
+        # Only supported by the decoder
+        path = self._write('text', TEXT)
+        with self.assertRaises(SystemExit):
+            self._main('compress', '-w', '15', path)
+        self.assertTrue(os.path.exists(path))
+
+        encoded = self._write('text.hs', heatshrink.encode(
+            TEXT, window_sz2=15, lookahead_sz2=4))
+        os.unlink(path)
+        self.assertEqual(self._main('decompress', '-w', '15', encoded)[0], 0)
+        self.assertEqual(self._read('text'), TEXT)
+
+    def test_does_not_overwrite(self):
+        path = self._write('text', TEXT)
+        self._write('text.hs', b'existing')
+
+        status, _ = self._main('compress', path)
+        self.assertEqual(status, 1)
+        self.assertEqual(self._read('text.hs'), b'existing')
+
+        self.assertEqual(self._main('compress', '-f', path)[0], 0)
+        self.assertEqual(self._read('text.hs'), COMPRESSED)
+
+    def test_decompress_unknown_suffix(self):
+        path = self._write('text.bin', COMPRESSED)
+        status, output = self._main('decompress', path)
+        self.assertEqual(status, 1)
+        self.assertIn('unknown suffix', output)
+
+    def test_parallel_jobs(self):
+        contents = {}
+        for i in range(4):
+            contents['file{}'.format(i)] = random_string(10000).encode('ascii')
+            self._write('file{}'.format(i), contents['file{}'.format(i)])
+
+        paths = [self._path(name) for name in sorted(contents)]
+        self.assertEqual(self._main('compress', '-j', '2', *paths)[0], 0)
+
+        compressed = [path + '.hs' for path in paths]
+        self.assertEqual(self._main('decompress', '-j', '0', *compressed)[0], 0)
+
+        for name, data in contents.items():
+            self.assertEqual(self._read(name), data)
+
+    def test_test_command(self):
+        path = self._write('text.hs', COMPRESSED)
+        status, output = self._main('test', '-v', path)
+        self.assertEqual(status, 0)
+        self.assertIn('OK', output)
+        self.assertIn('MB/s', output)
+
+    def test_list_command(self):
+        path = self._write('text.hs', COMPRESSED)
+        status, output = self._main('list', path)
+        self.assertEqual(status, 0)
+
+        header, row = output.splitlines()
+        self.assertEqual(row.split()[:2],
+                         [str(len(COMPRESSED)), str(len(TEXT))])
+        self.assertTrue(row.endswith(path))
+
+    def test_standard_streams(self):
+        def run(*args, **kwargs):
+            proc = subprocess.Popen(
+                [sys.executable, '-m', 'heatshrink'] + list(args),
+                cwd=PROJECT_DIR, stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            stdout, _ = proc.communicate(kwargs.get('input'))
+            self.assertEqual(proc.returncode, 0)
+            return stdout
+
+        self.assertEqual(run('compress', input=TEXT), COMPRESSED)
+        self.assertEqual(run('decompress', '-', input=COMPRESSED), TEXT)
+
+        path = self._write('text.hs', COMPRESSED)
+        self.assertEqual(run('decompress', '-c', path), TEXT)
+        self.assertTrue(os.path.exists(path))
@@ -1,8 +1,13 @@
 import array
+import ctypes
+import ctypes.util
+import io
+import os
+import pickle
 import unittest
 
 import heatshrink
-from heatshrink.core import Encoder, Reader, Writer
+from heatshrink.core import Encoder, Params, Reader, Writer, restore
 
 from .constants import TEXT
 from .utils import TestUtilsMixin, random_string
@@ -37,6 +42,54 @@ class InternalEncodersTest(TestUtilsMixin, unittest.TestCase):
             self.assertNotRaises(cls, lookahead_sz2=10)
 
 
+class ParamsTest(TestUtilsMixin, unittest.TestCase):
+    """Tests for the Params class."""
+
+    def test_defaults(self):
+        params = Params()
+        self.assertEqual(params.window_sz2, heatshrink.core.DEFAULT_WINDOW_SZ2)
+        self.assertEqual(params.lookahead_sz2,
+                         heatshrink.core.DEFAULT_LOOKAHEAD_SZ2)
+
+    def test_checks_sizes(self):
+        self.assertRaises(TypeError, Params, 'a string')
+        self.assertRaises(ValueError, Params, 16)
+        self.assertRaises(ValueError, Params, 8, 9)
+
+    def test_equality_and_pickling(self):
+        params = Params(8, 4)
+        self.assertEqual(params, Params(8, 4))
+        self.assertNotEqual(params, Params(8, 5))
+        self.assertEqual(hash(params), hash(Params(8, 4)))
+        self.assertEqual(pickle.loads(pickle.dumps(params)), params)
+        self.assertEqual(repr(params), 'Params(window_sz2=8, lookahead_sz2=4)')
+
+    def test_used_by_encoders(self):
+        params = Params(8, 4)
+        encoded = heatshrink.encode(TEXT, window_sz2=8, lookahead_sz2=4)
+        self.assertEqual(heatshrink.encode(TEXT, params=params), encoded)
+        self.assertEqual(heatshrink.decode(encoded, params=params), TEXT)
+        self.assertEqual(heatshrink.decompressed_size(encoded, params=params),
+                         len(TEXT))
+
+        for cls in (Writer, Reader):
+            self.assertEqual(cls(params).max_output_size, 1 << 8)
+            self.assertRaises(TypeError, cls, 8)
+            self.assertRaises(TypeError, cls, params, window_sz2=8)
+
+    def test_with_encoded_file(self):
+        params = Params(8, 4)
+        with io.BytesIO() as dst:
+            with heatshrink.open(dst, 'wb', params=params) as fp:
+                fp.write(TEXT)
+            encoded = dst.getvalue()
+
+        self.assertEqual(encoded,
+                         heatshrink.encode(TEXT, window_sz2=8, lookahead_sz2=4))
+        with heatshrink.open(io.BytesIO(encoded), params=params) as fp:
+            self.assertEqual(fp.read(), TEXT)
+
+
 class EncoderTest(TestUtilsMixin, unittest.TestCase):
     """Test encoder state machine."""
 
@@ -83,6 +136,34 @@ class EncoderTest(TestUtilsMixin, unittest.TestCase):
         self.assertTrue(len(encoded) > 0)
 
 
+    def test_fill_with_max_length(self):
+        encoded = heatshrink.encode(TEXT)
+        encoder = Encoder(Reader())
+        decoded = encoder.fill(encoded, 100)
+        self.assertEqual(decoded, TEXT[:100])
+        self.assertFalse(encoder.needs_input)
+
+        while not encoder.needs_input:
+            data = encoder.fill(b'', 100)
+            self.assertTrue(len(data) <= 100)
+            decoded += data
+
+        decoded += encoder.finish()
+        self.assertEqual(decoded, TEXT)
+
+    def test_finish_processes_remaining_input(self):
+        encoded = heatshrink.encode(TEXT)
+        encoder = Encoder(Reader())
+        decoded = encoder.fill(encoded, 10)
+        self.assertEqual(decoded + encoder.finish(), TEXT)
+
+    def test_needs_input(self):
+        for encoder in self.encoders:
+            self.assertTrue(encoder.needs_input)
+            encoder.fill(b'abcde')
+            self.assertTrue(encoder.needs_input)
+
+
 class EncodeFunctionTest(TestUtilsMixin, unittest.TestCase):
     """Tests for the core.encode function."""
 
@@ -126,6 +207,364 @@ class DecodeFunctionTest(TestUtilsMixin, unittest.TestCase):
         decoded = heatshrink.decode(b'\xb0\xd8\xacvK(', lookahead_sz2=3)
         self.assertEqual(decoded, b'abcde')
 
+    def test_decode_with_max_output_size(self):
+        encoded = heatshrink.encode(TEXT)
+        self.assertEqual(heatshrink.decode(encoded, max_output_size=len(TEXT)),
+                         TEXT)
+        self.assertRaises(ValueError, heatshrink.decode, encoded,
+                          max_output_size=len(TEXT) - 1)
+
+    def test_max_output_size_bounds_expanding_input(self):
+        # A tiny payload that expands to a lot of data
+        encoded = heatshrink.encode(b'\x00' * 1000000)
+        self.assertTrue(len(encoded) < 1000000 // 4)
+        self.assertRaises(ValueError, heatshrink.decode, encoded,
+                          max_output_size=1024)
+
+    def test_checks_max_output_size(self):
+        self.assertRaises(TypeError, heatshrink.decode, b'abcde',
+                          max_output_size='a string')
+        self.assertRaises(ValueError, heatshrink.decode, b'abcde',
+                          max_output_size=-1)
+
+
+class DecompressedSizeTest(TestUtilsMixin, unittest.TestCase):
+    """Tests for the core.decompressed_size function."""
+
+    def test_matches_decoded_size(self):
+        contents = random_string(10000).encode('ascii') + TEXT + b'\x00' * 5000
+        for window_sz2, lookahead_sz2 in [(4, 3), (8, 4), (11, 4), (15, 14)]:
+            params = {'window_sz2': window_sz2,
+                      'lookahead_sz2': lookahead_sz2}
+            encoded = heatshrink.encode(contents, **params)
+            self.assertEqual(heatshrink.decompressed_size(encoded, **params),
+                             len(contents))
+
+    def test_empty_and_truncated_input(self):
+        self.assertEqual(heatshrink.decompressed_size(b''), 0)
+
+        encoded = heatshrink.encode(TEXT)
+        for size in range(0, len(encoded), 7):
+            self.assertEqual(heatshrink.decompressed_size(encoded[:size]),
+                             len(heatshrink.decode(encoded[:size])))
+
+    def test_accepted_types(self):
+        encoded = heatshrink.encode(TEXT)
+        for buf in (encoded, bytearray(encoded), memoryview(encoded),
+                    array.array('B', encoded), list(bytearray(encoded))):
+            self.assertEqual(heatshrink.decompressed_size(buf), len(TEXT))
+
+    def test_reads_file_objects(self):
+        fp = io.BytesIO(b'junk' + heatshrink.encode(TEXT * 20))
+        fp.seek(4)
+        self.assertEqual(heatshrink.decompressed_size(fp), len(TEXT) * 20)
+        self.assertEqual(fp.read(), b'')
+
+    def test_checks_params(self):
+        self.assertRaises(ValueError, heatshrink.decompressed_size, b'',
+                          window_sz2=20)
+        self.assertRaises(TypeError, heatshrink.decompressed_size, b'',
+                          lookahead_sz2='a string')
+
+
+def stream_encode(buf, **kwargs):
+    encoder = Encoder(Writer(**kwargs))
+    return encoder.fill(buf) + encoder.finish()
+
+
+def stream_decode(buf, **kwargs):
+    """Decode buf with the streaming Reader."""
+    encoder = Encoder(Reader(**kwargs))
+    return encoder.fill(buf) + encoder.finish()
+
+
+class OneShotEncodeTest(TestUtilsMixin, unittest.TestCase):
+    """Checks that encode matches the streaming Writer bit for bit."""
+
+    def _check(self, buf, **kwargs):
+        self.assertEqual(heatshrink.encode(buf, **kwargs),
+                         stream_encode(buf, **kwargs))
+
+    def test_matches_writer(self):
+        for window_sz2, lookahead_sz2 in [(4, 3), (8, 4), (11, 4),
+                                          (12, 11), (14, 7)]:
+            params = {'window_sz2': window_sz2,
+                      'lookahead_sz2': lookahead_sz2}
+            window_sz = 1 << window_sz2
+            # Sizes around the boundaries of the encoding rounds
+            for size in (0, 1, 2, window_sz - 1, window_sz, window_sz + 1,
+                         2 * window_sz):
+                self._check((TEXT * (size // len(TEXT) + 1))[:size],
+                            **params)
+            self._check(b'\x00' * (3 * window_sz + 5), **params)
+            self._check(b'ab' * 3000, **params)
+            self._check(os.urandom(3000), **params)
+            self._check(TEXT, window=TEXT[:100], **params)
+
+    def test_largest_window(self):
+        contents = random_string(5000).encode('ascii') + TEXT * 100
+        params = {'window_sz2': 15, 'lookahead_sz2': 14}
+        encoded = heatshrink.encode(contents, **params)
+        self.assertEqual(heatshrink.decode(encoded, **params), contents)
+        # The C encoder's output would be corrupt
+        self.assertRaises(ValueError, Writer, **params)
+
+    def test_lookahead_not_smaller_than_window(self):
+        for func in (heatshrink.encode, heatshrink.decode):
+            self.assertRaises(MemoryError, func, TEXT,
+                              window_sz2=8, lookahead_sz2=8)
+        self.assertRaises(MemoryError, heatshrink.decode, TEXT,
+                          input_buffer_size=0)
+
+
+class OneShotDecodeTest(TestUtilsMixin, unittest.TestCase):
+    """Checks that decode matches the streaming Reader."""
+
+    def _check(self, buf, **kwargs):
+        self.assertEqual(heatshrink.decode(buf, **kwargs),
+                         stream_decode(buf, **kwargs))
+
+    def test_matches_reader(self):
+        contents = (random_string(5000).encode('ascii') + TEXT +
+                    b'\x00' * 3000 + b'ab' * 3000)
+        for window_sz2, lookahead_sz2 in [(4, 3), (8, 4), (11, 4),
+                                          (12, 11), (15, 14)]:
+            params = {'window_sz2': window_sz2,
+                      'lookahead_sz2': lookahead_sz2}
+            encoded = heatshrink.encode(contents, **params)
+            self.assertEqual(heatshrink.decode(encoded, **params), contents)
+            self._check(encoded[:len(encoded) // 2], **params)
+
+    def test_arbitrary_input(self):
+        # Any input is valid, back-references may reach before the start
+        for size in (1, 2, 10, 1000, 10000):
+            buf = os.urandom(size)
+            self._check(buf)
+            self._check(buf, window_sz2=4, lookahead_sz2=3)
+            self._check(buf, window_sz2=15, lookahead_sz2=14)
+
+    def test_truncated_input(self):
+        encoded = heatshrink.encode(TEXT)
+        for size in range(len(encoded)):
+            self._check(encoded[:size])
+
+    def test_window(self):
+        encoded = os.urandom(1000)
+        self._check(encoded, window=TEXT)
+        self._check(encoded, window=TEXT[:10], window_sz2=8)
+
+    def test_accepted_types(self):
+        encoded = heatshrink.encode(TEXT)
+        for buf in (bytearray(encoded), array.array('B', encoded),
+                    list(bytearray(encoded))):
+            self.assertEqual(heatshrink.decode(buf), TEXT)
+        self.assertRaises(TypeError, heatshrink.decode, u'abcde')
+        self.assertRaises(TypeError, heatshrink.decode, memoryview(encoded))
+
+
+class EstimateRatioTest(TestUtilsMixin, unittest.TestCase):
+    def test_estimates(self):
+        self.assertLess(heatshrink.estimate_ratio(TEXT * 10), 0.7)
+        self.assertLess(heatshrink.estimate_ratio(b'\x00' * 100000), 0.2)
+        self.assertGreaterEqual(heatshrink.estimate_ratio(os.urandom(100000)),
+                                1.0)
+        self.assertEqual(heatshrink.estimate_ratio(b''), 1.0)
+
+    def test_small_buffers_are_compressed_whole(self):
+        ratio = heatshrink.estimate_ratio(TEXT, window_sz2=8)
+        encoded = heatshrink.encode(TEXT, window_sz2=8)
+        self.assertEqual(ratio, len(encoded) / float(len(TEXT)))
+
+    def test_samples(self):
+        contents = os.urandom(50000) + b'a' * 50000
+        self.assertGreater(heatshrink.estimate_ratio(contents), 0.4)
+        self.assertLess(heatshrink.estimate_ratio(contents), 0.7)
+        self.assertGreaterEqual(
+            heatshrink.estimate_ratio(contents, samples=1), 1.0)
+
+    def test_bad_args(self):
+        self.assertRaises(ValueError, heatshrink.estimate_ratio, TEXT,
+                          sample_size=0)
+        self.assertRaises(ValueError, heatshrink.estimate_ratio, TEXT,
+                          samples=0)
+        self.assertRaises(TypeError, heatshrink.estimate_ratio, u'abc')
+
+
+class SnapshotTest(TestUtilsMixin, unittest.TestCase):
+    def setUp(self):
+        self.contents = random_string(20000).encode('ascii') + TEXT * 20
+
+    def test_writer(self):
+        middle = len(self.contents) // 2
+        for params in ({}, {'window_sz2': 8, 'lookahead_sz2': 4}):
+            encoder = Encoder(Writer(**params))
+            out = encoder.fill(self.contents[:middle])
+            copy = Encoder(restore(encoder._encoder.snapshot()))
+
+            # The copy continues without the data before the snapshot
+            rest = copy.fill(self.contents[middle:]) + copy.finish()
+            self.assertEqual(out + rest,
+                             heatshrink.encode(self.contents, **params))
+            self.assertEqual(encoder.fill(self.contents[middle:]) +
+                             encoder.finish(), rest)
+
+    def test_reader(self):
+        encoded = heatshrink.encode(self.contents, window_sz2=10)
+        middle = len(encoded) // 2
+        decoder = Encoder(Reader(window_sz2=10, input_buffer_size=100))
+        out = decoder.fill(encoded[:middle])
+        copy = restore(decoder.snapshot())
+        self.assertEqual(out + copy.fill(encoded[middle:]) + copy.finish(),
+                         self.contents)
+
+        copy = Encoder(restore(decoder._encoder.snapshot()))
+        self.assertEqual(out + copy.fill(encoded[middle:]) + copy.finish(),
+                         self.contents)
+
+    def test_in_the_middle_of_a_round(self):
+        for cls in (Writer, Reader):
+            data = self.contents if cls is Writer else heatshrink.encode(
+                self.contents)
+            encoder = Encoder(cls())
+            out = encoder.fill(data[:5000], max_length=1000)
+            self.assertFalse(encoder.needs_input)
+
+            copy = restore(encoder.snapshot())
+            rest = copy.fill(data[5000:]) + copy.finish()
+            self.assertEqual(rest, encoder.fill(data[5000:]) +
+                             encoder.finish())
+            self.assertEqual(out + rest, heatshrink.encode(self.contents)
+                             if cls is Writer else self.contents)
+
+    def test_pickle(self):
+        for obj in (Writer(window_sz2=8), Reader(lookahead_sz2=6),
+                    Encoder(Writer())):
+            copy = pickle.loads(pickle.dumps(obj))
+            self.assertIs(type(copy), type(obj))
+            self.assertEqual(copy.snapshot(), obj.snapshot())
+
+        encoder = Encoder(Writer())
+        encoder.fill(TEXT)
+        encoder.finish()
+        self.assertTrue(pickle.loads(pickle.dumps(encoder)).finished)
+
+    def test_snapshots_are_compact(self):
+        encoder = Encoder(Writer(window_sz2=11))
+        encoder.fill(self.contents)
+        self.assertLess(len(encoder.snapshot()), 2 * 2048 + 100)
+
+        decoder = Encoder(Reader(window_sz2=11))
+        decoder.fill(heatshrink.encode(self.contents))
+        self.assertLess(len(decoder.snapshot()), 2048 + 100)
+
+    def test_invalid_snapshots(self):
+        snapshot = Writer().snapshot()
+        for data in (b'', b'junk', snapshot[:10], snapshot[:-1],
+                     snapshot + b'x', Reader().snapshot()[:-1],
+                     Encoder(Writer()).snapshot()[:-1]):
+            self.assertRaises(ValueError, restore, data)
+
+
+class _MallInfo2(ctypes.Structure):
+    _fields_ = [(name, ctypes.c_size_t) for name in (
+        'arena', 'ordblks', 'smblks', 'hblks', 'hblkhd', 'usmblks',
+        'fsmblks', 'uordblks', 'fordblks', 'keepcost')]
+
+
+def malloc_counter():
+    """Return a function returning the bytes allocated with malloc.
+
+    tracemalloc doesn't see the allocations of the C library, so this
+    uses glibc's statistics. Returns None on other platforms.
+    """
+    try:
+        mallinfo2 = ctypes.CDLL(ctypes.util.find_library('c')).mallinfo2
+    except (AttributeError, OSError, TypeError):
+        return None
+    mallinfo2.restype = _MallInfo2
+
+    def allocated():
+        info = mallinfo2()
+        return info.uordblks + info.hblkhd
+    return allocated
+
+
+class MemoryUsageTest(TestUtilsMixin, unittest.TestCase):
+    def test_memory_for(self):
+        usage = heatshrink.memory_for(window_sz2=10, input_buffer_size=100)
+        self.assertEqual(usage, (Writer(window_sz2=10).memory_usage,
+                                 Reader(window_sz2=10,
+                                        input_buffer_size=100).memory_usage))
+        self.assertEqual(heatshrink.memory_for(Params(10, 4)).encoder,
+                         usage.encoder)
+        # Buffers of 2 windows and a 16 bit index entry for each byte
+        self.assertEqual(heatshrink.memory_for(window_sz2=11).encoder -
+                         usage.encoder, 3 * 2048)
+        self.assertEqual(usage.decoder -
+                         heatshrink.memory_for(window_sz2=9,
+                                               input_buffer_size=50).decoder,
+                         512 + 50)
+
+    def test_memory_for_checks_args(self):
+        self.assertRaises(ValueError, heatshrink.memory_for, window_sz2=3)
+        self.assertRaises(ValueError, heatshrink.memory_for,
+                          input_buffer_size=0)
+        self.assertRaises(ValueError, heatshrink.memory_for,
+                          input_buffer_size=1 << 16)
+
+    def test_matches_allocated_memory(self):
+        allocated = malloc_counter()
+        if allocated is None:
+            self.skipTest('malloc statistics are only available with glibc')
+
+        for cls, kwargs in ((Writer, {'window_sz2': 12}),
+                            (Reader, {'window_sz2': 12,
+                                      'input_buffer_size': 4000}),
+                            (Reader, {'window_sz2': 8,
+                                      'memory_budget': 10000})):
+            # Measure one object at a time, the median ignores the
+            # occasional allocation of the interpreter in between.
+            objs = []
+            sizes = []
+            for _ in range(5):
+                before = allocated()
+                objs.append(cls(**kwargs))
+                sizes.append(allocated() - before)
+            used = sorted(sizes)[len(sizes) // 2]
+
+            expected = objs[0].memory_usage
+            # Allow for the Python object and the allocator's bookkeeping
+            self.assertTrue(abs(used - expected) <= expected // 10,
+                            (cls, sizes, expected))
+
+    def test_reader_memory_budget(self):
+        needed = heatshrink.memory_for(window_sz2=8, input_buffer_size=1)
+        reader = Reader(window_sz2=8, memory_budget=needed.decoder + 99)
+        self.assertEqual(reader.memory_usage, needed.decoder + 99)
+        reader = Reader(window_sz2=8, memory_budget=1 << 30)
+        self.assertEqual(reader.memory_usage,
+                         heatshrink.memory_for(
+                             window_sz2=8,
+                             input_buffer_size=65535).decoder)
+
+        self.assertRaises(ValueError, Reader, window_sz2=8,
+                          memory_budget=needed.decoder - 1)
+        self.assertRaises(TypeError, Reader, memory_budget='1000')
+        self.assertRaises(TypeError, Reader, memory_budget=1 << 20,
+                          input_buffer_size=100)
+
+    def test_writer_memory_budget(self):
+        needed = heatshrink.memory_for(window_sz2=8).encoder
+        self.assertNotRaises(Writer, window_sz2=8, memory_budget=needed)
+        self.assertRaises(ValueError, Writer, window_sz2=8,
+                          memory_budget=needed - 1)
+
+    def test_decode_takes_no_memory_budget(self):
+        # Its memory is the output, which only max_output_size bounds
+        encoded = heatshrink.encode(TEXT, window_sz2=8)
+        self.assertRaises(TypeError, heatshrink.decode, encoded,
+                          window_sz2=8, memory_budget=1 << 20)
+
 
 class EncoderToDecoderTest(TestUtilsMixin, unittest.TestCase):
     """
@@ -156,3 +595,21 @@ class EncoderToDecoderTest(TestUtilsMixin, unittest.TestCase):
                 msg = ('Decoded and original file contents '
                        'do not match for size: {}')
                 self.fail(msg.format(size))
+
+    def test_with_window(self):
+        encoded = heatshrink.encode(TEXT, window=TEXT)
+        self.assertLess(len(encoded), len(heatshrink.encode(TEXT)))
+        self.assertEqual(heatshrink.decode(encoded, window=TEXT), TEXT)
+        self.assertNotEqual(heatshrink.decode(encoded), TEXT)
+
+        # Only the end of a long window is used
+        window = random_string(10000).encode('ascii') + TEXT[:500]
+        encoded = heatshrink.encode(TEXT, window=window, window_sz2=9)
+        self.assertEqual(heatshrink.decode(encoded, window=window,
+                                           window_sz2=9), TEXT)
+
+    def test_window_after_input_fails(self):
+        for cls in (Writer, Reader):
+            encoder = Encoder(cls())
+            encoder.fill(TEXT)
+            self.assertRaises(ValueError, encoder._encoder.set_window, TEXT)
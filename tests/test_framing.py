@@ -0,0 +1,351 @@
+import io
+import os
+import unittest
+
+import heatshrink
+from heatshrink import framing
+from heatshrink.streams import EncodedFile
+
+from .constants import TEXT
+from .utils import TestUtilsMixin, random_string
+
+TEST_FILENAME = 'test_framing_{}_tmp'.format(os.getpid())
+
+
+def framed(data, **kwargs):
+    """Return data written to a framed stream."""
+    with io.BytesIO() as dst:
+        with EncodedFile(dst, 'wb', format=heatshrink.FORMAT_FRAMED,
+                         **kwargs) as fp:
+            fp.write(data)
+        return dst.getvalue()
+
+
+class FramingTest(TestUtilsMixin, unittest.TestCase):
+    """Tests for the member header functions."""
+
+    def test_header_round_trip(self):
+        header = framing.pack_header(10, 20, 11, 4)
+        self.assertEqual(len(header), framing.HEADER_SIZE)
+
+        member = framing.read_header(io.BytesIO(header), 5, 7)
+        self.assertEqual(member, framing.Member(5, 7, 10, 20, 11, 4, 0))
+
+    def test_read_header_at_eof(self):
+        self.assertEqual(framing.read_header(io.BytesIO()), None)
+
+    def test_bad_headers(self):
+        header = framing.pack_header(10, 20, 11, 4)
+        self.assertRaises(IOError, framing.read_header,
+                          io.BytesIO(header[:-1]))
+        self.assertRaises(IOError, framing.read_header,
+                          io.BytesIO(b'junk' + header[4:]))
+
+        for window_sz2, lookahead_sz2 in [(8, 8), (8, 9), (3, 2), (16, 4),
+                                          (8, 2)]:
+            header = framing.pack_header(10, 20, window_sz2, lookahead_sz2)
+            self.assertRaises(IOError, framing.unpack_header, header)
+
+    def test_corrupt_header_params(self):
+        encoded = bytearray(framing.encode_member(TEXT))
+        # lookahead_sz2 of the header
+        encoded[6] = encoded[5]
+        with EncodedFile(io.BytesIO(encoded),
+                         format=heatshrink.FORMAT_FRAMED) as fp:
+            self.assertRaises(IOError, fp.read)
+
+    def test_encode_member(self):
+        data = framing.encode_member(TEXT, window_sz2=8, lookahead_sz2=4)
+        fp = io.BytesIO(data)
+        member = framing.read_header(fp)
+        self.assertEqual((member.size, member.window_sz2, member.lookahead_sz2),
+                         (len(TEXT), 8, 4))
+
+        payload = framing.read_payload(fp, member)
+        self.assertEqual(framing.decode_member(member, payload), TEXT)
+
+    def test_stored_member(self):
+        data = os.urandom(1000)
+        encoded = framing.encode_member(data, store=heatshrink.STORE_IF_LARGER)
+        self.assertEqual(len(encoded), framing.HEADER_SIZE + len(data))
+
+        member = framing.unpack_header(encoded[:framing.HEADER_SIZE])
+        self.assertTrue(member.flags & framing.FLAG_STORED)
+        payload = encoded[framing.HEADER_SIZE:]
+        self.assertEqual(framing.decode_member(member, payload), data)
+        self.assertRaises(IOError, framing.decode_member, member,
+                          payload[:-1])
+
+        # Compressible data is still compressed
+        encoded = framing.encode_member(TEXT, store=heatshrink.STORE_AUTO)
+        self.assertLess(len(encoded), len(TEXT))
+        self.assertRaises(ValueError, framing.encode_member, TEXT, store=3)
+
+    def test_decode_member_checks_size(self):
+        fp = io.BytesIO(framing.encode_member(TEXT))
+        member = framing.read_header(fp)
+        payload = framing.read_payload(fp, member)
+
+        self.assertRaises(IOError, framing.decode_member,
+                          member._replace(size=len(TEXT) - 1), payload)
+        self.assertRaises(IOError, framing.decode_member,
+                          member._replace(size=len(TEXT) + 1), payload)
+
+
+class FramedFileTest(TestUtilsMixin, unittest.TestCase):
+    """Tests for EncodedFile using the framed format."""
+
+    def tearDown(self):
+        if os.path.exists(TEST_FILENAME):
+            os.unlink(TEST_FILENAME)
+
+    def _open(self, data, **kwargs):
+        return EncodedFile(io.BytesIO(data), format=heatshrink.FORMAT_FRAMED,
+                           **kwargs)
+
+    def test_round_trip(self):
+        with self._open(framed(TEXT)) as fp:
+            self.assertEqual(fp.read(), TEXT)
+
+    def test_empty_file(self):
+        self.assertEqual(framed(b''), b'')
+        with self._open(b'') as fp:
+            self.assertEqual(fp.read(), b'')
+            self.assertEqual(fp.members(), [])
+
+    def test_member_size(self):
+        data = framed(TEXT, member_size=100)
+
+        with self._open(data) as fp:
+            members = fp.members()
+            self.assertEqual(len(members), (len(TEXT) + 99) // 100)
+            self.assertEqual([m.start for m in members],
+                             list(range(0, len(TEXT), 100)))
+            self.assertEqual(fp.read(), TEXT)
+
+        self.assertRaises(ValueError, framed, TEXT, member_size=0)
+
+    def test_members_record_params(self):
+        data = framed(TEXT, window_sz2=8, lookahead_sz2=3)
+
+        # Parameters are read from the member headers
+        with self._open(data) as fp:
+            member, = fp.members()
+            self.assertEqual((member.window_sz2, member.lookahead_sz2), (8, 3))
+            self.assertEqual(fp.read(), TEXT)
+
+    def test_largest_window(self):
+        contents = random_string(5000).encode('ascii') + TEXT * 100
+        params = {'window_sz2': 15, 'lookahead_sz2': 8}
+        with io.BytesIO() as dst:
+            with EncodedFile(dst, 'wb', format=heatshrink.FORMAT_FRAMED,
+                             member_size=len(contents) // 2 + 1,
+                             **params) as fp:
+                fp.write(contents[:1000])
+                fp.flush(heatshrink.FLUSH_SYNC)
+                fp.write(contents[1000:])
+            data = dst.getvalue()
+
+        with self._open(data) as fp:
+            self.assertEqual([(m.window_sz2, m.lookahead_sz2)
+                              for m in fp.members()], [(15, 8)] * 3)
+            self.assertEqual(fp.read(), contents)
+
+    def test_append(self):
+        chunks = [random_string(size).encode('ascii')
+                  for size in (1000, 10, 5000)]
+
+        for chunk in chunks:
+            with EncodedFile(TEST_FILENAME, 'ab',
+                             format=heatshrink.FORMAT_FRAMED) as fp:
+                fp.write(chunk)
+
+        with EncodedFile(TEST_FILENAME, format=heatshrink.FORMAT_FRAMED) as fp:
+            self.assertEqual(len(fp.members()), 3)
+            self.assertEqual(fp.read(), b''.join(chunks))
+
+    def test_parallel_read(self):
+        contents = random_string(100000).encode('ascii')
+        data = framed(contents, member_size=4096)
+
+        for threads in (1, 2, 8):
+            with self._open(data, threads=threads) as fp:
+                self.assertEqual(fp.read(), contents)
+
+            with self._open(data, threads=threads) as fp:
+                blocks = iter(lambda: fp.read(1000), b'')
+                self.assertEqual(b''.join(blocks), contents)
+
+        self.assertRaises(ValueError, self._open, data, threads=0)
+
+    def test_seek(self):
+        data = framed(TEXT, member_size=64)
+
+        with self._open(data, threads=2) as fp:
+            self.assertEqual(fp.read(100), TEXT[:100])
+            fp.seek(500)
+            self.assertEqual(fp.read(100), TEXT[500:600])
+            fp.seek(10)
+            self.assertEqual(fp.read(100), TEXT[10:110])
+            self.assertEqual(fp.seek(-100, io.SEEK_END), len(TEXT) - 100)
+            self.assertEqual(fp.read(), TEXT[-100:])
+            self.assertEqual(fp.seek(0, io.SEEK_END), len(TEXT))
+            self.assertEqual(fp.read(), b'')
+            self.assertRaises(IOError, fp.seek, -1)
+
+    def test_readline(self):
+        with self._open(framed(TEXT, member_size=50)) as fp:
+            self.assertEqual(fp.readlines(), TEXT.splitlines(True))
+
+    def test_max_output_size(self):
+        data = framed(TEXT, member_size=100)
+
+        with self._open(data, max_output_size=len(TEXT)) as fp:
+            self.assertEqual(fp.read(), TEXT)
+
+        with self._open(data, max_output_size=150) as fp:
+            self.assertEqual(fp.read(100), TEXT[:100])
+            self.assertRaises(ValueError, fp.read)
+
+    def test_corrupt_stream(self):
+        data = framed(TEXT)
+        with self._open(data[:-1]) as fp:
+            self.assertRaises(IOError, fp.read)
+        with self._open(data + b'junk') as fp:
+            self.assertRaises(IOError, fp.read)
+
+    def test_flush(self):
+        for mode in (heatshrink.FLUSH_SYNC, heatshrink.FLUSH_FULL):
+            dst = io.BytesIO()
+            fp = EncodedFile(dst, 'wb', format=heatshrink.FORMAT_FRAMED)
+            fp.write(TEXT[:500])
+            fp.flush(mode)
+            # Everything written so far is readable before closing
+            with self._open(dst.getvalue()) as reader:
+                self.assertEqual(reader.read(), TEXT[:500])
+
+            fp.write(TEXT[500:])
+            fp.close()
+            with self._open(dst.getvalue()) as reader:
+                self.assertEqual(len(reader.members()), 2)
+                self.assertEqual(reader.read(), TEXT)
+
+    def test_sync_flush_keeps_window(self):
+        def flushed(mode):
+            with io.BytesIO() as dst:
+                with EncodedFile(dst, 'wb',
+                                 format=heatshrink.FORMAT_FRAMED) as fp:
+                    for line in TEXT.splitlines(True):
+                        fp.write(line)
+                        fp.flush(mode)
+                return dst.getvalue()
+
+        sync = flushed(heatshrink.FLUSH_SYNC)
+        full = flushed(heatshrink.FLUSH_FULL)
+        self.assertLess(len(sync), len(full))
+
+        with self._open(sync) as fp:
+            members = fp.members()
+            self.assertFalse(members[0].flags & framing.FLAG_CONTINUED)
+            self.assertTrue(all(m.flags & framing.FLAG_CONTINUED
+                                for m in members[1:]))
+            self.assertEqual(fp.read(), TEXT)
+
+        with self._open(sync, threads=4) as fp:
+            self.assertEqual(fp.read(), TEXT)
+            fp.seek(len(TEXT) // 2)
+            self.assertEqual(fp.read(), TEXT[len(TEXT) // 2:])
+
+    def test_flush_checks_mode(self):
+        with EncodedFile(io.BytesIO(), 'wb',
+                         format=heatshrink.FORMAT_FRAMED) as fp:
+            fp.flush()
+            self.assertRaises(ValueError, fp.flush, 'sync')
+
+    def test_raw_format_flush_unsupported(self):
+        with EncodedFile(io.BytesIO(), 'wb') as fp:
+            fp.write(TEXT)
+            fp.flush()
+            self.assertRaises(io.UnsupportedOperation, fp.flush,
+                              heatshrink.FLUSH_SYNC)
+
+    def test_store_modes(self):
+        blobs = [os.urandom(1000), TEXT, os.urandom(1000), TEXT[::-1],
+                 os.urandom(1000), TEXT]
+        sizes = {}
+        for store in (heatshrink.STORE_NEVER, heatshrink.STORE_IF_LARGER,
+                      heatshrink.STORE_AUTO):
+            dst = io.BytesIO()
+            with EncodedFile(dst, 'wb', format=heatshrink.FORMAT_FRAMED,
+                             store=store) as fp:
+                for blob in blobs:
+                    fp.write(blob)
+                    fp.flush(heatshrink.FLUSH_SYNC)
+
+            sizes[store] = len(dst.getvalue())
+            with self._open(dst.getvalue()) as fp:
+                stored = [bool(m.flags & framing.FLAG_STORED)
+                          for m in fp.members()]
+                self.assertEqual(fp.read(), b''.join(blobs))
+                self.assertEqual(fp.seek(2500), 2500)
+                self.assertEqual(fp.read(), b''.join(blobs)[2500:])
+
+            expected = [store != heatshrink.STORE_NEVER, False] * 3
+            self.assertEqual(stored, expected)
+
+        self.assertLess(sizes[heatshrink.STORE_IF_LARGER],
+                        sizes[heatshrink.STORE_NEVER])
+        self.assertEqual(sizes[heatshrink.STORE_AUTO],
+                         sizes[heatshrink.STORE_IF_LARGER])
+
+    def test_max_level(self):
+        contents = random_string(3000).encode('ascii') + TEXT * 20 + \
+            b'\x00' * 3000
+        encoded = {}
+        for threads in (1, 4):
+            dst = io.BytesIO()
+            with EncodedFile(dst, 'wb', format=heatshrink.FORMAT_FRAMED,
+                             level=heatshrink.LEVEL_MAX, threads=threads,
+                             member_size=3000) as fp:
+                fp.write(contents[:5000])
+                fp.flush(heatshrink.FLUSH_SYNC)
+                fp.write(contents[5000:])
+            encoded[threads] = dst.getvalue()
+
+            with self._open(encoded[threads]) as fp:
+                self.assertEqual(fp.read(), contents)
+                members = fp.members()
+
+            # Every member is at most as large as with the default
+            for member in members:
+                data = contents[member.start:member.start + member.size]
+                window = contents[:member.start] if member.flags else None
+                default = heatshrink.encode(data, window=window)
+                self.assertLessEqual(member.compressed_size, len(default))
+            self.assertGreater(len({(m.window_sz2, m.lookahead_sz2)
+                                    for m in members}), 1)
+
+        self.assertEqual(encoded[1], encoded[4])
+
+    def test_max_level_member(self):
+        for data in (TEXT, b'\x00' * 1000, b''):
+            encoded = framing.encode_member(data, level=heatshrink.LEVEL_MAX)
+            member = framing.unpack_header(encoded[:framing.HEADER_SIZE])
+            self.assertLessEqual(member.compressed_size,
+                                 len(heatshrink.encode(data)))
+            self.assertEqual(framing.decode_member(
+                member, encoded[framing.HEADER_SIZE:]), data)
+        self.assertRaises(ValueError, framing.encode_member, TEXT, level=2)
+
+    def test_store_requires_framed_format(self):
+        self.assertRaises(ValueError, EncodedFile, io.BytesIO(), 'wb',
+                          store=heatshrink.STORE_AUTO)
+        self.assertRaises(ValueError, EncodedFile, io.BytesIO(), 'wb',
+                          level=heatshrink.LEVEL_MAX)
+
+    def test_params(self):
+        params = heatshrink.Params(8, 4)
+        with self._open(framed(TEXT, params=params, member_size=100)) as fp:
+            self.assertEqual({(m.window_sz2, m.lookahead_sz2)
+                              for m in fp.members()}, {(8, 4)})
+            self.assertEqual(fp.read(), TEXT)
@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from .utils import TestUtilsMixin
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Generous limit on the time taken by "import heatshrink", well above
+# the few milliseconds it takes, to catch heavy imports sneaking back.
+MAX_IMPORT_TIME = 0.1
+
+_SCRIPT = '''
+import sys, time
+initial = time.time()
+import heatshrink
+elapsed = time.time() - initial
+print(elapsed)
+print(' '.join(sorted(sys.modules)))
+'''
+
+
+def _run(script):
+    """Run a Python script in a fresh interpreter, returning stdout lines."""
+    output = subprocess.check_output([sys.executable, '-c', script],
+                                     cwd=PROJECT_DIR)
+    return output.decode('ascii').splitlines()
+
+
+@unittest.skipIf(sys.version_info < (3, 7),
+                 'Module attributes are only loaded lazily on Python 3.7+')
+class ImportTest(TestUtilsMixin, unittest.TestCase):
+    def test_streams_are_imported_lazily(self):
+        modules = _run(_SCRIPT)[1].split()
+        for name in ('heatshrink.streams', 'heatshrink.framing',
+                     'multiprocessing.pool'):
+            self.assertNotIn(name, modules)
+
+    def test_lazy_attributes(self):
+        lines = _run('import heatshrink\n'
+                     'print(heatshrink.EncodedFile.__module__)\n'
+                     'from heatshrink import open, FORMAT_FRAMED\n'
+                     'print("open" in dir(heatshrink))\n')
+        self.assertEqual(lines, ['heatshrink.streams', 'True'])
+
+        import heatshrink
+        self.assertRaises(AttributeError, getattr, heatshrink, 'missing')
+
+    def test_import_time(self):
+        # Best of a few runs, to ignore a slow start of the interpreter
+        elapsed = min(float(_run(_SCRIPT)[0]) for _ in range(3))
+        self.assertLess(elapsed, MAX_IMPORT_TIME)
@@ -0,0 +1,82 @@
+import os
+import unittest
+
+import heatshrink
+from heatshrink.parallel import map_decode, map_encode
+
+from .constants import TEXT
+from .utils import TestUtilsMixin, random_string
+
+_SHM_DIR = '/dev/shm'
+
+
+def shared_blocks():
+    """Return the names of the shared memory blocks, where visible."""
+    if not os.path.isdir(_SHM_DIR):
+        return set()
+    return set(name for name in os.listdir(_SHM_DIR)
+               if name.startswith('psm_'))
+
+
+class MapTest(TestUtilsMixin, unittest.TestCase):
+    def setUp(self):
+        self.buffers = [random_string(n * 37).encode('ascii') + TEXT
+                        for n in range(20)]
+        self.buffers.append(b'')
+        self.blocks = shared_blocks()
+
+    def tearDown(self):
+        # Every block has been freed
+        self.assertEqual(shared_blocks() - self.blocks, set())
+
+    def test_encode_in_order(self):
+        expected = [heatshrink.encode(buf) for buf in self.buffers]
+        for chunksize in (1, 3, 100):
+            self.assertEqual(list(map_encode(self.buffers, processes=2,
+                                             chunksize=chunksize)),
+                             expected)
+
+    def test_decode_in_order(self):
+        encoded = [heatshrink.encode(buf, window_sz2=8)
+                   for buf in self.buffers]
+        self.assertEqual(list(map_decode(iter(encoded), processes=2,
+                                         chunksize=4, window_sz2=8)),
+                         self.buffers)
+
+    def test_single_process(self):
+        self.assertEqual(list(map_encode(self.buffers, processes=1)),
+                         [heatshrink.encode(buf) for buf in self.buffers])
+
+    def test_buffer_types(self):
+        buffers = [bytearray(TEXT), memoryview(TEXT), list(TEXT[:10])]
+        expected = [heatshrink.encode(TEXT), heatshrink.encode(TEXT),
+                    heatshrink.encode(TEXT[:10])]
+        for processes in (1, 2):
+            self.assertEqual(list(map_encode(buffers, processes=processes)),
+                             expected)
+
+    def test_params(self):
+        for kwargs in ({'window_sz2': 15, 'lookahead_sz2': 8},
+                       {'params': heatshrink.Params(8, 4), 'window': TEXT}):
+            encoded = list(map_encode(self.buffers, processes=2, **kwargs))
+            self.assertEqual(encoded, [heatshrink.encode(buf, **kwargs)
+                                       for buf in self.buffers])
+            self.assertEqual(list(map_decode(encoded, processes=2,
+                                             **kwargs)),
+                             self.buffers)
+
+    def test_errors_are_raised(self):
+        encoded = [heatshrink.encode(buf) for buf in self.buffers]
+        results = map_decode(encoded, processes=2, max_output_size=1000)
+        self.assertEqual(next(results), self.buffers[0])
+        self.assertRaises(ValueError, list, results)
+
+    def test_stopping_early(self):
+        results = map_encode(self.buffers * 10, processes=2)
+        next(results)
+        results.close()
+
+    def test_bad_args(self):
+        self.assertRaises(ValueError, map_encode, [], processes=0)
+        self.assertRaises(ValueError, map_encode, [], chunksize=0)
+        self.assertRaises(ValueError, map_decode, [], window_sz2=3)
@@ -0,0 +1,114 @@
+"""Throughput regression checks.
+
+Measures the throughput of the encode and decode paths on the corpora
+of tests.corpus and compares it with a baseline recorded on the same
+machine. Record a baseline before a change with:
+
+    $ python -m tests.test_performance baseline.json
+
+and check against it afterwards with:
+
+    $ HEATSHRINK_PERF_BASELINE=baseline.json python -m pytest \\
+          tests/test_performance.py
+
+A path fails if it is slower than its baseline by more than the
+HEATSHRINK_PERF_THRESHOLD fraction, 0.2 by default. Without a
+baseline, the check is skipped.
+"""
+import json
+import os
+import sys
+import time
+import unittest
+
+import heatshrink
+from heatshrink.core import Reader, Writer
+
+from . import corpus
+from .utils import read_file, stream, write_file
+
+BASELINE = os.environ.get('HEATSHRINK_PERF_BASELINE')
+THRESHOLD = float(os.environ.get('HEATSHRINK_PERF_THRESHOLD', 0.2))
+
+# Number of timed runs of each path, the fastest counts
+REPEAT = 5
+CHUNK_SIZE = 1 << 16
+# Size of the messages of the small_* paths, where the fixed cost of
+# each call dominates
+MESSAGE_SIZE = 100
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+def paths(data):
+    """Return a dict of the measured paths, functions processing data."""
+    encoded = heatshrink.encode(data)
+    framed = {'format': heatshrink.FORMAT_FRAMED}
+    messages = [data[i:i + MESSAGE_SIZE]
+                for i in range(0, len(data), MESSAGE_SIZE)]
+    encoded_messages = [heatshrink.encode(m) for m in messages]
+    encoded_framed = write_file(data, CHUNK_SIZE, **framed)
+    return {
+        'encode': lambda: heatshrink.encode(data),
+        'decode': lambda: heatshrink.decode(encoded),
+        'decompressed_size': lambda: heatshrink.decompressed_size(encoded),
+        'writer': lambda: stream(Writer(), data, CHUNK_SIZE),
+        'reader': lambda: stream(Reader(), encoded, CHUNK_SIZE),
+        'file_write': lambda: write_file(data, CHUNK_SIZE),
+        'file_read': lambda: read_file(encoded, CHUNK_SIZE),
+        'framed_write': lambda: write_file(data, CHUNK_SIZE, **framed),
+        'framed_read': lambda: read_file(encoded_framed, CHUNK_SIZE,
+                                         **framed),
+        'small_encode': lambda: [heatshrink.encode(m) for m in messages],
+        'small_decode': lambda: [heatshrink.decode(m)
+                                 for m in encoded_messages],
+    }
+
+
+def measure():
+    """Return the throughput of each path, in MB/s of decoded data."""
+    data = b''.join(data for _, data in sorted(corpus.corpora().items()))
+    throughput = {}
+    for name, func in sorted(paths(data).items()):
+        best = float('inf')
+        for _ in range(REPEAT):
+            start = _clock()
+            func()
+            best = min(best, _clock() - start)
+        throughput[name] = len(data) / best / 1e6
+    return throughput
+
+
+@unittest.skipIf(BASELINE is None,
+                 'set HEATSHRINK_PERF_BASELINE to check the throughput')
+class ThroughputTest(unittest.TestCase):
+    def test_throughput(self):
+        with open(BASELINE) as fp:
+            baseline = json.load(fp)
+        self.assertEqual(baseline['corpus_size'], corpus.DEFAULT_SIZE,
+                         'baseline was recorded with another corpus size')
+
+        throughput = measure()
+        slower = []
+        for name, expected in sorted(baseline['throughput'].items()):
+            if throughput[name] < expected * (1 - THRESHOLD):
+                slower.append('{}: {:.1f} MB/s, baseline {:.1f} MB/s'.format(
+                    name, throughput[name], expected))
+        self.assertEqual(slower, [], 'Slower than the baseline:\n' +
+                         '\n'.join(slower))
+
+
+def main(argv):
+    if len(argv) != 2:
+        sys.exit('usage: python -m tests.test_performance BASELINE')
+
+    throughput = measure()
+    with open(argv[1], 'w') as fp:
+        json.dump({'corpus_size': corpus.DEFAULT_SIZE,
+                   'throughput': throughput}, fp, indent=2, sort_keys=True)
+    for name, value in sorted(throughput.items()):
+        print('{:<20} {:8.1f} MB/s'.format(name, value))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
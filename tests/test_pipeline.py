@@ -0,0 +1,174 @@
+import io
+import threading
+import unittest
+
+import heatshrink
+from heatshrink.streams import EncodedFile
+
+from .constants import TEXT
+from .utils import TestUtilsMixin, random_string
+
+
+class SlowFile(io.BytesIO):
+    """BytesIO whose writes wait until they are allowed."""
+    def __init__(self):
+        super(SlowFile, self).__init__()
+        self.allowed = threading.Event()
+
+    def write(self, data):
+        self.allowed.wait()
+        return super(SlowFile, self).write(data)
+
+
+class FailingFile(io.BytesIO):
+    def write(self, data):
+        raise IOError('disk full')
+
+
+class PipelinedWriterTest(TestUtilsMixin, unittest.TestCase):
+    def setUp(self):
+        self.chunks = [random_string(1000).encode('ascii') + TEXT
+                       for _ in range(20)]
+
+    def _write(self, pipeline, flush=None, **kwargs):
+        dst = io.BytesIO()
+        with EncodedFile(dst, 'wb', pipeline=pipeline, **kwargs) as fp:
+            for chunk in self.chunks:
+                fp.write(chunk)
+                if flush is not None:
+                    fp.flush(flush)
+        return dst.getvalue()
+
+    def test_output_matches_unpipelined(self):
+        self.assertEqual(self._write(4), self._write(0))
+        self.assertEqual(self._write(1, window_sz2=8),
+                         self._write(0, window_sz2=8))
+
+    def test_framed_format(self):
+        for mode in (None, heatshrink.FLUSH_SYNC, heatshrink.FLUSH_FULL):
+            kwargs = {'format': heatshrink.FORMAT_FRAMED,
+                      'member_size': 3000, 'flush': mode}
+            data = self._write(2, **kwargs)
+            self.assertEqual(data, self._write(0, **kwargs))
+
+            with EncodedFile(io.BytesIO(data),
+                             format=heatshrink.FORMAT_FRAMED) as fp:
+                self.assertEqual(fp.read(), b''.join(self.chunks))
+
+    def test_flush_waits_for_pipeline(self):
+        dst = io.BytesIO()
+        fp = EncodedFile(dst, 'wb', format=heatshrink.FORMAT_FRAMED,
+                         pipeline=4)
+        fp.write(TEXT)
+        fp.flush(heatshrink.FLUSH_FULL)
+        with EncodedFile(io.BytesIO(dst.getvalue()),
+                         format=heatshrink.FORMAT_FRAMED) as reader:
+            self.assertEqual(reader.read(), TEXT)
+        fp.close()
+
+    def test_write_does_not_wait_for_io(self):
+        dst = SlowFile()
+        fp = EncodedFile(dst, 'wb', pipeline=4)
+        for chunk in self.chunks[:4]:
+            fp.write(chunk)
+        self.assertEqual(dst.getvalue(), b'')
+
+        dst.allowed.set()
+        fp.close()
+        self.assertEqual(heatshrink.decode(dst.getvalue()),
+                         b''.join(self.chunks[:4]))
+
+    def test_buffers_can_be_reused(self):
+        dst = io.BytesIO()
+        buf = bytearray(TEXT)
+        with EncodedFile(dst, 'wb', pipeline=4) as fp:
+            fp.write(buf)
+            buf[:] = b'x' * len(buf)
+        self.assertEqual(heatshrink.decode(dst.getvalue()), TEXT)
+
+    def test_errors_are_raised_by_next_call(self):
+        fp = EncodedFile(FailingFile(), 'wb', format=heatshrink.FORMAT_FRAMED,
+                         member_size=100, pipeline=2)
+        fp.write(TEXT)
+        self.assertRaises(IOError, fp.flush)
+        self.assertRaises(IOError, fp.write, TEXT)
+        self.assertRaises(IOError, fp.close)
+        self.assertTrue(fp.closed)
+
+    def test_bad_args(self):
+        self.assertRaises(ValueError, EncodedFile, io.BytesIO(), 'wb',
+                          pipeline=-1)
+        with EncodedFile(io.BytesIO(), 'wb', pipeline=2) as fp:
+            self.assertRaises(TypeError, fp.write, u'abc')
+            self.assertRaises(io.UnsupportedOperation, fp.flush,
+                              heatshrink.FLUSH_SYNC)
+
+
+class FailingReader(io.BytesIO):
+    def read(self, size=-1):
+        data = super(FailingReader, self).read(size)
+        if self.tell() > 100:
+            raise IOError('read error')
+        return data
+
+
+def read_ahead_threads():
+    return [t for t in threading.enumerate()
+            if t.name == 'heatshrink-read-ahead']
+
+
+class ReadAheadTest(TestUtilsMixin, unittest.TestCase):
+    def setUp(self):
+        self.contents = (random_string(200000).encode('ascii') +
+                         TEXT * 100)
+        self.encoded = heatshrink.encode(self.contents)
+
+    def _open(self, read_ahead=4, **kwargs):
+        return EncodedFile(io.BytesIO(self.encoded), read_ahead=read_ahead,
+                           **kwargs)
+
+    def test_read(self):
+        for depth in (1, 4):
+            with self._open(depth) as fp:
+                self.assertEqual(fp.read(10), self.contents[:10])
+                self.assertEqual(fp.read(), self.contents[10:])
+                self.assertEqual(fp.read(), b'')
+
+    def test_readlines(self):
+        with self._open() as fp:
+            self.assertEqual(list(fp), self.contents.splitlines(True))
+
+    def test_seek(self):
+        with self._open() as fp:
+            fp.read(1000)
+            self.assertEqual(fp.seek(100000), 100000)
+            self.assertEqual(fp.read(10), self.contents[100000:100010])
+            self.assertEqual(fp.seek(-10, io.SEEK_END),
+                             len(self.contents) - 10)
+            self.assertEqual(fp.read(), self.contents[-10:])
+            self.assertEqual(fp.seek(5), 5)
+            self.assertEqual(fp.read(10), self.contents[5:15])
+
+    def test_cache(self):
+        with self._open(cache=heatshrink.BlockCache()) as fp:
+            # Not cached, the file has no descriptor
+            self.assertEqual(fp.read(), self.contents)
+
+    def test_max_output_size(self):
+        with self._open(max_output_size=1000) as fp:
+            self.assertEqual(fp.read(1000), self.contents[:1000])
+            self.assertRaises(ValueError, fp.read)
+
+    def test_read_errors_are_raised(self):
+        with EncodedFile(FailingReader(self.encoded), read_ahead=2) as fp:
+            self.assertRaises(IOError, fp.read)
+
+    def test_close_stops_thread(self):
+        fp = self._open(1)
+        fp.read(10)
+        self.assertEqual(len(read_ahead_threads()), 1)
+        fp.close()
+        self.assertEqual(read_ahead_threads(), [])
+
+    def test_bad_args(self):
+        self.assertRaises(ValueError, self._open, -1)
@@ -0,0 +1,210 @@
+"""Differential round-trip tests over generated corpora.
+
+Every encode and decode path is run on the corpora of tests.corpus
+with every parameter combination, checking that the paths agree with
+each other bit for bit and that everything decodes back to its input.
+
+If the reference command line tool of the C library is available,
+set with the HEATSHRINK_CLI environment variable or found on the PATH,
+its output is compared with encode as well.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import heatshrink
+from heatshrink.core import MAX_WRITER_WINDOW_SZ2, Params, Reader, Writer
+from heatshrink.parallel import map_decode, map_encode
+
+from . import corpus
+from .constants import TEXT
+from .utils import TestUtilsMixin, read_file, stream, write_file
+
+# Corpus size of the sweep over all parameters, which is raised to a
+# few windows for large windows so that the window wraps around.
+SWEEP_SIZE = corpus.DEFAULT_SIZE // 8
+
+# Odd chunk sizes for the streaming paths, so that chunks end in the
+# middle of tokens
+CHUNK_SIZES = (1021, 7919)
+
+# A few parameter combinations that every path is run with on the
+# full-size corpora
+LARGE_PARAMS = [Params(8, 4), Params(11, 4), Params(14, 8), Params(15, 7)]
+
+
+def sweep_size(params):
+    return max(SWEEP_SIZE, 3 << params.window_sz2)
+
+
+def has_writer(params):
+    """Return whether the streaming encoder supports params.
+
+    Larger windows are rejected by Writer and by the raw format
+    writers, framed members are compressed with encode instead.
+    """
+    return params.window_sz2 <= MAX_WRITER_WINDOW_SZ2
+
+
+class RoundTripMixin(TestUtilsMixin):
+    def check_core(self, data, params, msg):
+        encoded = heatshrink.encode(data, params=params)
+        self.assertEqual(heatshrink.decode(encoded, params=params), data,
+                         msg)
+        self.assertEqual(heatshrink.decompressed_size(encoded, params=params),
+                         len(data), msg)
+
+        for chunk_size in CHUNK_SIZES:
+            self.assertEqual(stream(Reader(params), encoded, chunk_size),
+                             data, msg)
+            if has_writer(params):
+                self.assertEqual(stream(Writer(params), data, chunk_size),
+                                 encoded, msg)
+            else:
+                self.assertRaises(ValueError, Writer, params)
+        return encoded
+
+    def check_files(self, data, encoded, params, msg):
+        chunk_size = CHUNK_SIZES[0]
+        if has_writer(params):
+            self.assertEqual(write_file(data, chunk_size, params=params),
+                             encoded, msg)
+        else:
+            self.assertRaises(ValueError, write_file, data, chunk_size,
+                              params=params)
+        self.assertEqual(read_file(encoded, chunk_size, params=params),
+                         data, msg)
+        self.assertEqual(read_file(encoded, chunk_size, params=params,
+                                   read_ahead=2),
+                         data, msg)
+
+        # Framed files, stored or compressed at once, with members
+        # that continue the previous ones
+        framed = {'format': heatshrink.FORMAT_FRAMED,
+                  'member_size': len(data) // 3 + 1}
+        for store in (heatshrink.STORE_NEVER, heatshrink.STORE_IF_LARGER):
+            encoded = write_file(data, chunk_size, store=store,
+                                 params=params, **framed)
+            self.assertEqual(read_file(encoded, chunk_size, **framed), data,
+                             msg)
+
+
+class ParamsSweepTest(RoundTripMixin, unittest.TestCase):
+    """Runs every parameter combination on smaller corpora."""
+
+    def test_core_paths(self):
+        for params in corpus.all_params():
+            for name, data in sorted(corpus.corpora(sweep_size(params))
+                                     .items()):
+                self.check_core(data, params, (params, name))
+
+    def test_file_paths(self):
+        for params in corpus.all_params():
+            data = corpus.text(sweep_size(params))
+            encoded = heatshrink.encode(data, params=params)
+            self.check_files(data, encoded, params, params)
+
+    def test_window(self):
+        window = corpus.text(1 << 16, seed=1)
+        data = corpus.text(SWEEP_SIZE, seed=2)
+        for params in corpus.all_params():
+            encoded = heatshrink.encode(data, params=params, window=window)
+            self.assertEqual(heatshrink.decode(encoded, params=params,
+                                               window=window),
+                             data, params)
+            if has_writer(params):
+                self.assertEqual(stream(Writer(params, window=window), data,
+                                        CHUNK_SIZES[0]),
+                                 encoded, params)
+
+
+class LargeCorporaTest(RoundTripMixin, unittest.TestCase):
+    """Runs every path on the full-size corpora."""
+
+    def setUp(self):
+        self.corpora = corpus.corpora()
+
+    def test_paths(self):
+        for params in LARGE_PARAMS:
+            for name, data in sorted(self.corpora.items()):
+                encoded = self.check_core(data, params, (params, name))
+                self.check_files(data, encoded, params, (params, name))
+
+    def test_process_pool(self):
+        buffers = [data for _, data in sorted(self.corpora.items())]
+        encoded = list(map_encode(buffers, processes=2, chunksize=2))
+        self.assertEqual(encoded, [heatshrink.encode(buf) for buf in buffers])
+        self.assertEqual(list(map_decode(encoded, processes=2)), buffers)
+
+    def test_concatenated_corpora(self):
+        # Switches between very different data within the window
+        data = b''.join(data[:1 << 14] for _, data
+                        in sorted(self.corpora.items())) * 4
+        for params in LARGE_PARAMS:
+            self.check_core(data, params, params)
+
+
+def find_reference_cli():
+    """Return the path of the C library's command line tool, or None."""
+    path = os.environ.get('HEATSHRINK_CLI')
+    if path is None:
+        path = getattr(shutil, 'which', lambda name: None)('heatshrink')
+    if path is None:
+        return None
+
+    # Only the C tool has these options
+    try:
+        usage = subprocess.Popen([path, '-h'], stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT).communicate()[0]
+    except OSError:
+        return None
+    if b'-w' not in usage or b'-l' not in usage:
+        return None
+    return path
+
+
+class ReferenceCLITest(TestUtilsMixin, unittest.TestCase):
+    """Compares encode and decode with the C library's command line
+    tool."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cli = find_reference_cli()
+
+    def setUp(self):
+        if self.cli is None:
+            self.skipTest('reference heatshrink tool not found, set '
+                          'HEATSHRINK_CLI')
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _run(self, mode, data, params):
+        src = os.path.join(self.tmpdir, 'in')
+        dst = os.path.join(self.tmpdir, 'out')
+        with open(src, 'wb') as fp:
+            fp.write(data)
+        subprocess.check_call([self.cli, mode,
+                               '-w', str(params.window_sz2),
+                               '-l', str(params.lookahead_sz2), src, dst])
+        with open(dst, 'rb') as fp:
+            return fp.read()
+
+    def test_matches_reference(self):
+        for params in corpus.all_params():
+            for name, data in sorted(corpus.corpora(sweep_size(params))
+                                     .items()):
+                msg = (params, name)
+                encoded = heatshrink.encode(data, params=params)
+                self.assertEqual(self._run('-d', encoded, params), data, msg)
+                if has_writer(params):
+                    self.assertEqual(self._run('-e', data, params), encoded,
+                                     msg)
+
+    def test_text(self):
+        params = Params(8, 4)
+        self.assertEqual(self._run('-e', TEXT, params),
+                         heatshrink.encode(TEXT, params=params))
@@ -0,0 +1,101 @@
+import io
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import heatshrink
+from heatshrink.streams import EncodedFile
+
+from .constants import TEXT
+from .utils import TestUtilsMixin, random_string
+
+
+class IterLinesTest(TestUtilsMixin, unittest.TestCase):
+    def setUp(self):
+        self.contents = b''.join(
+            random_string(n % 97).encode('ascii') + b'\n' for n in range(3000)
+        ) + TEXT + b'no newline'
+        self.encoded = heatshrink.encode(self.contents)
+
+    def test_lines(self):
+        for chunk_size in (1, 7, 1000, 1 << 20):
+            with EncodedFile(io.BytesIO(self.encoded)) as fp:
+                lines = list(fp.iter_lines(chunk_size))
+            self.assertEqual(lines, list(io.BytesIO(self.contents)))
+
+    def test_from_position(self):
+        with EncodedFile(io.BytesIO(self.encoded)) as fp:
+            fp.readline()
+            lines = list(fp.iter_lines())
+        self.assertEqual(lines, list(io.BytesIO(self.contents))[1:])
+
+    def test_bad_args(self):
+        with EncodedFile(io.BytesIO(self.encoded)) as fp:
+            self.assertRaises(ValueError, list, fp.iter_lines(0))
+        with EncodedFile(io.BytesIO(), 'wb') as fp:
+            self.assertRaises(io.UnsupportedOperation, list, fp.iter_lines())
+
+
+class GrepTest(TestUtilsMixin, unittest.TestCase):
+    def setUp(self):
+        self.lines = [random_string(n % 131).replace('\n', '').encode('ascii')
+                      + b'\n' for n in range(2000)]
+        self.lines[10] = b'needle at the start\n'
+        self.lines[500] = b'a needle and another needle\n'
+        self.lines[1999] = b'last needle'
+        self.contents = b''.join(self.lines)
+        self.encoded = heatshrink.encode(self.contents)
+
+    def _grep(self, pattern, **kwargs):
+        return list(heatshrink.grep(io.BytesIO(self.encoded), pattern,
+                                    **kwargs))
+
+    def _expected(self, matches):
+        expected = []
+        offset = 0
+        for lineno, line in enumerate(self.lines, 1):
+            if matches(line):
+                expected.append(heatshrink.GrepMatch(lineno, offset, line))
+            offset += len(line)
+        return expected
+
+    def test_bytes_pattern(self):
+        expected = self._expected(lambda line: b'needle' in line)
+        self.assertEqual(len(expected), 3)
+        for chunk_size in (3, 100, 1 << 20):
+            self.assertEqual(self._grep(b'needle', chunk_size=chunk_size),
+                             expected)
+
+    def test_regex_pattern(self):
+        pattern = re.compile(b'^needle|needle$', re.MULTILINE)
+        expected = self._expected(lambda line: pattern.search(line))
+        self.assertEqual(len(expected), 3)
+        for chunk_size in (5, 1 << 20):
+            self.assertEqual(self._grep(pattern, chunk_size=chunk_size),
+                             expected)
+
+    def test_empty_pattern_matches_all_lines(self):
+        self.assertEqual(self._grep(b''), self._expected(lambda line: True))
+
+    def test_offsets_can_be_seeked(self):
+        with EncodedFile(io.BytesIO(self.encoded)) as fp:
+            for match in self._grep(b'needle'):
+                fp.seek(match.offset)
+                self.assertEqual(fp.readline(), match.line)
+
+    def test_file(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'lines.hs')
+            with heatshrink.open(filename, 'wb', window_sz2=8) as fp:
+                fp.write(self.contents)
+            matches = list(heatshrink.grep(filename, b'needle', window_sz2=8))
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual([m.lineno for m in matches], [11, 501, 2000])
+
+    def test_bad_args(self):
+        self.assertRaises(TypeError, self._grep, u'needle')
+        self.assertRaises(ValueError, self._grep, b'needle', chunk_size=0)
@@ -0,0 +1,128 @@
+import multiprocessing
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+import heatshrink
+from heatshrink import shared
+
+from .constants import TEXT
+from .utils import TestUtilsMixin
+
+
+def _shared_contents(args):
+    """Return the shared contents of a file, run in worker processes."""
+    filename, cache_dir = args
+    return bytes(heatshrink.open_shared(filename, cache_dir)[:])
+
+
+class OpenSharedTest(TestUtilsMixin, unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.filename = os.path.join(self.tmpdir, 'text.hs')
+        self._write(TEXT)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, data, **kwargs):
+        with heatshrink.open(self.filename, 'wb', **kwargs) as fp:
+            fp.write(data)
+
+    def test_decodes_once(self):
+        data = heatshrink.open_shared(self.filename, self.cache_dir)
+        self.assertEqual(data[:], TEXT)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+        path = shared.cache_path(self.filename, self.cache_dir)
+        mtime = os.stat(path).st_mtime
+        data = heatshrink.open_shared(self.filename, self.cache_dir)
+        self.assertEqual(data[:], TEXT)
+        self.assertEqual(os.stat(path).st_mtime, mtime)
+
+    def test_read_only(self):
+        data = heatshrink.open_shared(self.filename, self.cache_dir)
+        with self.assertRaises(TypeError):
+            data[0:1] = b'x'
+
+    def test_key_changes_with_contents_and_params(self):
+        path = shared.cache_path(self.filename, self.cache_dir)
+        self.assertNotEqual(path, shared.cache_path(
+            self.filename, self.cache_dir, window_sz2=8))
+        self.assertNotEqual(path, shared.cache_path(
+            self.filename, self.cache_dir, format=heatshrink.FORMAT_FRAMED))
+        self.assertNotEqual(path, shared.cache_path(
+            self.filename, self.cache_dir, window=TEXT[:100]))
+
+        self._write(TEXT[:100], format=heatshrink.FORMAT_FRAMED)
+        self.assertNotEqual(path, shared.cache_path(
+            self.filename, self.cache_dir))
+
+        data = heatshrink.open_shared(self.filename, self.cache_dir,
+                                      format=heatshrink.FORMAT_FRAMED)
+        self.assertEqual(data[:], TEXT[:100])
+
+    def test_window(self):
+        window = TEXT[:1000]
+        self._write(TEXT, window=window)
+        data = heatshrink.open_shared(self.filename, self.cache_dir,
+                                      window=window)
+        self.assertEqual(data[:], TEXT)
+        # Not the data decoded with the window
+        data = heatshrink.open_shared(self.filename, self.cache_dir)
+        self.assertNotEqual(data[:], TEXT)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    @unittest.skipUnless(hasattr(os, 'getuid'), 'requires user ids')
+    def test_default_cache_dir_is_private(self):
+        default = shared.DEFAULT_CACHE_DIR
+        shared.DEFAULT_CACHE_DIR = self.cache_dir
+        try:
+            data = heatshrink.open_shared(self.filename)
+            self.assertEqual(data[:], TEXT)
+            mode = os.stat(self.cache_dir).st_mode
+            self.assertEqual(stat.S_IMODE(mode), 0o700)
+
+            os.chmod(self.cache_dir, 0o777)
+            self.assertRaises(IOError, heatshrink.open_shared, self.filename)
+        finally:
+            shared.DEFAULT_CACHE_DIR = default
+
+    @unittest.skipUnless(hasattr(os, 'getuid'), 'requires user ids')
+    def test_untrusted_cache_file(self):
+        path = shared.cache_path(self.filename, self.cache_dir)
+        os.makedirs(self.cache_dir)
+        with open(path, 'wb') as fp:
+            fp.write(b'planted')
+        os.chmod(path, 0o666)
+        self.assertRaises(IOError, heatshrink.open_shared, self.filename,
+                          self.cache_dir)
+
+    def test_empty_file(self):
+        self._write(b'')
+        self.assertEqual(heatshrink.open_shared(self.filename,
+                                                self.cache_dir), b'')
+
+    def test_failed_decode_leaves_no_files(self):
+        self._write(TEXT, format=heatshrink.FORMAT_FRAMED)
+        with open(self.filename, 'ab') as fp:
+            fp.write(b'junk')
+
+        self.assertRaises(IOError, heatshrink.open_shared, self.filename,
+                          self.cache_dir, format=heatshrink.FORMAT_FRAMED)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_multiple_processes(self):
+        pool = multiprocessing.Pool(2)
+        try:
+            results = pool.map(_shared_contents,
+                               [(self.filename, self.cache_dir)] * 4)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        self.assertEqual(results, [TEXT] * 4)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
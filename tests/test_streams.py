@@ -5,6 +5,7 @@ import io
 import os
 import unittest
 
+import heatshrink
 from heatshrink.streams import EncodedFile
 
 from .constants import TEXT, COMPRESSED
@@ -53,7 +54,7 @@ class EncodedFileTest(TestUtilsMixin, unittest.TestCase):
             (8, 3),
             (11, 6),
             (4, 3),
-            (15, 9),
+            (14, 9),
         ]
 
         encoded = []
@@ -72,13 +73,26 @@ class EncodedFileTest(TestUtilsMixin, unittest.TestCase):
         # Ensure that all have different values
         self.assertEqual(len(encoded), len(set(encoded)))
 
+    def test_largest_window_is_rejected(self):
+        # The streaming encoder's output would be corrupt
+        with self.assertRaises(ValueError):
+            EncodedFile(io.BytesIO(), 'wb', window_sz2=15)
+
     def test_invalid_modes(self):
         data = io.BytesIO()
 
-        for mode in ['a+', 'w+', 'ab', 'r+', 'U', 'x', 'xb']:
+        for mode in ['a+', 'w+', 'r+', 'U', 'x', 'xb']:
             with self.assertRaisesRegexp(ValueError, '^Invalid mode: .*$'):
                 EncodedFile(data, mode=mode)
 
+    def test_append_requires_framed_format(self):
+        for mode in ['a', 'ab']:
+            with self.assertRaisesRegexp(ValueError, 'framed format'):
+                EncodedFile(io.BytesIO(), mode=mode)
+
+    def test_invalid_format(self):
+        self.assertRaises(ValueError, EncodedFile, io.BytesIO(), format=3)
+
     def test_round_trip(self):
         write_str = b'Testing\nAnd Stuff'
 
@@ -219,6 +233,17 @@ class EncodedFileTest(TestUtilsMixin, unittest.TestCase):
             self.assertEqual(seeked_pos, len(TEXT) - 100)
             self.assertEqual(fp.read(100), TEXT[-100:])
 
+    def test_seeking_to_end_does_not_decode(self):
+        with EncodedFile(io.BytesIO(COMPRESSED)) as fp:
+            self.assertEqual(fp.seek(0, io.SEEK_END), len(TEXT))
+            self.assertEqual(fp.read(), b'')
+
+        with EncodedFile(io.BytesIO(COMPRESSED)) as fp:
+            self.assertEqual(fp.seek(-10, io.SEEK_END), len(TEXT) - 10)
+            # The size was counted without reaching EOF
+            self.assertFalse(fp._buffer.raw._eof)
+            self.assertEqual(fp.read(), TEXT[-10:])
+
     def test_seeking_from_end_beyond_beginning(self):
         with EncodedFile(io.BytesIO(COMPRESSED)) as fp:
             # Go to end to get size
@@ -319,6 +344,40 @@ class EncodedFileTest(TestUtilsMixin, unittest.TestCase):
             lines = fp.readlines()
             self.assertEqual(b''.join(lines), TEXT)
 
+    def test_read_with_max_output_size(self):
+        with EncodedFile(io.BytesIO(COMPRESSED),
+                         max_output_size=len(TEXT)) as fp:
+            self.assertEqual(fp.read(), TEXT)
+
+        with EncodedFile(io.BytesIO(COMPRESSED), max_output_size=100) as fp:
+            self.assertEqual(fp.read(100), TEXT[:100])
+            self.assertRaises(ValueError, fp.read)
+
+    def test_memory_budget(self):
+        usage = heatshrink.memory_for(input_buffer_size=64)
+        with EncodedFile(io.BytesIO(COMPRESSED),
+                         memory_budget=usage.decoder) as fp:
+            self.assertEqual(fp.read(), TEXT)
+
+        self.assertRaises(ValueError, EncodedFile, io.BytesIO(), 'wb',
+                          memory_budget=usage.encoder - 1)
+        self.assertRaises(ValueError, EncodedFile, io.BytesIO(COMPRESSED),
+                          format=heatshrink.FORMAT_FRAMED,
+                          memory_budget=usage.decoder)
+
+    def test_read_is_bounded_by_read_size(self):
+        with io.BytesIO() as dst:
+            with EncodedFile(dst, mode='wb') as fp:
+                fp.write(b'\x00' * 1000000)
+
+            dst.seek(0)
+            with EncodedFile(dst) as fp:
+                raw = fp._buffer.raw
+                self.assertEqual(raw.read(10), b'\x00' * 10)
+                # Only a read-sized chunk should have been decoded
+                self.assertTrue(len(raw._buf) <= 10)
+                self.assertEqual(len(fp.read()), 1000000 - 10)
+
     #################
     # Writing
     #################
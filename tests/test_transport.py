@@ -0,0 +1,284 @@
+import io
+import socket
+import threading
+import unittest
+
+try:
+    import asyncio
+    _Protocol = asyncio.Protocol
+    _Transport = asyncio.Transport
+except ImportError:
+    asyncio = None
+    _Protocol = _Transport = object
+
+from heatshrink import framing
+from heatshrink.transport import EncodedSocket, EncodedProtocol
+
+from .constants import TEXT
+from .utils import TestUtilsMixin, random_string
+
+
+def recv_all(sock, size):
+    chunks = []
+    while size:
+        data = sock.recv(size)
+        if not data:
+            break
+        chunks.append(data)
+        size -= len(data)
+    return b''.join(chunks)
+
+
+class SendallSocket(object):
+    """Socket without sendmsg."""
+    def __init__(self):
+        self.sent = b''
+
+    def sendall(self, data):
+        self.sent += data
+
+    def close(self):
+        pass
+
+
+class PartialSocket(SendallSocket):
+    """Socket sending at most 7 bytes of the first 3 buffers a call."""
+    def sendmsg(self, buffers):
+        data = b''.join(buf.tobytes() for buf in buffers[:3])[:7]
+        self.sent += data
+        return len(data)
+
+
+class EncodedSocketTest(TestUtilsMixin, unittest.TestCase):
+    def setUp(self):
+        a, b = socket.socketpair()
+        a.settimeout(5)
+        b.settimeout(5)
+        self.sender = EncodedSocket(a)
+        self.receiver = EncodedSocket(b)
+
+    def tearDown(self):
+        self.sender.close()
+        self.receiver.close()
+
+    def test_messages(self):
+        messages = [TEXT[i:i + 100] for i in range(0, 1000, 100)]
+        for message in messages:
+            self.sender.sendall(message)
+            # Each message can be decoded as soon as it is sent
+            self.assertEqual(recv_all(self.receiver, len(message)), message)
+
+    def test_messages_share_window(self):
+        self.sender.sendall(TEXT)
+        raw = self.receiver.sock.recv(len(TEXT))
+        self.sender.sendall(TEXT)
+        repeated = self.receiver.sock.recv(len(TEXT))
+        self.assertLess(len(repeated), len(raw) // 4)
+
+        parser = framing._MemberParser()
+        self.assertEqual(parser.feed(raw) + parser.feed(repeated), TEXT * 2)
+
+    def test_batched_messages(self):
+        for line in TEXT.splitlines(True):
+            self.sender.write(line)
+            self.sender.end_message()
+        self.sender.flush()
+        self.assertEqual(recv_all(self.receiver, len(TEXT)), TEXT)
+
+    def test_large_data(self):
+        contents = random_string(300000).encode('ascii')
+        received = []
+        thread = threading.Thread(target=lambda: received.append(
+            recv_all(self.receiver, len(contents) + 1)))
+        thread.start()
+
+        self.sender.write(contents)
+        self.sender.close()
+        thread.join()
+        self.assertEqual(received, [contents])
+
+    def test_largest_window(self):
+        sender = EncodedSocket(SendallSocket(), window_sz2=15,
+                               lookahead_sz2=8)
+        for line in TEXT.splitlines(True):
+            sender.write(line)
+            sender.end_message()
+        sender.flush()
+        self.assertEqual(framing._MemberParser().feed(sender.sock.sent), TEXT)
+
+    def test_max_member_size(self):
+        # A header claiming a huge member is rejected right away
+        header = framing.pack_header(framing.MAX_MEMBER_SIZE,
+                                     framing.MAX_MEMBER_SIZE, 11, 4)
+        self.sender.sock.sendall(header)
+        self.assertRaises(IOError, self.receiver.recv, 100)
+
+        parser = framing._MemberParser(max_member_size=100)
+        self.assertEqual(parser.feed(framing.encode_member(TEXT[:100])),
+                         TEXT[:100])
+        self.assertRaises(IOError, parser.feed,
+                          framing.encode_member(TEXT[:101]))
+        self.assertRaises(ValueError, framing._MemberParser, 0)
+
+    def test_larger_members_than_received(self):
+        a, b = socket.socketpair()
+        sender = EncodedSocket(a)
+        receiver = EncodedSocket(b, member_size=100)
+        try:
+            sender.sendall(TEXT[:100])
+            self.assertEqual(recv_all(receiver, 100), TEXT[:100])
+            sender.sendall(TEXT)
+            self.assertRaises(IOError, receiver.recv, 100)
+        finally:
+            sender.close()
+            receiver.close()
+
+        a, b = socket.socketpair()
+        sender = EncodedSocket(a)
+        receiver = EncodedSocket(b, member_size=100, max_member_size=1000)
+        try:
+            sender.sendall(TEXT)
+            self.assertEqual(recv_all(receiver, len(TEXT)), TEXT)
+        finally:
+            sender.close()
+            receiver.close()
+
+    def test_partial_sends(self):
+        for sock in (PartialSocket(), SendallSocket()):
+            encoded = EncodedSocket(sock)
+            for line in TEXT.splitlines(True):
+                encoded.write(line)
+                encoded.end_message()
+            encoded.flush()
+            self.assertEqual(framing._MemberParser().feed(sock.sent), TEXT)
+
+    def test_truncated_stream(self):
+        data = framing.encode_member(TEXT)
+        self.sender.sock.sendall(data[:-1])
+        self.sender.sock.close()
+        self.assertRaises(IOError, self.receiver.recv, 100)
+
+    def test_closed(self):
+        self.sender.close()
+        self.sender.close()
+        self.assertRaises(ValueError, self.sender.sendall, TEXT)
+        self.assertEqual(self.receiver.recv(100), b'')
+
+
+class FakeTransport(_Transport):
+    def __init__(self):
+        super(FakeTransport, self).__init__()
+        self.calls = []
+        self.closed = False
+
+    def writelines(self, chunks):
+        self.calls.append(b''.join(chunks))
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def close(self):
+        self.closed = True
+
+
+class App(_Protocol):
+    def __init__(self):
+        self.received = b''
+        self.eof = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.received += data
+
+    def eof_received(self):
+        self.eof = True
+
+
+@unittest.skipIf(asyncio is None, 'asyncio is not available')
+class EncodedProtocolTest(TestUtilsMixin, unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def _connect(self, app, **params):
+        protocol = EncodedProtocol(app, **params)
+        transport = FakeTransport()
+        protocol.connection_made(transport)
+        return protocol, transport
+
+    def _run_once(self):
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    def test_writes_in_one_iteration_are_batched(self):
+        app = App()
+        _, transport = self._connect(app, window_sz2=10)
+        for line in TEXT.splitlines(True):
+            app.transport.write(line)
+        self.assertEqual(transport.calls, [])
+
+        self._run_once()
+        self.assertEqual(len(transport.calls), 1)
+        members = framing.read_index(io.BytesIO(transport.calls[0]))
+        self.assertEqual(len(members), 1)
+        self.assertEqual(members[0].window_sz2, 10)
+
+    def test_round_trip(self):
+        sender, receiver = App(), App()
+        _, transport = self._connect(sender)
+        protocol, _ = self._connect(receiver)
+
+        sender.transport.write(TEXT[:500])
+        self._run_once()
+        sender.transport.write(TEXT[500:])
+        sender.transport.close()
+        self.assertTrue(transport.closed)
+
+        # Received in arbitrary pieces
+        data = b''.join(transport.calls)
+        for i in range(0, len(data), 7):
+            protocol.data_received(data[i:i + 7])
+        protocol.eof_received()
+        self.assertEqual(receiver.received, TEXT)
+        self.assertTrue(receiver.eof)
+
+    def test_explicit_flush(self):
+        app = App()
+        _, transport = self._connect(app)
+        app.transport.write(TEXT)
+        app.transport.flush()
+        self.assertEqual(len(transport.calls), 1)
+        self._run_once()
+        self.assertEqual(len(transport.calls), 1)
+
+    def test_corrupt_data(self):
+        protocol, _ = self._connect(App())
+        self.assertRaises(IOError, protocol.data_received, b'x' * 100)
+
+        protocol, _ = self._connect(App())
+        self.assertRaises(IOError, protocol.data_received,
+                          framing.pack_header(1 << 30, 1 << 30, 11, 4))
+
+        protocol, _ = self._connect(App())
+        protocol.data_received(framing.encode_member(TEXT)[:-1])
+        self.assertRaises(IOError, protocol.eof_received)
+
+    def test_over_socket(self):
+        a, b = socket.socketpair()
+        receiver = EncodedSocket(b)
+        receiver.sock.settimeout(5)
+        app = App()
+
+        self.loop.run_until_complete(self.loop.create_connection(
+            lambda: EncodedProtocol(app), sock=a))
+        app.transport.write(TEXT)
+        self._run_once()
+        app.transport.close()
+        self._run_once()
+        self.assertEqual(recv_all(receiver, len(TEXT) + 1), TEXT)
+        receiver.close()
@@ -1,6 +1,10 @@
+import io
 import random
 import string
 
+from heatshrink.core import Encoder
+from heatshrink.streams import EncodedFile
+
 
 class TestUtilsMixin(object):
     """Mixin that provides extra testing utilities."""
@@ -24,3 +28,33 @@ def random_string(size):
     """
     choices = string.ascii_lowercase + string.ascii_uppercase + string.digits + '\n'
     return ''.join(random.choice(choices) for _ in range(size))
+
+
+def stream(coder, data, chunk_size):
+    """Run data through a Writer or Reader in chunks of chunk_size."""
+    encoder = Encoder(coder)
+    output = [encoder.fill(data[i:i + chunk_size])
+              for i in range(0, len(data), chunk_size)]
+    output.append(encoder.finish())
+    return b''.join(output)
+
+
+def write_file(data, chunk_size, **kwargs):
+    """Return the contents of an EncodedFile that data was written to."""
+    dst = io.BytesIO()
+    with EncodedFile(dst, 'wb', **kwargs) as fp:
+        for i in range(0, len(data), chunk_size):
+            fp.write(data[i:i + chunk_size])
+    return dst.getvalue()
+
+
+def read_file(encoded, chunk_size, **kwargs):
+    """Return the data read from an EncodedFile in chunks."""
+    chunks = []
+    with EncodedFile(io.BytesIO(encoded), **kwargs) as fp:
+        while True:
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return b''.join(chunks)